@@ -0,0 +1,6 @@
+'''
+Benchmarks of the client against a local stand-in for a Geo Engine instance
+
+Run `python -m benchmarks run` to measure all scenarios and `python -m benchmarks compare OLD NEW`
+to compare the recorded results of two releases.
+'''
@@ -0,0 +1,83 @@
+'''
+Command line interface of the benchmarks
+'''
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+import geoengine as ge
+
+from benchmarks.server import StandInServer
+from benchmarks.suite import IMPORT_SCENARIO, SCENARIOS, BenchmarkResult, compare_results, read_results, \
+    run_benchmarks, write_results
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _print_result(result: BenchmarkResult) -> None:
+    peak_rss = f'{result.peak_rss_bytes / 2**20:8.1f} MiB' if result.peak_rss_bytes is not None else '       n/a'
+    print(f'{result.scenario:<18} {result.size:>6}  p50 {result.p50_seconds * 1000:9.2f} ms  '
+          f'p95 {result.p95_seconds * 1000:9.2f} ms  {result.throughput_bytes_per_second / 2**20:8.1f} MiB/s  '
+          f'{result.calls_per_second:8.1f} calls/s  peak RSS {peak_rss}')
+
+
+def _run(args: argparse.Namespace) -> int:
+    '''Measure the scenarios against a stand-in server and write the results'''
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f'{ge.__version__}.json')
+
+    with StandInServer() as server:
+        results = run_benchmarks(server, args.scenario, repeats=args.repeats, quick=args.quick,
+                                 isolated=not args.in_process, report=_print_result)
+
+    write_results(results, output)
+    print(f'Wrote results to {output}')
+
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    '''Print the changes between two results files and fail if a scenario regressed'''
+
+    comparisons = compare_results(read_results(args.old), read_results(args.new), args.threshold)
+
+    for comparison in comparisons:
+        peak_rss = f'{comparison.peak_rss_ratio:6.2f}x' if comparison.peak_rss_ratio is not None else '   n/a'
+        marker = '  REGRESSION' if comparison.regressed else ''
+        print(f'{comparison.scenario:<18} {comparison.size:>6}  p50 {comparison.p50_ratio:6.2f}x  '
+              f'peak RSS {peak_rss}{marker}')
+
+    return 1 if any(comparison.regressed for comparison in comparisons) else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    '''Run the command of `argv` and return the exit code'''
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='measure the scenarios and record the results')
+    run.add_argument('--scenario', action='append', choices=[IMPORT_SCENARIO, *SCENARIOS],
+                     help='measure only this scenario, can be repeated')
+    run.add_argument('--repeats', type=int, default=5, help='measured calls per scenario and size')
+    run.add_argument('--quick', action='store_true', help='measure only the smallest size of each scenario')
+    run.add_argument('--in-process', action='store_true',
+                     help='do not isolate the scenarios in processes of their own, the peak RSS is then shared')
+    run.add_argument('--output', help='the results file, by default results/<version>.json')
+    run.set_defaults(func=_run)
+
+    compare = commands.add_parser('compare', help='compare two results files and fail on regressions')
+    compare.add_argument('old', help='the results of the baseline')
+    compare.add_argument('new', help='the results to check')
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help='the tolerated relative growth of latency and peak RSS')
+    compare.set_defaults(func=_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+'''
+Measures `import geoengine` in a fresh interpreter
+
+Run `python -m benchmarks.probe` to print the seconds of the import and the peak RSS afterwards as JSON.
+Only the standard library is imported before the package.
+'''
+
+import json
+import sys
+import time
+from typing import Optional
+
+
+def peak_rss_bytes() -> Optional[int]:
+    '''Return the peak resident set size of this process'''
+
+    # Linux carries `ru_maxrss` over `exec`, so a spawned process would report the peak of its parent
+    try:
+        with open('/proc/self/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:  # not available on Windows
+        return None
+
+    # macOS reports bytes
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main() -> None:
+    '''Import the package and print the measurements'''
+
+    start = time.perf_counter()
+    import geoengine  # pylint: disable=import-outside-toplevel,unused-import
+    seconds = time.perf_counter() - start
+
+    json.dump({'seconds': seconds, 'peak_rss_bytes': peak_rss_bytes()}, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+'''
+A local HTTP stand-in for a Geo Engine instance that serves synthetic results
+
+Unlike `requests_mock`, the stand-in is reached through real sockets, so the benchmarks include connection
+handling, HTTP parsing and the transfer of the response bodies.
+'''
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from uuid import UUID, uuid4
+
+import numpy as np
+import rasterio.io
+from PIL import Image
+from rasterio.transform import from_origin
+
+SESSION_ID = 'c4983c3e-9b53-47ae-bda9-382223bd5081'
+
+RASTER_WORKFLOW_ID = UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62')
+
+LAYER_PROVIDER_ID = UUID('ac50ed0d-c9a0-41f8-9ce8-35fc9e38299b')
+
+
+@lru_cache(maxsize=8)
+def synthetic_geotiff(width: int, height: int, bounds: Tuple[float, float, float, float]) -> bytes:
+    '''Encode an uncompressed `uint16` GeoTiff of a gradient'''
+
+    (xmin, _ymin, xmax, ymax) = bounds
+    pixels = (np.arange(width * height, dtype=np.uint32) % 65521).astype(np.uint16).reshape(1, height, width)
+
+    with rasterio.io.MemoryFile() as memfile:
+        with memfile.open(driver='GTiff', width=width, height=height, count=1, dtype='uint16', crs='EPSG:4326',
+                          nodata=0, transform=from_origin(xmin, ymax, (xmax - xmin) / width,
+                                                          (ymax - bounds[1]) / height)) as dataset:
+            dataset.write(pixels)
+        return memfile.read()
+
+
+@lru_cache(maxsize=8)
+def synthetic_png(width: int, height: int) -> bytes:
+    '''Encode an RGBA PNG of a gradient'''
+
+    gradient = np.linspace(0, 255, width * height, dtype=np.float64).astype(np.uint8).reshape(height, width)
+    pixels = np.stack([gradient, gradient[::-1], np.full_like(gradient, 128), np.full_like(gradient, 255)], axis=-1)
+
+    buffer = BytesIO()
+    Image.fromarray(pixels, mode='RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=8)
+def synthetic_feature_collection(count: int) -> bytes:
+    '''Encode a GeoJSON feature collection of `count` points with two attributes'''
+
+    rng = np.random.default_rng(count)
+    coordinates = rng.uniform((-180.0, -90.0), (180.0, 90.0), size=(count, 2))
+
+    return json.dumps({
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                'properties': {'value': i, 'name': f'feature {i}'},
+                'when': {'start': '2014-04-01T00:00:00+00:00', 'end': '2014-04-02T00:00:00+00:00'},
+            }
+            for (i, (x, y)) in enumerate(coordinates.tolist())
+        ],
+    }).encode()
+
+
+class StandInState:  # pylint: disable=too-many-instance-attributes
+    '''
+    The synthetic resources of a stand-in server
+
+    Resumable uploads follow the tus protocol and are created at `resumable_upload_path`. Set `dropped_parts` or
+    `corrupted_parts` to let parts fail by closing the connection without a response or by failing their checksum,
+    after `parts_before_failures` parts succeeded.
+    '''
+
+    vector_workflows: Dict[str, int]
+    tasks: Dict[str, int]
+    collections: Dict[str, int]
+    resumable_uploads: Dict[str, Tuple[int, bytearray]]
+    resumable_upload_path: str
+    parts_before_failures: int
+    dropped_parts: int
+    corrupted_parts: int
+    __lock: threading.Lock
+
+    def __init__(self) -> None:
+        '''Start without resources'''
+        self.vector_workflows = {}
+        self.tasks = {}
+        self.collections = {}
+        self.resumable_uploads = {}
+        self.resumable_upload_path = '/upload/tus'
+        self.parts_before_failures = 0
+        self.dropped_parts = 0
+        self.corrupted_parts = 0
+        self.__lock = threading.Lock()
+
+    def add_vector_workflow(self, feature_count: int) -> UUID:
+        '''Add a vector workflow whose WFS results have `feature_count` points'''
+        workflow_id = uuid4()
+        self.vector_workflows[str(workflow_id)] = feature_count
+        return workflow_id
+
+    def add_task(self, running_polls: int) -> UUID:
+        '''Add a task that reports to be running for `running_polls` status queries'''
+        task_id = uuid4()
+        self.tasks[str(task_id)] = running_polls
+        return task_id
+
+    def add_collection(self, item_count: int) -> str:
+        '''Add a layer collection with `item_count` layers'''
+        collection_id = str(uuid4())
+        self.collections[collection_id] = item_count
+        return collection_id
+
+    def take_failure(self) -> Optional[str]:
+        '''Return whether the next part is `dropped` or `corrupted` or None if it succeeds'''
+        with self.__lock:
+            if self.parts_before_failures > 0:
+                self.parts_before_failures -= 1
+                return None
+            if self.dropped_parts > 0:
+                self.dropped_parts -= 1
+                return 'dropped'
+            if self.corrupted_parts > 0:
+                self.corrupted_parts -= 1
+                return 'corrupted'
+            return None
+
+    def poll_task(self, task_id: str) -> bool:
+        '''Count a status query and return whether the task is still running'''
+        with self.__lock:
+            remaining = self.tasks.get(task_id, 0)
+            self.tasks[task_id] = max(remaining - 1, 0)
+            return remaining > 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''Serves the endpoints that the benchmarks use'''
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which would otherwise stall on delayed acknowledgements
+    disable_nagle_algorithm = True
+    server: StandInServer
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        '''Serve metadata, OGC services, task status and layer collections'''
+
+        url = urlparse(self.path)
+        query = {key: values[0] for (key, values) in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+        state = self.server.state
+
+        if parts[0] == 'workflow' and parts[-1] == 'metadata':
+            self.send_json(self.__result_descriptor(parts[1]))
+        elif parts[0] == 'wcs':
+            self.send_body(self.__coverage(query), 'image/tiff')
+        elif parts[0] == 'wms':
+            self.send_body(synthetic_png(int(query['width']), int(query['height'])), 'image/png')
+        elif parts[0] == 'wfs' and parts[1] in state.vector_workflows:
+            self.send_body(synthetic_feature_collection(state.vector_workflows[parts[1]]), 'application/json')
+        elif parts[0] == 'tasks' and parts[-1] == 'status':
+            if state.poll_task(parts[1]):
+                self.send_json({'status': 'running', 'pct_complete': '50.00%', 'time_estimate': '? (± ?)',
+                                'info': None})
+            else:
+                self.send_json({'status': 'completed', 'info': None, 'timeTotal': '00:00:01'})
+        elif parts[:2] == ['layers', 'collections'] and len(parts) == 4 and parts[3] in state.collections:
+            self.send_json(self.__collection_page(parts[3], int(query['offset']), int(query['limit'])))
+        else:
+            self.send_json({'error': 'NotFound', 'message': f'{url.path} does not exist'}, status=404)
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        '''Serve sessions, uploads and dataset creation'''
+
+        # the body must be consumed to keep the connection usable
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            self.__read_chunked_body()
+        else:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        path = urlparse(self.path).path
+        if path == '/anonymous':
+            self.send_json({'id': SESSION_ID, 'project': None, 'view': None})
+        elif path == self.server.state.resumable_upload_path:
+            upload_id = str(uuid4())
+            self.server.state.resumable_uploads[upload_id] = (int(self.headers['Upload-Length']), bytearray())
+            self.send_tus(201, {'Location': f'{path}/{upload_id}'})
+        elif path in ('/upload', '/dataset'):
+            self.send_json({'id': str(uuid4())})
+        else:
+            self.send_json({'error': 'NotFound', 'message': f'{path} does not exist'}, status=404)
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        '''Report the offset of a resumable upload'''
+
+        upload = self.server.state.resumable_uploads.get(urlparse(self.path).path.split('/')[-1])
+        if upload is None:
+            self.send_tus(404)
+            return
+
+        (length, content) = upload
+        self.send_tus(200, {'Upload-Offset': str(len(content)), 'Upload-Length': str(length),
+                            'Cache-Control': 'no-store'})
+
+    def do_PATCH(self) -> None:  # pylint: disable=invalid-name
+        '''Append a part with a SHA-256 checksum to a resumable upload'''
+
+        part = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        upload = self.server.state.resumable_uploads.get(urlparse(self.path).path.split('/')[-1])
+        if upload is None:
+            self.send_tus(404)
+            return
+
+        (length, content) = upload
+        if int(self.headers['Upload-Offset']) != len(content) or len(content) + len(part) > length:
+            self.send_tus(409)
+            return
+
+        failure = self.server.state.take_failure()
+        if failure == 'dropped':
+            self.close_connection = True
+            return
+        if failure == 'corrupted':
+            part = part[1:]
+
+        (algorithm, checksum) = self.headers['Upload-Checksum'].split(' ')
+        if algorithm != 'sha256' or base64.b64decode(checksum) != hashlib.sha256(part).digest():
+            self.send_tus(460)
+            return
+
+        content.extend(part)
+        self.send_tus(204, {'Upload-Offset': str(len(content))})
+
+    def __read_chunked_body(self) -> int:
+        '''Consume a body with chunked transfer encoding and return its size'''
+
+        size = 0
+        while True:
+            chunk_size = int(self.rfile.readline().split(b';')[0], 16)
+            if chunk_size == 0:
+                # skip the trailers up to the final empty line
+                while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return size
+
+            self.rfile.read(chunk_size)
+            self.rfile.readline()
+            size += chunk_size
+
+    def __result_descriptor(self, workflow_id: str) -> Dict[str, Any]:
+        '''Describe a vector workflow of the state or otherwise the raster workflow'''
+
+        if workflow_id in self.server.state.vector_workflows:
+            return {
+                'type': 'vector',
+                'dataType': 'MultiPoint',
+                'spatialReference': 'EPSG:4326',
+                'columns': {
+                    'value': {'dataType': 'int', 'measurement': {'type': 'unitless'}},
+                    'name': {'dataType': 'text', 'measurement': {'type': 'unitless'}},
+                },
+            }
+
+        return {
+            'type': 'raster',
+            'dataType': 'U16',
+            'spatialReference': 'EPSG:4326',
+            'measurement': {'type': 'unitless'},
+        }
+
+    @staticmethod
+    def __coverage(query: Dict[str, str]) -> bytes:
+        '''Encode a coverage of the bounding box and resolution of a `GetCoverage` query'''
+
+        # EPSG:4326 uses the OGC axis order, so the resolutions are swapped as well
+        [ymin, xmin, ymax, xmax] = [float(v) for v in query['boundingbox'].split(',')]
+        x_resolution = abs(float(query['resy']))
+        y_resolution = abs(float(query['resx']))
+
+        width = round((xmax - xmin) / x_resolution)
+        height = round((ymax - ymin) / y_resolution)
+
+        return synthetic_geotiff(width, height, (xmin, ymin, xmax, ymax))
+
+    def __collection_page(self, collection_id: str, offset: int, limit: int) -> Dict[str, Any]:
+        '''Return a page of the layers of a collection'''
+
+        count = self.server.state.collections[collection_id]
+
+        return {
+            'id': {'collectionId': collection_id, 'providerId': str(LAYER_PROVIDER_ID)},
+            'name': 'Benchmark',
+            'description': f'{count} layers',
+            'entryLabel': None,
+            'properties': [],
+            'items': [
+                {
+                    'type': 'layer',
+                    'id': {'layerId': f'layer-{i}', 'providerId': str(LAYER_PROVIDER_ID)},
+                    'name': f'Layer {i}',
+                    'description': f'Layer {i} of the benchmark',
+                }
+                for i in range(offset, min(offset + limit, count))
+            ],
+        }
+
+    def send_tus(self, status: int, headers: Optional[Dict[str, str]] = None) -> None:
+        '''Send an empty response of the tus protocol'''
+        self.send_response(status)
+        for (name, value) in {'Tus-Resumable': '1.0.0', 'Content-Length': '0', **(headers or {})}.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def send_json(self, body: Any, status: int = 200) -> None:
+        '''Send a JSON response'''
+        self.send_body(json.dumps(body).encode(), 'application/json', status)
+
+    def send_body(self, content: bytes, content_type: str, status: int = 200) -> None:
+        '''Send a response that keeps the connection alive'''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    '''
+    A Geo Engine stand-in that listens on a free local port and serves requests on a background thread
+
+    Use it as a context manager or call `start` and `stop`.
+    '''
+
+    daemon_threads = True
+
+    state: StandInState
+    __thread: Optional[threading.Thread] = None
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        '''Bind the server to `host` and `port`, where port 0 picks a free port'''
+        super().__init__((host, port), StandInHandler)
+        self.state = StandInState()
+
+    def __enter__(self) -> StandInServer:
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        '''The base url of the server'''
+        (host, port) = self.server_address[:2]
+        return f'http://{host!s}:{port}'
+
+    def start(self) -> None:
+        '''Serve requests on a background thread'''
+        self.__thread = threading.Thread(target=self.serve_forever, name='geoengine-stand-in', daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        '''Stop serving requests and close the socket'''
+        if self.__thread is not None:
+            self.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.server_close()
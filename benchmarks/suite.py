@@ -0,0 +1,363 @@
+'''
+Benchmark scenarios, their measurement and the recorded results
+'''
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+import geoengine as ge
+from geoengine.layers import LayerCollectionId, LayerProviderId
+from geoengine.tasks import Task, TaskId
+
+from benchmarks.probe import peak_rss_bytes
+from benchmarks.server import LAYER_PROVIDER_ID, RASTER_WORKFLOW_ID, StandInServer, StandInState
+
+TIME = ge.TimeInterval(datetime(2014, 4, 1, 12, tzinfo=timezone.utc))
+
+WORLD = ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0)
+
+
+class Scenario(NamedTuple):
+    '''
+    A benchmarked call at several payload sizes
+
+    `setup` runs in the benchmark process and creates the synthetic resources of a size on the server.
+    It returns the parameters for `build`, which runs in the measured process and returns the call to measure.
+    '''
+
+    name: str
+    operation: str
+    sizes: Tuple[int, ...]
+    setup: Callable[[StandInState, int, int], Dict[str, Any]]
+    build: Callable[[Dict[str, Any]], Callable[[], Any]]
+
+
+def _no_setup(_state: StandInState, size: int, _calls: int) -> Dict[str, Any]:
+    return {'size': size}
+
+
+def _build_get_array(params: Dict[str, Any]) -> Callable[[], Any]:
+    '''Query a square coverage of the world with `size` rows and columns'''
+
+    side = params['size']
+    workflow = ge.workflow_by_id(RASTER_WORKFLOW_ID)
+    query = ge.QueryRectangle(WORLD, TIME, ge.SpatialResolution(360.0 / side, 180.0 / side))
+
+    return lambda: workflow.get_array(query)
+
+
+def _setup_get_dataframe(state: StandInState, size: int, _calls: int) -> Dict[str, Any]:
+    return {'workflow_id': str(state.add_vector_workflow(size))}
+
+
+def _build_get_dataframe(params: Dict[str, Any]) -> Callable[[], Any]:
+    '''Query all features of the vector workflow'''
+
+    workflow = ge.workflow_by_id(params['workflow_id'])
+    query = ge.QueryRectangle(WORLD, TIME, ge.SpatialResolution(0.1, 0.1))
+
+    return lambda: workflow.get_dataframe(query)
+
+
+def _point_dataframe(rows: int) -> Any:
+    '''Create a point data frame with `rows` rows'''
+
+    # only the upload scenarios pay for importing geopandas
+    import geopandas as gpd  # pylint: disable=import-outside-toplevel
+
+    rng = np.random.default_rng(rows)
+    coordinates = rng.uniform((-180.0, -90.0), (180.0, 90.0), size=(rows, 2))
+
+    return gpd.GeoDataFrame(
+        {'value': np.arange(rows), 'measurement': rng.normal(size=rows)},
+        geometry=gpd.points_from_xy(coordinates[:, 0], coordinates[:, 1]),
+        crs='EPSG:4326',
+    )
+
+
+def _build_upload_dataframe(params: Dict[str, Any]) -> Callable[[], Any]:
+    '''Upload a point data frame with `size` rows'''
+
+    data = _point_dataframe(params['size'])
+
+    return lambda: ge.upload_dataframe(data)
+
+
+def _build_upload_dataframes(params: Dict[str, Any]) -> Callable[[], Any]:
+    '''Upload `size` point data frames with 5000 rows each as a batch'''
+
+    data = [_point_dataframe(5000)] * params['size']
+
+    return lambda: ge.upload_dataframes(data)
+
+
+def _setup_layer_collection(state: StandInState, size: int, _calls: int) -> Dict[str, Any]:
+    return {'collection_id': state.add_collection(size)}
+
+
+def _build_layer_collection(params: Dict[str, Any]) -> Callable[[], Any]:
+    '''Retrieve all pages of the layer collection'''
+
+    collection_id = LayerCollectionId(params['collection_id'])
+
+    return lambda: ge.layer_collection(collection_id, LayerProviderId(LAYER_PROVIDER_ID))
+
+
+def _setup_wait_for_finish(state: StandInState, size: int, calls: int) -> Dict[str, Any]:
+    # every call needs a task of its own, since the status of a task advances with each query
+    return {'task_ids': [str(state.add_task(size)) for _ in range(calls)]}
+
+
+def _build_wait_for_finish(params: Dict[str, Any]) -> Callable[[], Any]:
+    '''Wait for the next unused task'''
+
+    tasks = iter([Task(TaskId(UUID(task_id))) for task_id in params['task_ids']])
+
+    return lambda: next(tasks).wait_for_finish(check_interval_seconds=0, print_status=False)
+
+
+IMPORT_SCENARIO = 'import'
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in [
+    # the size is the number of rows and columns
+    Scenario('get_array', 'get_array', (256, 1024, 2048), _no_setup, _build_get_array),
+    # the size is the number of features
+    Scenario('get_dataframe', 'get_dataframe', (1000, 10000, 50000), _setup_get_dataframe, _build_get_dataframe),
+    Scenario('upload_dataframe', 'upload_dataframe', (1000, 10000, 50000), _no_setup, _build_upload_dataframe),
+    # the size is the number of data frames in the batch
+    Scenario('upload_dataframes', 'upload_dataframes', (4, 16, 64), _no_setup, _build_upload_dataframes),
+    # the size is the number of layers in the collection
+    Scenario('layer_collection', 'layer_collection', (20, 200, 1000), _setup_layer_collection,
+             _build_layer_collection),
+    # the size is the number of status queries while the task is running
+    Scenario('wait_for_finish', 'task_status', (1, 10, 50), _setup_wait_for_finish, _build_wait_for_finish),
+]}
+
+
+class BenchmarkResult(NamedTuple):
+    '''The measurements of a scenario at one payload size'''
+
+    scenario: str
+    size: int
+    repeats: int
+    mean_seconds: float
+    p50_seconds: float
+    p95_seconds: float
+    min_seconds: float
+    max_seconds: float
+    bytes_per_call: float
+    throughput_bytes_per_second: float
+    calls_per_second: float
+    peak_rss_bytes: Optional[int]
+
+
+def measure(server_url: str, scenario_name: str, size: int, params: Dict[str, Any], repeats: int) -> BenchmarkResult:
+    '''
+    Measure a scenario in the current process
+
+    The call is run once to warm up the connection and the caches of the process and then `repeats` times.
+    '''
+
+    scenario = SCENARIOS[scenario_name]
+
+    ge.initialize(server_url)
+    collector = ge.HistogramCollector()
+
+    try:
+        call = scenario.build(params)
+        call()
+
+        ge.get_session().add_instrument(collector)
+
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        ge.reset(False)
+
+    bytes_per_call = sum(collector.counter(scenario.operation, counter)
+                         for counter in ('bytes_received', 'bytes_sent')) / repeats
+    mean = float(np.mean(latencies))
+
+    return BenchmarkResult(
+        scenario=scenario_name,
+        size=size,
+        repeats=repeats,
+        mean_seconds=mean,
+        p50_seconds=float(np.percentile(latencies, 50)),
+        p95_seconds=float(np.percentile(latencies, 95)),
+        min_seconds=min(latencies),
+        max_seconds=max(latencies),
+        bytes_per_call=bytes_per_call,
+        throughput_bytes_per_second=bytes_per_call / mean if mean > 0 else 0.0,
+        calls_per_second=1.0 / mean if mean > 0 else 0.0,
+        peak_rss_bytes=peak_rss_bytes(),
+    )
+
+
+def measure_import(repeats: int) -> BenchmarkResult:
+    '''
+    Measure `import geoengine` in `repeats` fresh interpreters
+
+    The peak RSS is the largest one of the interpreters.
+    '''
+
+    samples = []
+    for _ in range(repeats):
+        probe = subprocess.run([sys.executable, '-m', 'benchmarks.probe'], capture_output=True, check=True, text=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        samples.append(json.loads(probe.stdout))
+
+    latencies = [sample['seconds'] for sample in samples]
+    peak_rss = [sample['peak_rss_bytes'] for sample in samples if sample['peak_rss_bytes'] is not None]
+    mean = float(np.mean(latencies))
+
+    return BenchmarkResult(
+        scenario=IMPORT_SCENARIO,
+        size=0,
+        repeats=repeats,
+        mean_seconds=mean,
+        p50_seconds=float(np.percentile(latencies, 50)),
+        p95_seconds=float(np.percentile(latencies, 95)),
+        min_seconds=min(latencies),
+        max_seconds=max(latencies),
+        bytes_per_call=0.0,
+        throughput_bytes_per_second=0.0,
+        calls_per_second=1.0 / mean if mean > 0 else 0.0,
+        peak_rss_bytes=max(peak_rss) if peak_rss else None,
+    )
+
+
+def run_benchmarks(server: StandInServer,  # pylint: disable=too-many-arguments
+                   scenario_names: Optional[Iterable[str]] = None,
+                   repeats: int = 5,
+                   quick: bool = False,
+                   isolated: bool = True,
+                   report: Optional[Callable[[BenchmarkResult], None]] = None) -> List[BenchmarkResult]:
+    '''
+    Measure scenarios against a running stand-in `server`
+
+    The `import` scenario measures `import geoengine` in fresh interpreters, all others call the `server`.
+    If `quick` is True, only the smallest size of each scenario is measured. If `isolated` is True, every
+    scenario and size runs in a fresh process, so that the peak RSS belongs to it alone.
+    '''
+
+    results = []
+
+    for name in scenario_names if scenario_names is not None else [IMPORT_SCENARIO, *SCENARIOS]:
+        if name == IMPORT_SCENARIO:
+            result = measure_import(repeats)
+            if report is not None:
+                report(result)
+            results.append(result)
+            continue
+
+        scenario = SCENARIOS[name]
+
+        for size in scenario.sizes[:1] if quick else scenario.sizes:
+            params = scenario.setup(server.state, size, repeats + 1)
+
+            if isolated:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(measure, server.url, name, size, params, repeats).result()
+            else:
+                result = measure(server.url, name, size, params, repeats)
+
+            if report is not None:
+                report(result)
+            results.append(result)
+
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    '''Return the commit of the working directory, if it is a git repository'''
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results: Sequence[BenchmarkResult], path: str) -> None:
+    '''Write the results together with the version of the library and the environment to `path`'''
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({
+            'version': ge.__version__,
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': [result._asdict() for result in results],
+        }, file, indent=2)
+
+
+def read_results(path: str) -> List[BenchmarkResult]:
+    '''Read the results that were written by `write_results`'''
+
+    with open(path, encoding='utf-8') as file:
+        return [BenchmarkResult(**result) for result in json.load(file)['results']]
+
+
+class Comparison(NamedTuple):
+    '''The change of a scenario between two recorded runs, as ratios of new to old values'''
+
+    scenario: str
+    size: int
+    p50_ratio: float
+    peak_rss_ratio: Optional[float]
+    regressed: bool
+
+
+def compare_results(old: Sequence[BenchmarkResult],
+                    new: Sequence[BenchmarkResult],
+                    threshold: float = 0.1) -> List[Comparison]:
+    '''
+    Compare the median latency and the peak RSS of the scenarios that were measured in both runs
+
+    A scenario regressed if one of them grew by more than `threshold`, e.g. by more than 10% for 0.1.
+    '''
+
+    old_by_key = {(result.scenario, result.size): result for result in old}
+
+    comparisons = []
+    for result in new:
+        previous = old_by_key.get((result.scenario, result.size))
+        if previous is None:
+            continue
+
+        p50_ratio = result.p50_seconds / previous.p50_seconds if previous.p50_seconds > 0 else 1.0
+        peak_rss_ratio = None
+        if result.peak_rss_bytes is not None and previous.peak_rss_bytes:
+            peak_rss_ratio = result.peak_rss_bytes / previous.peak_rss_bytes
+
+        comparisons.append(Comparison(
+            scenario=result.scenario,
+            size=result.size,
+            p50_ratio=p50_ratio,
+            peak_rss_ratio=peak_rss_ratio,
+            regressed=p50_ratio > 1.0 + threshold or (peak_rss_ratio or 0.0) > 1.0 + threshold,
+        ))
+
+    return comparisons
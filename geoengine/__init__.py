@@ -1,32 +1,121 @@
-'''Entry point for Geo Engine Python Library'''
+'''
+Entry point for Geo Engine Python Library
+
+The submodules are imported on first access of one of their attributes, so that `import geoengine` is fast and
+heavy dependencies like geopandas, rasterio, xarray or matplotlib are only loaded when they are used.
+'''
+
+from functools import lru_cache
+from importlib import import_module
+from typing import TYPE_CHECKING, Any, Dict, List
 
-from pkg_resources import get_distribution
 from requests import utils
 
-from .auth import Session, get_session, initialize, reset
-from .colorizer import Colorizer, ColorBreakpoint, LinearGradientColorizer, PaletteColorizer, \
-    LogarithmicGradientColorizer
-from .datasets import upload_dataframe, StoredDataset, add_public_raster_dataset, volumes, DatasetProperties, \
-    delete_dataset
-from .error import GeoEngineException, InputException, UninitializedException, TypeException, \
-    MethodNotCalledOnPlotException, MethodNotCalledOnRasterException, MethodNotCalledOnVectorException, \
-    SpatialReferenceMismatchException, check_response_for_error, ModificationNotOnLayerDbException, \
-    NoAdminSessionException
-from .layers import Layer, LayerCollection, LayerListing, LayerCollectionListing, \
-    LayerId, LayerCollectionId, LayerProviderId, \
-    layer_collection, layer
-from .types import QueryRectangle,  \
-    RasterResultDescriptor, Provenance, UnitlessMeasurement, ContinuousMeasurement, \
-    ClassificationMeasurement, BoundingBox2D, TimeInterval, SpatialResolution, SpatialPartition2D, \
-    RasterSymbology, VectorSymbology
-from .workflow import WorkflowId, Workflow, workflow_by_id, register_workflow
+if TYPE_CHECKING:
+    from .auth import Session, get_session, initialize, reset
+    from .transport import ConnectionPoolConfig, RetryPolicy, RetryEvent
+    from .cache import ResultCache, CacheStats, enable_result_cache, disable_result_cache, get_result_cache
+    from .catalog import LayerCatalog, CatalogEntry, CrawlStats, CrawlError
+    from .http_cache import HttpCache, HttpCacheStats
+    from .colorizer import Colorizer, ColorBreakpoint, LinearGradientColorizer, PaletteColorizer, \
+        LogarithmicGradientColorizer
+    from .coverage import RasterCoverage
+    from .datasets import upload_dataframe, upload_dataframes, UploadResult, upload_file_resumable, \
+        ResumableUploadState, StoredDataset, add_public_raster_dataset, volumes, DatasetProperties, delete_dataset
+    from .error import GeoEngineException, InputException, UninitializedException, TypeException, \
+        MethodNotCalledOnPlotException, MethodNotCalledOnRasterException, MethodNotCalledOnVectorException, \
+        SpatialReferenceMismatchException, check_response_for_error, ModificationNotOnLayerDbException, \
+        NoAdminSessionException
+    from .instrumentation import Instrument, OperationStart, OperationEnd, Histogram, HistogramCollector, \
+        OtlpJsonFileExporter
+    from .layers import Layer, LayerCollection, LayerListing, LayerCollectionListing, \
+        LayerId, LayerCollectionId, LayerProviderId, \
+        layer_collection, layer_collection_items, layer
+    from .tiles import Tile, TileGrid, WEB_MERCATOR, WORLD_CRS84_QUAD, write_mbtiles, write_png_directory
+    from .types import QueryRectangle,  \
+        RasterResultDescriptor, Provenance, UnitlessMeasurement, ContinuousMeasurement, \
+        ClassificationMeasurement, BoundingBox2D, TimeInterval, SpatialResolution, SpatialPartition2D, \
+        RasterSymbology, VectorSymbology
+    from .workflow import WorkflowId, Workflow, workflow_by_id, register_workflow, register_workflows, \
+        resolve_result_descriptors, VectorResultFormat
+    from .workflow_registry import WorkflowRegistry, set_workflow_store, get_workflow_registry
+
+_EXPORTS: Dict[str, List[str]] = {
+    'auth': ['Session', 'get_session', 'initialize', 'reset'],
+    'transport': ['ConnectionPoolConfig', 'RetryPolicy', 'RetryEvent'],
+    'cache': ['ResultCache', 'CacheStats', 'enable_result_cache', 'disable_result_cache', 'get_result_cache'],
+    'catalog': ['LayerCatalog', 'CatalogEntry', 'CrawlStats', 'CrawlError'],
+    'http_cache': ['HttpCache', 'HttpCacheStats'],
+    'colorizer': ['Colorizer', 'ColorBreakpoint', 'LinearGradientColorizer', 'PaletteColorizer',
+                  'LogarithmicGradientColorizer'],
+    'coverage': ['RasterCoverage'],
+    'datasets': ['upload_dataframe', 'upload_dataframes', 'UploadResult', 'upload_file_resumable',
+                 'ResumableUploadState', 'StoredDataset', 'add_public_raster_dataset', 'volumes', 'DatasetProperties',
+                 'delete_dataset'],
+    'error': ['GeoEngineException', 'InputException', 'UninitializedException', 'TypeException',
+              'MethodNotCalledOnPlotException', 'MethodNotCalledOnRasterException',
+              'MethodNotCalledOnVectorException', 'SpatialReferenceMismatchException', 'check_response_for_error',
+              'ModificationNotOnLayerDbException', 'NoAdminSessionException'],
+    'instrumentation': ['Instrument', 'OperationStart', 'OperationEnd', 'Histogram', 'HistogramCollector',
+                        'OtlpJsonFileExporter'],
+    'layers': ['Layer', 'LayerCollection', 'LayerListing', 'LayerCollectionListing', 'LayerId', 'LayerCollectionId',
+               'LayerProviderId', 'layer_collection', 'layer_collection_items', 'layer'],
+    'tiles': ['Tile', 'TileGrid', 'WEB_MERCATOR', 'WORLD_CRS84_QUAD', 'write_mbtiles', 'write_png_directory'],
+    'types': ['QueryRectangle', 'RasterResultDescriptor', 'Provenance', 'UnitlessMeasurement',
+              'ContinuousMeasurement', 'ClassificationMeasurement', 'BoundingBox2D', 'TimeInterval',
+              'SpatialResolution', 'SpatialPartition2D', 'RasterSymbology', 'VectorSymbology'],
+    'workflow': ['WorkflowId', 'Workflow', 'workflow_by_id', 'register_workflow', 'register_workflows',
+                 'resolve_result_descriptors', 'VectorResultFormat'],
+    'workflow_registry': ['WorkflowRegistry', 'set_workflow_store', 'get_workflow_registry'],
+}
+
+_ATTRIBUTE_MODULES: Dict[str, str] = {
+    attribute: module for (module, attributes) in _EXPORTS.items() for attribute in attributes
+}
+
+_SUBMODULES = frozenset(['aio', 'api', 'tasks', 'tiff', *_EXPORTS])
+
+__all__ = ['DEFAULT_USER_AGENT', 'default_user_agent', *_ATTRIBUTE_MODULES]
+
+
+@lru_cache(maxsize=None)
+def _version() -> str:
+    '''Look up the installed version without scanning all distributions like `pkg_resources`'''
+
+    # pylint: disable=import-outside-toplevel
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python 3.7
+        from pkg_resources import get_distribution
+        return get_distribution('geoengine').version
+
+    return version('geoengine')
+
+
+def __getattr__(name: str) -> Any:
+    '''Import the submodule of an attribute on first access'''
+
+    if name in _ATTRIBUTE_MODULES:
+        value = getattr(import_module(f'.{_ATTRIBUTE_MODULES[name]}', __name__), name)
+    elif name in _SUBMODULES:
+        value = import_module(f'.{name}', __name__)
+    elif name == '__version__':
+        value = _version()
+    elif name == 'DEFAULT_USER_AGENT':
+        value = f'geoengine-python/{_version()}'
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    globals()[name] = value
+    return value
 
 
-DEFAULT_USER_AGENT = f'geoengine-python/{get_distribution("geoengine").version}'
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__) | _SUBMODULES | {'__version__'})
 
 
 def default_user_agent(_name="python-requests"):
-    return DEFAULT_USER_AGENT
+    return f'geoengine-python/{_version()}'
 
 
 utils.default_user_agent = default_user_agent
@@ -0,0 +1,512 @@
+'''
+An asyncio client for Geo Engine
+
+All requests of an `AsyncClient` share one connection pool and at most `max_concurrency` of them are in flight
+at the same time. Further requests wait for a free slot, so a single event loop can drive hundreds of concurrent
+queries without overwhelming the server. Decoding the results runs on a thread pool and does not block the loop.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import json
+import urllib.parse
+from io import BytesIO
+from logging import debug
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar, Union
+from uuid import UUID
+
+import geopandas as gpd
+import numpy as np
+import rasterio.io
+from owslib.util import ServiceException
+from PIL import Image
+
+from geoengine import api
+from geoengine.auth import Session, get_session
+from geoengine.colorizer import Colorizer
+from geoengine.error import GeoEngineException, InputException, MethodNotCalledOnRasterException, \
+    MethodNotCalledOnVectorException, check_ows_exception_report
+from geoengine.layers import DEFAULT_PAGE_SIZE, LAYER_DB_PROVIDER_ID, Layer, LayerCollection, LayerCollectionId, \
+    LayerId, LayerProviderId, _layer_collection_path
+from geoengine.tasks import TaskId, TaskStatus, TaskStatusInfo
+from geoengine.tiff import read_tiff_bands, read_tiff_layout
+from geoengine.types import QueryRectangle, ResultDescriptor
+from geoengine.workflow import VectorResultFormat, WorkflowId, _arrow_table_to_geopandas, _decode_arrow_table, \
+    _geo_json_with_time_to_geopandas, _is_unsupported_format_response, _wcs_params, _wfs_params, _wms_params
+
+try:
+    import httpx
+except ImportError as import_error:
+    raise ImportError('The asyncio client requires `httpx`, install it with `pip install geoengine[aio]`') \
+        from import_error
+
+T = TypeVar('T')
+
+
+class AsyncClient:
+    '''
+    An asynchronous HTTP client for the Geo Engine instance of a `Session`
+
+    The client owns a connection pool of at most `max_connections` connections and limits the number of
+    requests in flight to `max_concurrency`. It must be used by a single event loop and should be closed
+    with `aclose` or by using it as an async context manager.
+    '''
+
+    __session: Session
+    __http_client: httpx.AsyncClient
+    __max_concurrency: int
+    __semaphore: Optional[asyncio.Semaphore] = None
+
+    def __init__(self,
+                 session: Optional[Session] = None,
+                 max_concurrency: int = 64,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        '''
+        Create a client for `session`, which defaults to the current session
+
+        A custom `transport` replaces the pooled default transport, e.g., for testing.
+        '''
+        # pylint: disable=too-many-arguments
+
+        if max_concurrency < 1 or max_connections < 1:
+            raise InputException('max_concurrency and max_connections must be positive')
+
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from geoengine import default_user_agent
+
+        self.__session = session if session is not None else get_session()
+        self.__max_concurrency = max_concurrency
+        self.__http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections),
+            headers={'User-Agent': default_user_agent()},
+            transport=transport,
+        )
+
+    def __repr__(self) -> str:
+        return f'AsyncClient(server_url={self.server_url!r}, max_concurrency={self.__max_concurrency!r})'
+
+    async def __aenter__(self) -> AsyncClient:
+        return self
+
+    async def __aexit__(self,
+                        exc_type: Optional[Type[BaseException]],
+                        exc_value: Optional[BaseException],
+                        traceback: Optional[TracebackType]) -> None:
+        '''Close the client when leaving the context'''
+        await self.aclose()
+
+    @property
+    def session(self) -> Session:
+        '''The session whose credentials are used for all requests'''
+        return self.__session
+
+    @property
+    def server_url(self) -> str:
+        '''The server url of the session'''
+        return self.__session.server_url
+
+    @property
+    def max_concurrency(self) -> int:
+        '''The maximum number of requests in flight'''
+        return self.__max_concurrency
+
+    async def request(self, method: str, path: str, timeout: float = 60, **kwargs: Any) -> httpx.Response:
+        '''
+        Send a request to `path` on the server and read the response body
+
+        The request waits until fewer than `max_concurrency` requests are in flight.
+        '''
+
+        # the semaphore is bound to the running loop, so it is created on first use
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+
+        async with self.__semaphore:
+            return await self.__http_client.request(
+                method,
+                f'{self.server_url}{path}',
+                timeout=timeout,
+                **kwargs
+            )
+
+    async def aclose(self) -> None:
+        '''Close all pooled connections'''
+
+        await self.__http_client.aclose()
+
+
+class AsyncWorkflow:
+    '''
+    Holds a workflow id and allows querying data asynchronously
+    '''
+
+    __client: AsyncClient
+    __workflow_id: WorkflowId
+    __result_descriptor: Optional[asyncio.Future[ResultDescriptor]] = None
+
+    def __init__(self, client: AsyncClient, workflow_id: WorkflowId) -> None:
+        '''
+        Initialize a workflow
+
+        The result descriptor is queried on first use.
+        '''
+        self.__client = client
+        self.__workflow_id = workflow_id
+
+    def __str__(self) -> str:
+        return str(self.__workflow_id)
+
+    def __repr__(self) -> str:
+        return repr(self.__workflow_id)
+
+    async def __query_result_descriptor(self, timeout: int = 60) -> ResultDescriptor:
+        '''
+        Query the metadata of the workflow result
+        '''
+
+        response = await self.__client.request(
+            'GET',
+            f'/workflow/{self.__workflow_id}/metadata',
+            headers=self.__client.session.auth_header,
+            timeout=timeout,
+        )
+
+        _check_response(response)
+
+        response_json = response.json()
+
+        debug(response_json)
+
+        return ResultDescriptor.from_response(response_json)
+
+    async def get_result_descriptor(self, timeout: int = 60) -> ResultDescriptor:
+        '''
+        Return the metadata of the workflow result
+
+        It is queried once per workflow, even if many queries start at the same time. Failed queries are retried.
+        '''
+
+        future = self.__result_descriptor
+        if future is None or (future.done() and (future.cancelled() or future.exception() is not None)):
+            future = asyncio.ensure_future(self.__query_result_descriptor(timeout))
+            self.__result_descriptor = future
+
+        # a cancelled caller must not cancel the query for the other callers
+        return await asyncio.shield(future)
+
+    async def get_array(
+        self,
+        bbox: QueryRectangle,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None
+    ) -> np.ndarray:
+        '''
+        Query a workflow and return the raster result as a numpy array
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        timeout : HTTP request timeout in seconds
+        force_no_data_value: If not None, use this value as no data value for the requested raster data. \
+            Otherwise, use the Geo Engine will produce masked rasters.
+        '''
+
+        if not (await self.get_result_descriptor()).is_raster_result():
+            raise MethodNotCalledOnRasterException()
+
+        response = await self.__client.request(
+            'GET',
+            f'/wcs/{self.__workflow_id}',
+            params=_wcs_params(self.__workflow_id, bbox, 'image/tiff', force_no_data_value),
+            headers=self.__client.session.auth_header,
+            timeout=timeout,
+        )
+
+        _check_ows_response(response)
+
+        return await _run_in_executor(_read_first_band, response.content)
+
+    async def get_dataframe(
+        self,
+        bbox: QueryRectangle,
+        timeout: int = 3600,
+        output_format: VectorResultFormat = VectorResultFormat.GEOJSON
+    ) -> gpd.GeoDataFrame:
+        '''
+        Query a workflow and return the WFS result as a GeoPandas `GeoDataFrame`
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        timeout : HTTP request timeout in seconds
+        output_format : The encoding of the transferred result. The binary formats `ARROW` and `GEOPARQUET` \
+            require `pyarrow`. If the server cannot produce them, GeoJSON is used instead.
+        '''
+
+        if not (await self.get_result_descriptor()).is_vector_result():
+            raise MethodNotCalledOnVectorException()
+
+        response = await self.__request_wfs(bbox, output_format, timeout)
+
+        if output_format != VectorResultFormat.GEOJSON and _is_unsupported_format_response(response):
+            debug(f'WFS cannot produce {output_format.value}, falling back to GeoJSON: {response.text}')
+            output_format = VectorResultFormat.GEOJSON
+            response = await self.__request_wfs(bbox, output_format, timeout)
+
+        _check_response(response)
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+
+        if output_format == VectorResultFormat.GEOJSON or content_type == VectorResultFormat.GEOJSON.value:
+            return await _run_in_executor(
+                lambda content: _geo_json_with_time_to_geopandas(json.loads(content), bbox.srs),
+                response.content
+            )
+
+        return await _run_in_executor(
+            lambda content: _arrow_table_to_geopandas(_decode_arrow_table(content, output_format), bbox.srs),
+            response.content
+        )
+
+    async def __request_wfs(
+        self,
+        bbox: QueryRectangle,
+        output_format: VectorResultFormat,
+        timeout: int
+    ) -> httpx.Response:
+        '''Send a WFS GetFeature request for `output_format`'''
+
+        return await self.__client.request(
+            'GET',
+            f'/wfs/{self.__workflow_id}',
+            params=_wfs_params(self.__workflow_id, bbox, output_format),
+            headers=self.__client.session.auth_header,
+            timeout=timeout,
+        )
+
+    async def wms_get_map_as_image(self, bbox: QueryRectangle, colorizer: Colorizer, timeout: int = 3600) -> Image:
+        '''Return the result of a WMS request as a PIL Image'''
+
+        if not (await self.get_result_descriptor()).is_raster_result():
+            raise MethodNotCalledOnRasterException()
+
+        response = await self.__client.request(
+            'GET',
+            f'/wms/{self.__workflow_id}',
+            params=_wms_params(self.__workflow_id, bbox, colorizer),
+            headers=self.__client.session.auth_header,
+            timeout=timeout,
+        )
+
+        _check_response(response)
+
+        return Image.open(BytesIO(response.content))
+
+
+class AsyncTask:
+    '''
+    Holds a task id, allows querying and manipulating the task status asynchronously
+    '''
+
+    __client: AsyncClient
+    __task_id: TaskId
+
+    def __init__(self, client: AsyncClient, task_id: TaskId) -> None:
+        self.__client = client
+        self.__task_id = task_id
+
+    def __eq__(self, other):
+        '''Check if two task representations are equal'''
+        if not isinstance(other, self.__class__):
+            return False
+
+        return self.__task_id == other.__task_id  # pylint: disable=protected-access
+
+    def __str__(self) -> str:
+        return str(self.__task_id)
+
+    def __repr__(self) -> str:
+        return repr(self.__task_id)
+
+    async def get_status(self, timeout: int = 3600) -> TaskStatusInfo:
+        '''
+        Returns the status of a task in a Geo Engine instance
+        '''
+
+        response = await self.__client.request(
+            'GET',
+            f'/tasks/{self.__task_id}/status',
+            headers=self.__client.session.auth_header,
+            timeout=timeout,
+        )
+
+        _check_response(response)
+
+        return TaskStatusInfo.from_response(response.json())
+
+    async def abort(self, force: bool = False, timeout: int = 3600) -> None:
+        '''
+        Abort a running task in a Geo Engine instance
+        '''
+
+        response = await self.__client.request(
+            'GET',
+            f'/tasks/{self.__task_id}/abort?force={str(force).lower()}',
+            headers=self.__client.session.auth_header,
+            timeout=timeout,
+        )
+
+        _check_response(response)
+
+    async def wait_for_finish(
+            self,
+            check_interval_seconds: float = 5,
+            request_timeout: int = 3600,
+            print_status: bool = True) -> TaskStatusInfo:
+        '''
+        Wait for the given task in a Geo Engine instance to finish (status either complete, aborted or failed).
+        The status is printed after each check-in. Check-ins happen in intervals of check_interval_seconds seconds.
+        '''
+        current_status = await self.get_status(request_timeout)
+
+        while current_status.status == TaskStatus.RUNNING:
+            current_status = await self.get_status(request_timeout)
+
+            if print_status:
+                print(current_status)
+            if current_status.status == TaskStatus.RUNNING:
+                await asyncio.sleep(check_interval_seconds)
+
+        return current_status
+
+
+def workflow_by_id(client: AsyncClient, workflow_id: Union[UUID, WorkflowId]) -> AsyncWorkflow:
+    '''
+    Create a workflow object from a workflow id
+    '''
+
+    if isinstance(workflow_id, UUID):
+        workflow_id = WorkflowId(workflow_id)
+
+    return AsyncWorkflow(client, workflow_id)
+
+
+async def layer_collection(client: AsyncClient,
+                           layer_collection_id: Optional[LayerCollectionId] = None,
+                           layer_provider_id: LayerProviderId = LAYER_DB_PROVIDER_ID,
+                           timeout: int = 60,
+                           page_size: int = DEFAULT_PAGE_SIZE) -> LayerCollection:
+    '''
+    Retrieve a layer collection that contains layers and layer collections in pages of `page_size` items.
+    '''
+
+    if page_size < 1:
+        raise InputException('page_size must be positive')
+
+    request = _layer_collection_path(layer_collection_id, layer_provider_id)
+
+    page_limit = page_size
+    pages: List[api.LayerCollectionResponse] = []
+
+    offset = 0
+    while True:
+        response = await client.request(
+            'GET',
+            f'{request}?offset={offset}&limit={page_limit}',
+            headers=client.session.admin_or_normal_auth_header,
+            timeout=timeout,
+        )
+
+        if not response.is_success:
+            raise GeoEngineException(response.json())
+
+        page: api.LayerCollectionResponse = response.json()
+
+        if len(page['items']) < page_limit:
+            if len(pages) == 0 or len(page['items']) > 0:  # we need at least one page before breaking
+                pages.append(page)
+            break
+
+        pages.append(page)
+        offset += page_limit
+
+    return LayerCollection.from_response(pages)
+
+
+async def layer(client: AsyncClient,
+                layer_id: LayerId,
+                layer_provider_id: LayerProviderId = LAYER_DB_PROVIDER_ID,
+                timeout: int = 60) -> Layer:
+    '''
+    Retrieve a layer from the server.
+    '''
+
+    response = await client.request(
+        'GET',
+        f'/layers/{layer_provider_id}/{urllib.parse.quote_plus(layer_id)}',
+        headers=client.session.admin_or_normal_auth_header,
+        timeout=timeout,
+    )
+
+    if not response.is_success:
+        raise GeoEngineException(response.json())
+
+    return Layer.from_response(response.json())
+
+
+async def _run_in_executor(function: Callable[[bytes], T], content: bytes) -> T:
+    '''Run a CPU-bound decoding function on the default thread pool of the running loop'''
+
+    return await asyncio.get_running_loop().run_in_executor(None, function, content)
+
+
+def _read_first_band(content: bytes) -> np.ndarray:
+    '''Decode the first band of a GeoTiff, copying uncompressed pixels directly from the response'''
+
+    layout = read_tiff_layout(content)
+
+    if layout is None:
+        with rasterio.io.MemoryFile(content) as memfile, memfile.open() as dataset:
+            return dataset.read(1)
+
+    array = np.empty((layout.height, layout.width), dtype=layout.dtype.newbyteorder('='))
+    read_tiff_bands(content, layout, [1], array[np.newaxis])
+
+    return array
+
+
+def _check_response(response: httpx.Response) -> None:
+    '''
+    Checks a `Response` for an error and raises it if there is one.
+    '''
+
+    if response.is_success:
+        return
+
+    # try to parse it as a Geo Engine error
+    try:
+        response_json: Dict[str, Any] = response.json()
+    except ValueError:
+        pass  # ignore errors, it seemed not to be JSON
+    else:
+        if isinstance(response_json, dict) and 'error' in response_json:
+            raise GeoEngineException(response_json)
+
+    response.raise_for_status()
+
+
+def _check_ows_response(response: httpx.Response) -> None:
+    '''
+    Checks a `Response` of an OGC web service (e.g., WCS) for an error and raises it if there is one.
+    '''
+
+    if response.status_code in [400, 401]:
+        raise ServiceException(response.text)
+
+    response.raise_for_status()
+
+    check_ows_exception_report(response.headers.get('Content-Type'), response.content)
@@ -4,14 +4,17 @@ Module for encapsulating Geo Engine authentication
 
 from __future__ import annotations
 from typing import ClassVar, Dict, Optional, Tuple
+import hashlib
 from uuid import UUID
 
 import os
 from dotenv import load_dotenv
-import requests as req
 from requests.auth import AuthBase
 
 from geoengine.error import GeoEngineException, UninitializedException, NoAdminSessionException
+from geoengine.http_cache import HttpCache
+from geoengine.instrumentation import Instrument, set_instruments_provider
+from geoengine.transport import ConnectionPoolConfig, RetryingSession, RetryPolicy, create_http_session
 
 
 class BearerAuth(AuthBase):  # pylint: disable=too-few-public-methods
@@ -34,18 +37,24 @@ class Session:
 
     __id: UUID
     __valid_until: Optional[str] = None
+    __user_id: Optional[str] = None
     __server_url: str
     __timeout: int = 60
+    __http_session: RetryingSession
+    __instruments: Tuple[Instrument, ...] = ()
 
     __admin_token: Optional[UUID] = None
 
     session: ClassVar[Optional[Session]] = None
 
-    def __init__(self,
+    def __init__(self,  # pylint: disable=too-many-arguments
                  server_url: str,
                  credentials: Optional[Tuple[str, str]] = None,
                  token: Optional[str] = None,
-                 admin_token: Optional[str] = None) -> None:
+                 admin_token: Optional[str] = None,
+                 pool_config: Optional[ConnectionPoolConfig] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 http_cache: Optional[HttpCache] = None) -> None:
         '''
         Initialize communication between this library and a Geo Engine instance
 
@@ -56,6 +65,9 @@ class Session:
          - `(email, password)` as tuple
          - `token` as a string
          - `admin_token` as a string
+         - `pool_config` as a `ConnectionPoolConfig` for the HTTP connection pool of this session
+         - `retry_policy` as a `RetryPolicy` for retrying idempotent requests on transient errors
+         - `http_cache` as an `HttpCache` for layers, layer collections, workflow definitions, provenance and volumes
 
         optional environment variables:
          - `GEOENGINE_EMAIL`
@@ -69,23 +81,27 @@ class Session:
         if credentials is not None and token is not None:
             raise GeoEngineException({'message': 'Cannot provide both credentials and token'})
 
+        self.__http_session = create_http_session(pool_config, retry_policy, http_cache)
+        http_session = self.__http_session
+
         if credentials is not None:
-            session = req.post(f'{server_url}/login', json={"email": credentials[0],
-                                                            "password": credentials[1]}, timeout=self.__timeout).json()
+            session = http_session.post(f'{server_url}/login', json={"email": credentials[0],
+                                                                     "password": credentials[1]},
+                                        timeout=self.__timeout).json()
         elif "GEOENGINE_EMAIL" in os.environ and "GEOENGINE_PASSWORD" in os.environ:
-            session = req.post(f'{server_url}/login',
-                               json={"email": os.environ.get("GEOENGINE_EMAIL"),
-                                     "password": os.environ.get("GEOENGINE_PASSWORD")},
-                               timeout=self.__timeout).json()
+            session = http_session.post(f'{server_url}/login',
+                                        json={"email": os.environ.get("GEOENGINE_EMAIL"),
+                                              "password": os.environ.get("GEOENGINE_PASSWORD")},
+                                        timeout=self.__timeout).json()
         elif token is not None:
-            session = req.get(f'{server_url}/session', headers={'Authorization': f'Bearer {token}'},
-                              timeout=self.__timeout).json()
+            session = http_session.get(f'{server_url}/session', headers={'Authorization': f'Bearer {token}'},
+                                       timeout=self.__timeout).json()
         elif "GEOENGINE_TOKEN" in os.environ:
-            session = req.get(f'{server_url}/session',
-                              headers={'Authorization': f'Bearer {os.environ.get("GEOENGINE_TOKEN")}'},
-                              timeout=self.__timeout).json()
+            session = http_session.get(f'{server_url}/session',
+                                       headers={'Authorization': f'Bearer {os.environ.get("GEOENGINE_TOKEN")}'},
+                                       timeout=self.__timeout).json()
         else:
-            session = req.post(f'{server_url}/anonymous', timeout=self.__timeout).json()
+            session = http_session.post(f'{server_url}/anonymous', timeout=self.__timeout).json()
 
         if 'error' in session:
             raise GeoEngineException(session)
@@ -95,6 +111,9 @@ class Session:
         if 'validUntil' in session:
             self.__valid_until = session['validUntil']
 
+        if isinstance(session.get('user'), dict) and 'id' in session['user']:
+            self.__user_id = str(session['user']['id'])
+
         self.__server_url = server_url
 
         if admin_token is not None:
@@ -151,6 +170,75 @@ class Session:
 
         return self.__server_url
 
+    @property
+    def cache_scope(self) -> str:
+        '''
+        Identify the user of this session in caches that are shared between sessions
+
+        This is the user id if the server reported it and a hash of the session token otherwise.
+        '''
+
+        if self.__user_id is not None:
+            return f'user:{self.__user_id}'
+
+        return 'token:' + hashlib.sha256(str(self.__id).encode()).hexdigest()
+
+    @property
+    def requests_session(self) -> RetryingSession:
+        '''
+        Return the pooled HTTP session that all requests of this session should use
+
+        Reusing it keeps connections to the Geo Engine instance alive across calls.
+        '''
+
+        return self.__http_session
+
+    @property
+    def retry_policy(self) -> Optional[RetryPolicy]:
+        '''
+        Return the policy for retrying idempotent requests, or None if requests are not retried
+        '''
+
+        return self.__http_session.retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, retry_policy: Optional[RetryPolicy]) -> None:
+        self.__http_session.retry_policy = retry_policy
+
+    @property
+    def http_cache(self) -> Optional[HttpCache]:
+        '''
+        Return the cache for metadata responses, or None if they are not cached
+        '''
+
+        return self.__http_session.http_cache
+
+    @http_cache.setter
+    def http_cache(self, http_cache: Optional[HttpCache]) -> None:
+        self.__http_session.http_cache = http_cache
+
+    @property
+    def instruments(self) -> Tuple[Instrument, ...]:
+        '''
+        Return the instruments that receive the events of the operations of this session
+        '''
+
+        return self.__instruments
+
+    def add_instrument(self, instrument: Instrument) -> None:
+        '''
+        Report the start and end of all instrumented operations of this session to `instrument`
+        '''
+
+        self.__instruments = (*self.__instruments, instrument)
+
+    def remove_instrument(self, instrument: Instrument) -> None:
+        '''
+        Stop reporting operations to `instrument`
+        '''
+
+        self.__instruments = tuple(i for i in self.__instruments if i is not instrument)
+
     def requests_bearer_auth(self) -> BearerAuth:
         '''
         Return a Bearer authentication object for the current session
@@ -163,7 +251,17 @@ class Session:
         Logout the current session
         '''
 
-        req.post(f'{self.server_url}/logout', headers=self.auth_header, timeout=self.__timeout)
+        self.__http_session.post(f'{self.server_url}/logout', headers=self.auth_header, timeout=self.__timeout)
+
+    def close(self) -> None:
+        '''
+        Close all pooled connections of the current session
+        '''
+
+        self.__http_session.close()
+
+
+set_instruments_provider(lambda: () if Session.session is None else Session.session.instruments)
 
 
 def get_session() -> Session:
@@ -179,10 +277,13 @@ def get_session() -> Session:
     return Session.session
 
 
-def initialize(server_url: str,
+def initialize(server_url: str,  # pylint: disable=too-many-arguments
                credentials: Optional[Tuple[str, str]] = None,
                token: Optional[str] = None,
-               admin_token: Optional[str] = None) -> None:
+               admin_token: Optional[str] = None,
+               pool_config: Optional[ConnectionPoolConfig] = None,
+               retry_policy: Optional[RetryPolicy] = None,
+               http_cache: Optional[HttpCache] = None) -> None:
     '''
     Initialize communication between this library and a Geo Engine instance
 
@@ -190,13 +291,20 @@ def initialize(server_url: str,
     Credentials and token must not be provided at the same time.
 
     optional arugments: (email, password) as tuple or token as a string
+    optional `pool_config` to configure the size and keep-alive behavior of the HTTP connection pool
+    optional `retry_policy` to retry idempotent requests such as WCS, WFS, WMS and status queries on transient errors
+    optional `http_cache` to cache and revalidate layers, layer collections, workflow definitions, provenance
+    and volumes
     optional environment variables: GEOENGINE_EMAIL, GEOENGINE_PASSWORD, GEOENGINE_TOKEN
     optional .env file defining: GEOENGINE_EMAIL, GEOENGINE_PASSWORD, GEOENGINE_TOKEN
     '''
 
     load_dotenv()
 
-    Session.session = Session(server_url, credentials, token, admin_token)
+    if Session.session is not None:
+        Session.session.close()
+
+    Session.session = Session(server_url, credentials, token, admin_token, pool_config, retry_policy, http_cache)
 
 
 def reset(logout: bool = True) -> None:
@@ -204,7 +312,9 @@ def reset(logout: bool = True) -> None:
     Resets the current session
     '''
 
-    if Session.session is not None and logout:
-        Session.session.logout()
+    if Session.session is not None:
+        if logout:
+            Session.session.logout()
+        Session.session.close()
 
     Session.session = None
@@ -0,0 +1,319 @@
+'''
+A persistent on-disk cache for workflow query results
+'''
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging import debug
+from os import PathLike
+from threading import Lock
+from typing import Any, BinaryIO, ClassVar, Iterator, List, NamedTuple, Optional, Tuple, Union, cast
+from uuid import uuid4
+
+from geoengine.types import QueryRectangle
+
+ENTRY_SUFFIX = '.result'
+TEMPORARY_PREFIX = '.tmp-'
+
+
+class CacheStats(NamedTuple):
+    '''Hit and miss statistics of a `ResultCache`'''
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        '''The share of lookups that were served from the cache'''
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+
+class ResultCache:
+    '''
+    A size-bounded on-disk cache for query results
+
+    Registered workflows are immutable, so their results only depend on the query.
+    Entries are written atomically and the least recently used entries are evicted once the cache
+    exceeds `max_bytes`. The cache is safe to use from multiple threads.
+    '''
+
+    __directory: str
+    __max_bytes: int
+    __lock: Lock
+    __size_bytes: int
+    __hits: int = 0
+    __misses: int = 0
+    __evictions: int = 0
+
+    global_cache: ClassVar[Optional[ResultCache]] = None
+
+    def __init__(self, directory: Optional[Union[str, PathLike]] = None, max_bytes: int = 1024 ** 3) -> None:
+        '''
+        Open or create a cache in `directory`
+
+        If `directory` is None, the cache is located in the user's cache directory.
+        '''
+
+        if max_bytes < 1:
+            raise ValueError('The maximum cache size must be positive')
+
+        if directory is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+            directory = os.path.join(cache_home, 'geoengine', 'results')
+
+        self.__directory = os.fspath(directory)
+        self.__max_bytes = max_bytes
+        self.__lock = Lock()
+
+        os.makedirs(self.__directory, exist_ok=True)
+
+        self.__size_bytes = sum(size for (_path, size, _mtime) in self.__entries())
+
+    def __repr__(self) -> str:
+        return f'ResultCache(directory={self.__directory!r}, max_bytes={self.__max_bytes!r})'
+
+    @property
+    def directory(self) -> str:
+        '''The directory of the cache'''
+        return self.__directory
+
+    @property
+    def max_bytes(self) -> int:
+        '''The size limit of the cache'''
+        return self.__max_bytes
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        '''
+        Build a cache key from JSON-serializable parts
+
+        `QueryRectangle`s are normalized, so equal queries lead to equal keys.
+        '''
+
+        normalized = [_normalize_query_rectangle(part) if isinstance(part, QueryRectangle) else part for part in parts]
+
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.__directory, key + ENTRY_SUFFIX)
+
+    def get_path(self, key: str) -> Optional[str]:
+        '''Return the path of the entry for `key` or None if it is not cached'''
+
+        path = self.__path(key)
+
+        try:
+            # mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            with self.__lock:
+                self.__misses += 1
+            return None
+
+        with self.__lock:
+            self.__hits += 1
+
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        '''Return the content of the entry for `key` or None if it is not cached'''
+
+        path = self.get_path(key)
+        if path is None:
+            return None
+
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            # evicted in the meantime
+            return None
+
+    @contextmanager
+    def writer(self, key: str) -> Iterator[BinaryIO]:
+        '''
+        Write the entry for `key` through a file
+
+        The entry only becomes visible if the block finishes without an exception.
+        '''
+
+        with tempfile.NamedTemporaryFile(dir=self.__directory, prefix=TEMPORARY_PREFIX, delete=False) as file:
+            temporary_path = file.name
+
+            try:
+                yield cast(BinaryIO, file)
+            except BaseException:
+                file.close()
+                os.remove(temporary_path)
+                raise
+
+        self.__commit(key, temporary_path)
+
+    def put(self, key: str, content: bytes) -> None:
+        '''Store `content` as the entry for `key`'''
+
+        with self.writer(key) as file:
+            file.write(content)
+
+    def put_file(self, key: str, path: Union[str, PathLike], link: bool = False) -> None:
+        '''
+        Store a copy of the file at `path` as the entry for `key`
+
+        If `link` is True, the entry is a hard link to the file if possible, which avoids copying it.
+        The file must not be modified afterwards.
+        '''
+
+        if link:
+            temporary_path = os.path.join(self.__directory, TEMPORARY_PREFIX + uuid4().hex)
+            try:
+                os.link(path, temporary_path)
+            except OSError:
+                pass
+            else:
+                self.__commit(key, temporary_path)
+                return
+
+        with self.writer(key) as file, open(path, 'rb') as source:
+            shutil.copyfileobj(source, file)
+
+    def __commit(self, key: str, temporary_path: str) -> None:
+        '''Atomically turn a temporary file into the entry for `key`'''
+
+        path = self.__path(key)
+        size = os.path.getsize(temporary_path)
+
+        with self.__lock:
+            try:
+                replaced_size = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_size = 0
+
+            os.replace(temporary_path, path)
+
+            self.__size_bytes += size - replaced_size
+
+            if self.__size_bytes > self.__max_bytes:
+                self.__evict()
+
+    def __entries(self) -> List[Tuple[str, int, float]]:
+        '''Return the path, size and last usage of all entries'''
+
+        entries = []
+        with os.scandir(self.__directory) as directory:
+            for entry in directory:
+                if not entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def __evict(self) -> None:
+        '''Remove the least recently used entries until the cache fits into its limit'''
+
+        # other processes may share the directory, so recount
+        entries = sorted(self.__entries(), key=lambda entry: entry[2])
+        self.__size_bytes = sum(size for (_path, size, _mtime) in entries)
+
+        for (path, size, _mtime) in entries:
+            if self.__size_bytes <= self.__max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            self.__size_bytes -= size
+            self.__evictions += 1
+
+            debug(f'Evicted {path} from the result cache')
+
+    def clear(self) -> None:
+        '''Remove all entries and reset the statistics'''
+
+        with self.__lock:
+            for (path, _size, _mtime) in self.__entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            self.__size_bytes = 0
+            self.__hits = 0
+            self.__misses = 0
+            self.__evictions = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        '''Return the statistics of this cache since it was opened'''
+
+        with self.__lock:
+            return CacheStats(
+                hits=self.__hits,
+                misses=self.__misses,
+                evictions=self.__evictions,
+                entries=len(self.__entries()),
+                size_bytes=self.__size_bytes,
+            )
+
+
+def _normalize_query_rectangle(query_rectangle: QueryRectangle) -> List[Any]:
+    '''Convert a `QueryRectangle` into a canonical, JSON-serializable form'''
+
+    def normalize_time(time: Optional[datetime]) -> Optional[str]:
+        if time is None:
+            return None
+        if time.tzinfo is not None:
+            time = time.astimezone(timezone.utc)
+        return time.isoformat()
+
+    time_interval = query_rectangle.time
+    end = time_interval.end if time_interval.end != time_interval.start else None
+
+    return [
+        [repr(float(x)) for x in query_rectangle.spatial_bounds.as_bbox_tuple()],
+        [normalize_time(time_interval.start), normalize_time(end)],
+        [repr(float(x)) for x in query_rectangle.spatial_resolution.as_tuple()],
+        query_rectangle.srs,
+    ]
+
+
+def enable_result_cache(directory: Optional[Union[str, PathLike]] = None, max_bytes: int = 1024 ** 3) -> ResultCache:
+    '''
+    Cache all workflow query results in `directory`, which defaults to the user's cache directory
+
+    The cache is used by `get_array`, `get_xarray`, `download_raster`, `get_dataframe`, `plot_chart` and
+    `wms_get_map_as_image`. The least recently used results are evicted once the cache exceeds `max_bytes`.
+    '''
+
+    ResultCache.global_cache = ResultCache(directory, max_bytes)
+
+    return ResultCache.global_cache
+
+
+def disable_result_cache() -> None:
+    '''Stop caching workflow query results. The cached results remain on disk.'''
+
+    ResultCache.global_cache = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    '''Return the global result cache if it is enabled'''
+
+    return ResultCache.global_cache
@@ -0,0 +1,438 @@
+'''
+A crawler for the layer tree and a local catalog index with full-text search over it
+'''
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from os import PathLike
+from threading import Lock
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+from uuid import UUID, uuid4
+
+from geoengine.auth import get_session
+from geoengine.error import InputException
+from geoengine.layers import DEFAULT_PAGE_SIZE, LAYER_DB_PROVIDER_ID, LayerCollection, LayerCollectionId, \
+    LayerCollectionListing, LayerCollectionListingType, LayerId, LayerListing, LayerProviderId, Listing, \
+    layer_collection
+
+CollectionKey = Tuple[LayerProviderId, Optional[LayerCollectionId]]
+
+# catalogs with another schema version are rebuilt on the next crawl
+CATALOG_SCHEMA_VERSION = 2
+
+
+class CatalogEntry(NamedTuple):
+    '''A layer or layer collection in the catalog together with the collection that lists it'''
+
+    kind: LayerCollectionListingType
+    provider_id: LayerProviderId
+    item_id: str
+    name: str
+    description: str
+    parent_provider_id: LayerProviderId
+    parent_collection_id: LayerCollectionId
+
+    def listing(self) -> Listing:
+        '''Return the entry as a listing, e.g., to `load` it'''
+
+        if self.kind is LayerCollectionListingType.COLLECTION:
+            return LayerCollectionListing(LayerCollectionId(self.item_id), self.provider_id, self.name,
+                                          self.description)
+
+        return LayerListing(LayerId(self.item_id), self.provider_id, self.name, self.description)
+
+
+class CrawlError(NamedTuple):
+    '''A collection that could not be loaded during a crawl'''
+
+    provider_id: LayerProviderId
+    collection_id: Optional[LayerCollectionId]
+    error: Exception
+
+
+class CrawlStats(NamedTuple):
+    '''The outcome of a crawl'''
+
+    collections_loaded: int
+    collections_unchanged: int
+    collections_skipped: int
+    collections_removed: int
+    errors: List[CrawlError]
+    duration_seconds: float
+
+
+class LayerCatalog:
+    '''
+    A local index of the layer tree of Geo Engine instances with full-text search over names and descriptions
+
+    The index is an SQLite database, which is kept in memory or, if a `path` is given, persisted across processes.
+    Entries are stored per server, so one catalog can index several instances.
+    '''
+
+    __path: Optional[str]
+    __connection: Optional[sqlite3.Connection]
+    __full_text: bool
+    __lock: Lock
+
+    def __init__(self, path: Optional[Union[str, PathLike]] = None) -> None:
+        '''Create a catalog that is persisted in the SQLite database at `path` if it is given'''
+
+        self.__path = os.fspath(path) if path is not None else None
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(self.__path or ':memory:', check_same_thread=False)
+
+        with self.__connection:
+            if self.__connection.execute('PRAGMA user_version').fetchone()[0] != CATALOG_SCHEMA_VERSION:
+                for statement in ['DROP TRIGGER IF EXISTS entries_insert', 'DROP TRIGGER IF EXISTS entries_delete',
+                                  'DROP TABLE IF EXISTS entries_fts', 'DROP TABLE IF EXISTS entries',
+                                  'DROP TABLE IF EXISTS collections',
+                                  f'PRAGMA user_version = {CATALOG_SCHEMA_VERSION}']:
+                    self.__connection.execute(statement)
+
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS collections ('
+                'server_url TEXT NOT NULL, provider_id TEXT NOT NULL, collection_id TEXT NOT NULL, '
+                'name TEXT NOT NULL, description TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+                'crawled_at REAL NOT NULL, crawl_id TEXT NOT NULL, '
+                'PRIMARY KEY (server_url, provider_id, collection_id))'
+            )
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'id INTEGER PRIMARY KEY, server_url TEXT NOT NULL, parent_provider_id TEXT NOT NULL, '
+                'parent_collection_id TEXT NOT NULL, kind TEXT NOT NULL, provider_id TEXT NOT NULL, '
+                'item_id TEXT NOT NULL, name TEXT NOT NULL, description TEXT NOT NULL, position INTEGER NOT NULL, '
+                'UNIQUE (server_url, parent_provider_id, parent_collection_id, kind, provider_id, item_id))'
+            )
+            self.__full_text = self.__create_full_text_index()
+
+    def __create_full_text_index(self) -> bool:
+        '''Index the entries with FTS5 and return whether it is available in this SQLite build'''
+
+        assert self.__connection is not None
+
+        try:
+            self.__connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts '
+                'USING fts5(name, description, content=entries, content_rowid=id)'
+            )
+        except sqlite3.OperationalError:  # without FTS5, the search falls back to substring matching
+            return False
+
+        self.__connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN '
+            'INSERT INTO entries_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END'
+        )
+        self.__connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN '
+            'INSERT INTO entries_fts (entries_fts, rowid, name, description) '
+            "VALUES ('delete', old.id, old.name, old.description); END"
+        )
+
+        return True
+
+    def __repr__(self) -> str:
+        return f'LayerCatalog(path={self.__path!r})'
+
+    def __enter__(self) -> LayerCatalog:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def crawl(self,  # pylint: disable=too-many-arguments,too-many-locals
+              layer_collection_id: Optional[LayerCollectionId] = None,
+              layer_provider_id: LayerProviderId = LAYER_DB_PROVIDER_ID,
+              max_workers: int = 8,
+              max_depth: Optional[int] = None,
+              max_age_seconds: Optional[float] = None,
+              page_size: int = DEFAULT_PAGE_SIZE,
+              timeout: int = 60) -> CrawlStats:
+        '''
+        Walk the layer tree below a collection breadth-first and index all layers and collections
+
+        Collections are loaded concurrently on a thread pool of at most `max_workers` and every collection is
+        loaded at most once, even if it is listed in several places. The root collection is the default.
+
+        The refresh is incremental: collections that were indexed less than `max_age_seconds` ago are not loaded
+        again, their indexed children are walked instead, and the entries of a loaded collection are only
+        rewritten if its listing changed. After a complete crawl from the root, collections that are not part of
+        the tree anymore are removed.
+
+        Collections that fail to load are reported in the `CrawlStats` and keep their previous entries.
+        '''
+
+        if max_workers < 1:
+            raise InputException('max_workers must be positive')
+
+        start = time.perf_counter()
+        server_url = get_session().server_url
+        crawl_id = str(uuid4())
+
+        queue: Deque[Tuple[CollectionKey, int]] = deque([((layer_provider_id, layer_collection_id), 0)])
+        visited: Set[CollectionKey] = {(layer_provider_id, layer_collection_id)}
+        pending: Dict[Future, Tuple[CollectionKey, int]] = {}
+        errors: List[CrawlError] = []
+        counts = {'loaded': 0, 'unchanged': 0, 'skipped': 0}
+
+        def visit_children(children: List[CollectionKey], depth: int) -> None:
+            if max_depth is not None and depth >= max_depth:
+                return
+            for child in children:
+                if child not in visited:
+                    visited.add(child)
+                    queue.append((child, depth + 1))
+
+        def load(key: CollectionKey) -> LayerCollection:
+            return layer_collection(key[1], key[0], timeout, page_size, max_workers=1)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while queue or pending:
+                while queue and len(pending) < max_workers:
+                    (key, depth) = queue.popleft()
+
+                    fresh_children = self.__fresh_children(server_url, key, max_age_seconds, crawl_id)
+                    if fresh_children is not None:
+                        counts['skipped'] += 1
+                        visit_children(fresh_children, depth)
+                        continue
+
+                    pending[executor.submit(load, key)] = (key, depth)
+
+                if not pending:
+                    continue
+
+                (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    (key, depth) = pending.pop(future)
+
+                    error = future.exception()
+                    if isinstance(error, Exception):
+                        errors.append(CrawlError(key[0], key[1], error))
+                        continue
+                    if error is not None:
+                        raise error
+
+                    collection = future.result()
+                    # the root collection is requested without an id
+                    visited.add((collection.provider_id, collection.collection_id))
+
+                    changed = self.__store(server_url, collection, crawl_id)
+                    counts['loaded' if changed else 'unchanged'] += 1
+
+                    visit_children([
+                        (item.provider_id, item.listing_id)
+                        for item in collection.items if isinstance(item, LayerCollectionListing)
+                    ], depth)
+
+        removed = 0
+        if layer_collection_id is None and max_depth is None and not errors:
+            removed = self.__remove_unvisited(server_url, crawl_id)
+
+        return CrawlStats(
+            collections_loaded=counts['loaded'],
+            collections_unchanged=counts['unchanged'],
+            collections_skipped=counts['skipped'],
+            collections_removed=removed,
+            errors=errors,
+            duration_seconds=time.perf_counter() - start,
+        )
+
+    def __fresh_children(self,
+                         server_url: str,
+                         key: CollectionKey,
+                         max_age_seconds: Optional[float],
+                         crawl_id: str) -> Optional[List[CollectionKey]]:
+        '''Return the indexed child collections of a collection if it was crawled within `max_age_seconds`'''
+
+        (provider_id, collection_id) = key
+        if max_age_seconds is None or collection_id is None:
+            return None
+
+        with self.__lock:
+            connection = self.__open_connection()
+
+            with connection:
+                updated = connection.execute(
+                    'UPDATE collections SET crawl_id = ? '
+                    'WHERE server_url = ? AND provider_id = ? AND collection_id = ? AND crawled_at >= ?',
+                    (crawl_id, server_url, str(provider_id), collection_id, time.time() - max_age_seconds)
+                ).rowcount
+
+            if updated == 0:
+                return None
+
+            rows = connection.execute(
+                'SELECT provider_id, item_id FROM entries '
+                'WHERE server_url = ? AND parent_provider_id = ? AND parent_collection_id = ? AND kind = ? '
+                'ORDER BY position',
+                (server_url, str(provider_id), collection_id, LayerCollectionListingType.COLLECTION.value)
+            ).fetchall()
+
+        return [(LayerProviderId(UUID(row[0])), LayerCollectionId(row[1])) for row in rows]
+
+    def __store(self, server_url: str, collection: LayerCollection, crawl_id: str) -> bool:
+        '''Store a loaded collection and its items and return whether its listing changed'''
+
+        parent = (server_url, str(collection.provider_id), collection.collection_id)
+        items = [
+            (
+                LayerCollectionListingType.COLLECTION.value if isinstance(item, LayerCollectionListing)
+                else LayerCollectionListingType.LAYER.value,
+                str(item.provider_id),
+                str(item.listing_id),
+                item.name,
+                item.description,
+            )
+            for item in collection.items
+        ]
+        fingerprint = hashlib.sha256(repr((collection.name, collection.description, items)).encode()).hexdigest()
+
+        with self.__lock:
+            connection = self.__open_connection()
+
+            row = connection.execute(
+                'SELECT fingerprint FROM collections WHERE server_url = ? AND provider_id = ? AND collection_id = ?',
+                parent
+            ).fetchone()
+            changed = row is None or row[0] != fingerprint
+
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO collections '
+                    '(server_url, provider_id, collection_id, name, description, fingerprint, crawled_at, crawl_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (*parent, collection.name, collection.description, fingerprint, time.time(), crawl_id)
+                )
+
+                if changed:
+                    connection.execute(
+                        'DELETE FROM entries WHERE server_url = ? AND parent_provider_id = ? '
+                        'AND parent_collection_id = ?',
+                        parent
+                    )
+                    # a plain insert keeps the full-text index in sync, so items listed twice are inserted once
+                    rows = []
+                    listed: Set[Tuple[str, str, str]] = set()
+                    for (position, item) in enumerate(items):
+                        if item[:3] not in listed:
+                            listed.add(item[:3])
+                            rows.append((*parent, *item, position))
+
+                    connection.executemany(
+                        'INSERT INTO entries (server_url, parent_provider_id, parent_collection_id, '
+                        'kind, provider_id, item_id, name, description, position) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        rows
+                    )
+
+        return changed
+
+    def __remove_unvisited(self, server_url: str, crawl_id: str) -> int:
+        '''Remove the collections of `server_url` that were not part of the crawl and return their number'''
+
+        with self.__lock:
+            connection = self.__open_connection()
+
+            with connection:
+                connection.execute(
+                    'DELETE FROM entries WHERE server_url = ? AND NOT EXISTS ('
+                    'SELECT 1 FROM collections c WHERE c.server_url = entries.server_url '
+                    'AND c.provider_id = entries.parent_provider_id '
+                    'AND c.collection_id = entries.parent_collection_id AND c.crawl_id = ?)',
+                    (server_url, crawl_id)
+                )
+                return connection.execute(
+                    'DELETE FROM collections WHERE server_url = ? AND crawl_id != ?',
+                    (server_url, crawl_id)
+                ).rowcount
+
+    def search(self,
+               query: str,
+               limit: int = 20,
+               kind: Optional[LayerCollectionListingType] = None) -> List[CatalogEntry]:
+        '''
+        Search the names and descriptions of the indexed layers and collections of the current session's server
+
+        All words of `query` must occur, where the last one may be a prefix. The best matches come first.
+        '''
+
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+
+        server_url = get_session().server_url
+        columns = 'e.kind, e.provider_id, e.item_id, e.name, e.description, e.parent_provider_id, ' \
+            'e.parent_collection_id'
+        kind_condition = 'AND e.kind = ?' if kind is not None else ''
+        kind_parameters = [kind.value] if kind is not None else []
+
+        with self.__lock:
+            connection = self.__open_connection()
+
+            if self.__full_text:
+                match = ' '.join(f'"{word}"' for word in words) + '*'
+                rows = connection.execute(
+                    f'SELECT {columns} FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid '
+                    f'WHERE entries_fts MATCH ? AND e.server_url = ? {kind_condition} '
+                    f'ORDER BY bm25(entries_fts) LIMIT ?',
+                    (match, server_url, *kind_parameters, limit)
+                ).fetchall()
+            else:
+                conditions = ' AND '.join(["(e.name || ' ' || e.description) LIKE ?"] * len(words))
+                rows = connection.execute(
+                    f'SELECT {columns} FROM entries e '
+                    f'WHERE {conditions} AND e.server_url = ? {kind_condition} LIMIT ?',
+                    (*(f'%{word}%' for word in words), server_url, *kind_parameters, limit)
+                ).fetchall()
+
+        return [
+            CatalogEntry(
+                kind=LayerCollectionListingType(row[0]),
+                provider_id=LayerProviderId(UUID(row[1])),
+                item_id=row[2],
+                name=row[3],
+                description=row[4],
+                parent_provider_id=LayerProviderId(UUID(row[5])),
+                parent_collection_id=LayerCollectionId(row[6]),
+            )
+            for row in rows
+        ]
+
+    def __len__(self) -> int:
+        '''Return the number of indexed entries of all servers'''
+
+        with self.__lock:
+            return self.__open_connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self) -> None:
+        '''Remove all entries'''
+
+        with self.__lock:
+            connection = self.__open_connection()
+
+            with connection:
+                connection.execute('DELETE FROM entries')
+                connection.execute('DELETE FROM collections')
+
+    def close(self) -> None:
+        '''Close the database of the catalog'''
+
+        with self.__lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+    def __open_connection(self) -> sqlite3.Connection:
+        '''Return the database connection or raise if the catalog was closed'''
+
+        if self.__connection is None:
+            raise InputException('The catalog is closed')
+
+        return self.__connection
@@ -2,14 +2,14 @@
 
 from abc import abstractmethod
 import json
-from typing import Dict, List, Tuple, cast
+from typing import TYPE_CHECKING, Dict, List, Tuple, cast
 from typing_extensions import Literal
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
-from matplotlib.cm import ScalarMappable
 from geoengine import api
 
+if TYPE_CHECKING:
+    from matplotlib.colors import ListedColormap
+
 
 class ColorBreakpoint():
     """This class is used to generate geoengine compatible color breakpoint definitions."""
@@ -51,14 +51,19 @@ class Colorizer():
 
     @staticmethod
     def linear_with_mpl_cmap(
-        map_name: ListedColormap,
+        map_name: "ListedColormap",
         min_max: Tuple[int, int],
         n_steps: int = 10,
         default_color: Tuple[int, int, int, int] = (0, 0, 0, 0),
         no_data_color: Tuple[int, int, int, int] = (0, 0, 0, 0)
     ) -> "LinearGradientColorizer":
         """Initialize the colorizer."""
-        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-arguments,import-outside-toplevel
+
+        # matplotlib is slow to import, so it is only loaded for colormaps
+        import matplotlib.pyplot as plt
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.colors import ListedColormap
 
         # assert correct parameters are given
         if not isinstance(map_name, ListedColormap):
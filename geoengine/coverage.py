@@ -0,0 +1,185 @@
+'''
+An open raster result for repeated band, window and overview reads
+'''
+
+from __future__ import annotations
+
+from contextlib import ExitStack
+from threading import Lock
+from types import TracebackType
+from typing import Iterator, List, Optional, Sequence, Tuple, Type, Union
+
+import numpy as np
+import rasterio.io
+from rasterio.crs import CRS  # pylint: disable=no-name-in-module
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from geoengine.error import InputException
+from geoengine.tiff import band_indexes
+
+
+class RasterCoverage:
+    '''
+    A raster result that was fetched once and is kept open for repeated reads
+
+    The coverage is held in memory or in a temporary file until the coverage is closed.
+    Use it as a context manager or call `close`. Reads are safe to use from multiple threads.
+    '''
+
+    __dataset: rasterio.io.DatasetReader
+    __resources: ExitStack
+    __lock: Lock
+    __closed: bool = False
+
+    def __init__(self, dataset: rasterio.io.DatasetReader, resources: ExitStack) -> None:
+        '''Wrap an open `dataset` whose underlying file is released by closing `resources`'''
+        self.__dataset = dataset
+        self.__resources = resources
+        self.__lock = Lock()
+
+    def __repr__(self) -> str:
+        return f'RasterCoverage(shape={self.shape!r}, count={self.count!r}, dtypes={self.dtypes!r})'
+
+    def __enter__(self) -> RasterCoverage:
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        '''Release the coverage'''
+        self.close()
+
+    def close(self) -> None:
+        '''Release the coverage'''
+
+        with self.__lock:
+            if not self.__closed:
+                self.__closed = True
+                self.__resources.close()
+
+    @property
+    def count(self) -> int:
+        '''The number of bands'''
+        return self.__dataset.count
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        '''The number of `(rows, columns)`'''
+        return (self.__dataset.height, self.__dataset.width)
+
+    @property
+    def dtypes(self) -> Tuple[str, ...]:
+        '''The data types of the bands'''
+        return tuple(self.__dataset.dtypes)
+
+    @property
+    def crs(self) -> CRS:
+        '''The coordinate reference system'''
+        return self.__dataset.crs
+
+    @property
+    def transform(self) -> Affine:
+        '''The affine transformation from pixel to world coordinates'''
+        return self.__dataset.transform
+
+    @property
+    def nodata(self) -> Optional[float]:
+        '''The no data value'''
+        return self.__dataset.nodata
+
+    @property
+    def overviews(self) -> List[int]:
+        '''The decimation factors of the overviews that are stored in the coverage'''
+        return self.__dataset.overviews(1)
+
+    def window_transform(self, window: Window) -> Affine:
+        '''Return the affine transformation of `window`'''
+        return self.__dataset.window_transform(window)
+
+    def read(self,
+             bands: Optional[Union[int, Sequence[int]]] = 1,
+             window: Optional[Window] = None,
+             out: Optional[np.ndarray] = None,
+             out_shape: Optional[Tuple[int, int]] = None,
+             resampling: Resampling = Resampling.nearest) -> np.ndarray:
+        '''
+        Read bands of the coverage
+
+        Parameters
+        ----------
+        bands : The 1-based index of the band to read, which results in a 2D array, or a sequence of indexes \
+            or None for all bands, which results in a 3D array of shape `(bands, rows, columns)`
+        window : If not None, only read this `rasterio.windows.Window`
+        out : A preallocated array to read into, which is returned
+        out_shape : If not None, read a decimated `(rows, columns)` version of the window, using the \
+            overviews of the coverage if there are any
+        resampling : The resampling method for decimated reads
+        '''
+        # pylint: disable=too-many-arguments
+
+        with self.__lock:
+            if self.__closed:
+                raise InputException('The coverage is closed')
+
+            indexes = band_indexes(bands, self.__dataset.count)
+            read_indexes = bands if isinstance(bands, int) else indexes
+
+            if out_shape is not None:
+                if out is not None:
+                    raise InputException('Cannot provide both out and out_shape')
+                if isinstance(bands, int):
+                    out_shape_with_bands: Tuple[int, ...] = out_shape
+                else:
+                    out_shape_with_bands = (len(indexes), *out_shape)
+
+                return self.__dataset.read(
+                    read_indexes, window=window, out_shape=out_shape_with_bands, resampling=resampling
+                )
+
+            return self.__dataset.read(read_indexes, window=window, out=out)
+
+    def read_overview(self,
+                      factor: int,
+                      bands: Optional[Union[int, Sequence[int]]] = 1,
+                      window: Optional[Window] = None,
+                      resampling: Resampling = Resampling.nearest) -> np.ndarray:
+        '''
+        Read a version of the coverage that is decimated by `factor` along both axes
+
+        Stored overviews are used if there are any.
+        '''
+
+        if factor < 1:
+            raise InputException('factor must be positive')
+
+        (height, width) = (int(window.height), int(window.width)) if window is not None else self.shape
+
+        return self.read(
+            bands,
+            window=window,
+            out_shape=(max(height // factor, 1), max(width // factor, 1)),
+            resampling=resampling,
+        )
+
+    def windows(self, tile_shape: Tuple[int, int]) -> Iterator[Tuple[Tuple[int, int], Window]]:
+        '''
+        Split the coverage into windows of `(rows, columns)` pixels
+
+        Each window is returned together with its pixel offset `(row, column)`. Windows at the right and lower
+        border may be smaller than `tile_shape`.
+        '''
+
+        (tile_height, tile_width) = tile_shape
+        if tile_height < 1 or tile_width < 1:
+            raise InputException("Tile shape: Must be positive")
+
+        (height, width) = self.shape
+
+        for row in range(0, height, tile_height):
+            for column in range(0, width, tile_width):
+                yield ((row, column), Window(
+                    column, row, min(tile_width, width - column), min(tile_height, height - row)
+                ))
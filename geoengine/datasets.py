@@ -1,25 +1,40 @@
+# pylint: disable=too-many-lines
+
 '''
 Module for working with datasets and source definitions
 '''
 
 from __future__ import annotations
 from abc import abstractmethod
-from typing import List, NamedTuple, Optional, cast
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union, cast
 from enum import Enum
-from uuid import UUID
+from logging import debug
+from os import PathLike
+from uuid import UUID, uuid4
+import base64
+import hashlib
 import json
+import multiprocessing
+import os
+import urllib.parse
+from time import sleep
 from typing_extensions import Literal
 from attr import dataclass
 import numpy as np
-import geopandas as gpd
-import requests as req
 from geoengine import api
-from geoengine.error import GeoEngineException, InputException
-from geoengine.auth import get_session
+from geoengine.error import GeoEngineException, InputException, check_response_for_error
+from geoengine.auth import Session, get_session
+from geoengine.instrumentation import bind_operation, instrumented
+from geoengine.transport import RETRYABLE_EXCEPTIONS, RETRYABLE_STATUS_CODES, RetryPolicy, gzip_stream, \
+    multipart_stream
 from geoengine.types import Provenance, RasterSymbology, TimeStep, \
     TimeStepGranularity, VectorDataType, VectorResultDescriptor, VectorColumnInfo, \
     UnitlessMeasurement
 
+if TYPE_CHECKING:
+    import geopandas as gpd
+
 
 class UnixTimeStampType(Enum):
     '''A unix time stamp type'''
@@ -416,35 +431,80 @@ def pandas_dtype_to_column_type(dtype: np.dtype) -> str:
         f'pandas dtype {dtype} has no corresponding column type')
 
 
-def upload_dataframe(
-        df: gpd.GeoDataFrame,
-        name: str = "Upload from Python",
-        time: OgrSourceDatasetTimeType = OgrSourceDatasetTimeType.none(),
-        on_error: OgrOnError = OgrOnError.ABORT,
-        timeout: int = 3600) -> DatasetId:
+DEFAULT_UPLOAD_CHUNK_ROWS = 10_000
+
+
+def geojson_chunks(df: gpd.GeoDataFrame, chunk_rows: int = DEFAULT_UPLOAD_CHUNK_ROWS) -> Iterator[bytes]:
     '''
-    Uploads a given dataframe to Geo Engine and returns the id of the created dataset
+    Serialize `df` like `df.to_json()`, but `chunk_rows` features at a time
+
+    Only one chunk of the GeoJSON feature collection is held in memory at any time.
     '''
 
+    yield b'{"type": "FeatureCollection", "features": ['
+
+    for start in range(0, len(df), chunk_rows):
+        features = json.dumps(list(df.iloc[start:start + chunk_rows].iterfeatures(na='null', show_bbox=False)))
+        separator = ', ' if start > 0 else ''
+        yield (separator + features[1:-1]).encode()
+
+    yield b']}'
+
+
+def _upload_body(df: gpd.GeoDataFrame, boundary: str, chunk_rows: int, compress: bool) -> Iterator[bytes]:
+    '''Stream the multipart body that uploads `df` as `geo.json`'''
+
+    body = multipart_stream('geo.json', geojson_chunks(df, chunk_rows), boundary)
+
+    return gzip_stream(body) if compress else body
+
+
+def _serialize_upload_body(df: gpd.GeoDataFrame, boundary: str, chunk_rows: int, compress: bool) -> bytes:
+    '''Serialize the whole multipart body that uploads `df`, e.g., in a worker process'''
+
+    return b''.join(_upload_body(df, boundary, chunk_rows, compress))
+
+
+def _check_dataframe(df: gpd.GeoDataFrame) -> None:
+    '''Check that `df` can be uploaded'''
+
     if len(df) == 0:
         raise InputException("Cannot upload empty dataframe")
 
     if df.crs is None:
         raise InputException("Dataframe must have a specified crs")
 
+
+def _post_upload(body: Union[bytes, Iterator[bytes]], boundary: str, compress: bool, timeout: int) -> UploadId:
+    '''Send the multipart `body` of an upload'''
+
     session = get_session()
 
-    df_json = df.to_json()
+    headers = {**session.auth_header, 'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
 
-    response = req.post(f'{session.server_url}/upload',
-                        files={"geo.json": df_json},
-                        headers=session.auth_header,
-                        timeout=timeout).json()
+    response = session.requests_session.post(f'{session.server_url}/upload',
+                                             data=body,
+                                             headers=headers,
+                                             timeout=timeout).json()
 
     if 'error' in response:
         raise GeoEngineException(response)
 
-    upload_id = UploadId.from_response(response)
+    return UploadId.from_response(response)
+
+
+def _create_ogr_dataset(  # pylint: disable=too-many-arguments
+        df: gpd.GeoDataFrame,
+        upload_id: UploadId,
+        name: str,
+        time: OgrSourceDatasetTimeType,
+        on_error: OgrOnError,
+        timeout: int) -> DatasetId:
+    '''Create a dataset that loads the GeoJSON upload of `df`'''
+
+    session = get_session()
 
     vector_type = VectorDataType.from_geopandas_type_name(df.geom_type[0])
 
@@ -492,17 +552,350 @@ def upload_dataframe(
         })
     })
 
-    response = req.post(f'{session.server_url}/dataset',
-                        json=create, headers=session.auth_header,
-                        timeout=timeout
-                        ).json()
+    response = session.requests_session.post(f'{session.server_url}/dataset',
+                                             json=create, headers=session.auth_header,
+                                             timeout=timeout
+                                             ).json()
 
     if 'error' in response:
         raise GeoEngineException(response)
 
+    _invalidate_datasets(session)
+
     return DatasetId(response["id"])
 
 
+@instrumented('upload_dataframe', '/upload')
+def upload_dataframe(  # pylint: disable=too-many-arguments
+        df: gpd.GeoDataFrame,
+        name: str = "Upload from Python",
+        time: OgrSourceDatasetTimeType = OgrSourceDatasetTimeType.none(),
+        on_error: OgrOnError = OgrOnError.ABORT,
+        timeout: int = 3600,
+        chunk_rows: int = DEFAULT_UPLOAD_CHUNK_ROWS,
+        compress: bool = False) -> DatasetId:
+    '''
+    Uploads a given dataframe to Geo Engine and returns the id of the created dataset
+
+    The dataframe is serialized to GeoJSON in chunks of `chunk_rows` rows and streamed to the server, so the
+    memory usage does not grow with the size of the dataframe. If `compress` is True, the body is sent
+    gzip-compressed with `Content-Encoding: gzip`, which the server has to support.
+    '''
+
+    _check_dataframe(df)
+
+    if chunk_rows < 1:
+        raise InputException('chunk_rows must be positive')
+
+    boundary = uuid4().hex
+    upload_id = _post_upload(_upload_body(df, boundary, chunk_rows, compress), boundary, compress, timeout)
+
+    return _create_ogr_dataset(df, upload_id, name, time, on_error, timeout)
+
+
+class UploadResult(NamedTuple):
+    '''The outcome of uploading one dataframe of a batch'''
+
+    dataset_id: Optional[DatasetId]
+    error: Optional[Exception]
+
+    @property
+    def ok(self) -> bool:  # pylint: disable=invalid-name
+        '''Whether the dataset was created'''
+        return self.error is None
+
+
+@instrumented('upload_dataframes', '/upload')
+def upload_dataframes(  # pylint: disable=too-many-arguments
+        dfs: Sequence[gpd.GeoDataFrame],
+        names: Optional[Sequence[str]] = None,
+        time: OgrSourceDatasetTimeType = OgrSourceDatasetTimeType.none(),
+        on_error: OgrOnError = OgrOnError.ABORT,
+        timeout: int = 3600,
+        upload_workers: int = 4,
+        serialization_workers: Optional[int] = None,
+        compress: bool = False) -> List[UploadResult]:
+    '''
+    Upload many dataframes concurrently and return the outcome of each one in input order
+
+    The dataframes are serialized on a process pool of `serialization_workers` processes, while the uploads and
+    the creation of the datasets run on a thread pool of `upload_workers`. By default, one CPU is left to this
+    process and at most `upload_workers` processes are used. If `serialization_workers` is 0, the dataframes are
+    streamed from the upload threads instead, which avoids spawning processes and copying the dataframes to them.
+    At most `upload_workers` dataframes are serialized or uploaded at a time.
+
+    A failing dataframe does not abort the batch, its error is returned in its `UploadResult` instead.
+    The worker processes are spawned, so scripts that call this function must guard their entry point with
+    `if __name__ == '__main__':`.
+    '''
+
+    if names is None:
+        names = ["Upload from Python"] * len(dfs)
+    if len(names) != len(dfs):
+        raise InputException('There must be one name per dataframe')
+    if upload_workers < 1:
+        raise InputException('upload_workers must be positive')
+    if serialization_workers is None:
+        serialization_workers = min((os.cpu_count() or 1) - 1, upload_workers)
+    if serialization_workers < 0:
+        raise InputException('serialization_workers must not be negative')
+
+    processes = ProcessPoolExecutor(serialization_workers, mp_context=multiprocessing.get_context('spawn')) \
+        if serialization_workers > 0 and len(dfs) > 0 else None
+
+    def upload(df: gpd.GeoDataFrame, name: str) -> UploadResult:
+        try:
+            _check_dataframe(df)
+
+            boundary = uuid4().hex
+            body: Union[bytes, Iterator[bytes]]
+            if processes is None:
+                body = _upload_body(df, boundary, DEFAULT_UPLOAD_CHUNK_ROWS, compress)
+            else:
+                body = processes.submit(_serialize_upload_body, df, boundary, DEFAULT_UPLOAD_CHUNK_ROWS,
+                                        compress).result()
+
+            upload_id = _post_upload(body, boundary, compress, timeout)
+
+            return UploadResult(_create_ogr_dataset(df, upload_id, name, time, on_error, timeout), None)
+        except Exception as error:  # pylint: disable=broad-except
+            debug(f'Failed to upload dataframe {name!r}: {error!r}')
+            return UploadResult(None, error)
+
+    try:
+        with ThreadPoolExecutor(max_workers=upload_workers) as threads:
+            return list(threads.map(bind_operation(upload), dfs, names))
+    finally:
+        if processes is not None:
+            processes.shutdown()
+
+
+RESUMABLE_UPLOAD_PATH = '/upload/tus'
+
+TUS_VERSION = '1.0.0'
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class ResumableUploadState(NamedTuple):
+    '''The progress of a resumable upload, which is persisted after every acknowledged part'''
+
+    url: str
+    file_name: str
+    size: int
+    sha256: str
+    part_size: int
+    offset: int
+
+    @property
+    def upload_id(self) -> UploadId:
+        '''The id of the upload, which is the last segment of its url'''
+        return UploadId(UUID(self.url.rstrip('/').rsplit('/', 1)[-1]))
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict())  # pylint: disable=no-member
+
+    @classmethod
+    def from_json(cls, content: str) -> ResumableUploadState:
+        return ResumableUploadState(**json.loads(content))
+
+
+def _file_digest(path: Union[str, PathLike]) -> Tuple[int, str]:
+    '''Return the size and the SHA-256 digest of a file'''
+
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+            size += len(block)
+
+    return (size, digest.hexdigest())
+
+
+def _resumable_state_path(state_directory: Optional[Union[str, PathLike]],
+                          server_url: str,
+                          file_name: str,
+                          sha256: str) -> str:
+    '''Return the path of the state file of uploading a file with `sha256` to `server_url`'''
+
+    if state_directory is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        state_directory = os.path.join(cache_home, 'geoengine', 'uploads')
+
+    os.makedirs(state_directory, exist_ok=True)
+
+    key = hashlib.sha256(f'{server_url}\n{file_name}\n{sha256}'.encode()).hexdigest()
+
+    return os.path.join(state_directory, key + '.json')
+
+
+def _save_resumable_state(path: str, state: ResumableUploadState) -> None:
+    '''Atomically persist the state of an upload'''
+
+    temporary_path = f'{path}.{uuid4().hex}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        file.write(state.to_json())
+    os.replace(temporary_path, path)
+
+
+def _load_resumable_state(path: str) -> Optional[ResumableUploadState]:
+    '''Load the state of an unfinished upload if there is one'''
+
+    try:
+        with open(path, encoding='utf-8') as file:
+            return ResumableUploadState.from_json(file.read())
+    except FileNotFoundError:
+        return None
+    except (ValueError, TypeError):  # a corrupt state starts over
+        return None
+
+
+def _tus_headers(**headers: str) -> Dict[str, str]:
+    '''Build the headers of a request of the tus protocol'''
+    return {**get_session().auth_header, 'Tus-Resumable': TUS_VERSION, **headers}
+
+
+def _create_resumable_upload(endpoint: str, file_name: str, size: int, sha256: str, part_size: int,
+                             timeout: int) -> ResumableUploadState:
+    '''Announce an upload to the server at its `endpoint` for resumable uploads'''
+    # pylint: disable=too-many-arguments
+
+    session = get_session()
+
+    encoded_name = base64.b64encode(file_name.encode()).decode()
+
+    response = session.requests_session.post(
+        f'{session.server_url}{endpoint}',
+        headers=_tus_headers(**{'Upload-Length': str(size), 'Upload-Metadata': f'filename {encoded_name}'}),
+        timeout=timeout
+    )
+
+    if response.status_code != 201 or 'Location' not in response.headers:
+        check_response_for_error(response)
+        raise GeoEngineException({'error': 'ResumableUpload', 'message': 'The server did not create the upload'})
+
+    url = urllib.parse.urljoin(f'{session.server_url}{endpoint}', response.headers['Location'])
+
+    return ResumableUploadState(url, file_name, size, sha256, part_size, 0)
+
+
+def _resumable_upload_offset(state: ResumableUploadState, timeout: int) -> Optional[int]:
+    '''Ask the server for the acknowledged offset of an upload, or None if it does not know the upload anymore'''
+
+    response = get_session().requests_session.head(state.url, headers=_tus_headers(), timeout=timeout)
+
+    if response.status_code in (403, 404, 410):
+        return None
+
+    check_response_for_error(response)
+
+    offset = int(response.headers['Upload-Offset'])
+    if offset > state.size:
+        return None
+
+    return offset
+
+
+class _PartRejected(Exception):
+    '''The server rejected a part because of its checksum or offset or a transient error'''
+
+
+def _send_part(state: ResumableUploadState, part: bytes, timeout: int) -> int:
+    '''Send the part at the offset of `state` and return the new offset'''
+
+    checksum = base64.b64encode(hashlib.sha256(part).digest()).decode()
+
+    response = get_session().requests_session.patch(
+        state.url,
+        data=part,
+        headers=_tus_headers(**{
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': str(state.offset),
+            'Upload-Checksum': f'sha256 {checksum}',
+        }),
+        timeout=timeout
+    )
+
+    # the part was corrupted on the way, the offsets diverged or the server is temporarily unavailable
+    if response.status_code in (409, 460) or response.status_code in RETRYABLE_STATUS_CODES:
+        raise _PartRejected(f'The part at offset {state.offset} was rejected with {response.status_code}')
+
+    check_response_for_error(response)
+
+    return int(response.headers['Upload-Offset'])
+
+
+def upload_file_resumable(  # pylint: disable=too-many-arguments,too-many-locals
+        path: Union[str, PathLike],
+        file_name: Optional[str] = None,
+        part_size: int = DEFAULT_PART_SIZE,
+        state_directory: Optional[Union[str, PathLike]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        endpoint: str = RESUMABLE_UPLOAD_PATH,
+        timeout: int = 60) -> UploadId:
+    '''
+    Upload the file at `path` in parts of `part_size` bytes with the tus resumable upload protocol
+
+    The server has to support the tus protocol at `endpoint`, a path relative to the server URL.
+    Every part is sent with a SHA-256 checksum. After each part that the server acknowledged, the progress is
+    persisted in `state_directory`, which defaults to the user's cache directory. If a part fails, the upload asks
+    the server for the acknowledged offset and resumes from there, as often as `retry_policy` allows. Calling this
+    function again for the same file and server, e.g., after the process was interrupted, resumes the upload, too.
+    '''
+
+    if part_size < 1:
+        raise InputException('part_size must be positive')
+
+    session = get_session()
+    policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+    file_name = file_name if file_name is not None else os.path.basename(path)
+    (size, sha256) = _file_digest(path)
+    if size == 0:
+        raise InputException('Cannot upload an empty file')
+
+    state_path = _resumable_state_path(state_directory, f'{session.server_url}{endpoint}', file_name, sha256)
+    state = _load_resumable_state(state_path)
+    synchronized = False
+    attempt = 1
+
+    with open(path, 'rb') as file:
+        while state is None or state.offset < state.size or not synchronized:
+            try:
+                if state is None:
+                    state = _create_resumable_upload(endpoint, file_name, size, sha256, part_size, timeout)
+                    _save_resumable_state(state_path, state)
+                    synchronized = True
+                elif not synchronized:
+                    offset = _resumable_upload_offset(state, timeout)
+                    state = None if offset is None else state._replace(offset=offset)
+                    synchronized = state is not None
+                    continue
+
+                file.seek(state.offset)
+                part = file.read(min(state.part_size, state.size - state.offset))
+
+                offset = _send_part(state, part, timeout)
+            except (*RETRYABLE_EXCEPTIONS, _PartRejected) as error:
+                if attempt >= policy.max_attempts:
+                    raise
+                delay = policy.backoff(attempt)
+                debug(f'Resuming the upload of {file_name} in {delay:.2f}s after {error!r}')
+                sleep(delay)
+                attempt += 1
+                synchronized = False
+                continue
+
+            state = state._replace(offset=offset)
+            _save_resumable_state(state_path, state)
+            attempt = 1
+
+    os.remove(state_path)
+
+    return state.upload_id
+
+
 class StoredDataset(NamedTuple):
     '''The result of a store dataset request is a combination of `upload_id` and `dataset_id`'''
 
@@ -540,15 +933,16 @@ class Volume:
         return Volume(response['name'], response['path'])
 
 
+@instrumented('volumes', '/dataset/volumes')
 def volumes(timeout: int = 60) -> List[Volume]:
     '''Returns a list of all volumes'''
 
     session = get_session()
 
-    response = req.get(f'{session.server_url}/dataset/volumes',
-                       headers=session.admin_auth_header,
-                       timeout=timeout
-                       ).json()
+    response = session.requests_session.cached_get(f'{session.server_url}/dataset/volumes',
+                                                   headers=session.admin_auth_header,
+                                                   timeout=timeout
+                                                   ).json()
 
     return [Volume.from_response(v) for v in response]
 
@@ -576,14 +970,16 @@ def add_public_raster_dataset(volume_id: VolumeId, properties: DatasetProperties
     headers = session.admin_auth_header
     headers['Content-Type'] = 'application/json'
 
-    response = req.post(f'{session.server_url}/dataset',
-                        data=data, headers=headers,
-                        timeout=timeout
-                        ).json()
+    response = session.requests_session.post(f'{session.server_url}/dataset',
+                                             data=data, headers=headers,
+                                             timeout=timeout
+                                             ).json()
 
     if 'error' in response:
         raise GeoEngineException(response)
 
+    _invalidate_datasets(session)
+
     return DatasetId.from_response(response)
 
 
@@ -592,10 +988,18 @@ def delete_dataset(dataset_id: DatasetId, timeout: int = 60) -> None:
 
     session = get_session()
 
-    response = req.delete(f'{session.server_url}/dataset/{dataset_id}',
-                          headers=session.admin_or_normal_auth_header,
-                          timeout=timeout)
+    response = session.requests_session.delete(f'{session.server_url}/dataset/{dataset_id}',
+                                               headers=session.admin_or_normal_auth_header,
+                                               timeout=timeout)
 
     if response.status_code != 200:
         error_json = response.json()
         raise GeoEngineException(error_json)
+
+    _invalidate_datasets(session)
+
+
+def _invalidate_datasets(session: Session) -> None:
+    '''Remove the cached datasets and the layers that list them after a dataset was added or deleted'''
+
+    session.requests_session.invalidate_cache(f'{session.server_url}/dataset', f'{session.server_url}/layers/')
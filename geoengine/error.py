@@ -2,7 +2,8 @@
 Package errors and backend mapped error types
 '''
 
-from typing import Dict, Union
+from typing import Dict, Optional, Union
+from xml.etree import ElementTree
 from requests import Response, HTTPError
 from geoengine import api
 
@@ -161,3 +162,44 @@ def check_response_for_error(response: Response) -> None:
 
     # raise `HTTPError` if `GeoEngineException` or any other was not thrown
     raise exception
+
+
+def check_ows_response_for_error(response: Response) -> None:
+    '''
+    Checks a `Response` of an OGC web service (e.g., WCS) for an error and raises it if there is one.
+
+    Client errors and exception reports are raised as `owslib.util.ServiceException`,
+    all other errors as `HTTPError`.
+    '''
+
+    if response.status_code in [400, 401]:
+        from owslib.util import ServiceException  # pylint: disable=import-outside-toplevel
+        raise ServiceException(response.text)
+
+    response.raise_for_status()
+
+    # check for service exceptions without the http error status set
+    check_ows_exception_report(response.headers.get('Content-Type'), response.content)
+
+
+def check_ows_exception_report(content_type: Optional[str], content: bytes) -> None:
+    '''
+    Checks the body of a successful OGC web service response for an exception report and raises it if there is one.
+    '''
+
+    if content_type not in ['text/xml', 'application/xml', 'application/vnd.ogc.se_xml']:
+        return
+
+    exception_tags = [
+        '{http://www.opengis.net/ows}Exception',
+        '{http://www.opengis.net/ows/1.1}Exception',
+        '{http://www.opengis.net/ogc}ServiceException',
+        'ServiceException',
+    ]
+
+    tree = ElementTree.fromstring(content)
+    for exception_tag in exception_tags:
+        service_exception = tree.find(exception_tag)
+        if service_exception is not None:
+            from owslib.util import ServiceException  # pylint: disable=import-outside-toplevel
+            raise ServiceException('\n'.join(t.strip() for t in service_exception.itertext() if t.strip()))
@@ -0,0 +1,336 @@
+'''
+An HTTP cache for metadata responses that revalidates them with conditional requests
+'''
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from logging import debug
+from os import PathLike
+from threading import Lock
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Union
+
+import requests as req
+from requests.structures import CaseInsensitiveDict
+
+from geoengine.error import InputException
+
+# the headers that are stored with a response and merged from a `304 Not Modified`
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'Date')
+
+
+class HttpCacheStats(NamedTuple):
+    '''Statistics of an `HttpCache`'''
+
+    hits: int
+    revalidations: int
+    misses: int
+    entries: int
+
+    @property
+    def hit_rate(self) -> float:
+        '''The share of lookups that were answered without downloading the response again'''
+        lookups = self.hits + self.revalidations + self.misses
+        if lookups == 0:
+            return 0.0
+        return (self.hits + self.revalidations) / lookups
+
+
+class _Entry(NamedTuple):
+    '''A stored response'''
+
+    headers: Dict[str, str]
+    content: bytes
+    fresh_until: float
+
+
+class HttpCache:  # pylint: disable=too-many-instance-attributes
+    '''
+    A cache for `GET` responses that is kept in memory or, if a `path` is given, persisted in an SQLite database
+
+    Responses are fresh for the `max-age` of their `Cache-Control` header or until their `Expires` date.
+    Stale responses with an `ETag` or `Last-Modified` validator are revalidated with a conditional request, so an
+    unchanged response costs a `304 Not Modified` instead of the download. Responses without validators and
+    freshness information are reused for `default_ttl_seconds`.
+    Entries are keyed by URL and authorization, so sessions of different users do not share responses.
+    At most `max_entries` responses are kept, the least recently used ones are evicted first.
+    '''
+
+    __path: Optional[str]
+    __connection: Optional[sqlite3.Connection]
+    __default_ttl_seconds: float
+    __max_entries: int
+    __lock: Lock
+    __hits: int = 0
+    __revalidations: int = 0
+    __misses: int = 0
+
+    def __init__(self,
+                 path: Optional[Union[str, PathLike]] = None,
+                 default_ttl_seconds: float = 60.0,
+                 max_entries: int = 1024) -> None:
+        '''Create a cache that is persisted in the SQLite database at `path` if it is given'''
+
+        if default_ttl_seconds < 0:
+            raise InputException('default_ttl_seconds must not be negative')
+        if max_entries < 1:
+            raise InputException('max_entries must be positive')
+
+        self.__path = os.fspath(path) if path is not None else None
+        self.__default_ttl_seconds = default_ttl_seconds
+        self.__max_entries = max_entries
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(self.__path or ':memory:', check_same_thread=False)
+
+        with self.__connection:
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, url TEXT NOT NULL, headers TEXT NOT NULL, content BLOB NOT NULL, '
+                'fresh_until REAL NOT NULL, used_at REAL NOT NULL)'
+            )
+
+    def __repr__(self) -> str:
+        return f'HttpCache(path={self.__path!r}, default_ttl_seconds={self.__default_ttl_seconds!r}, ' \
+            f'max_entries={self.__max_entries!r})'
+
+    def __enter__(self) -> HttpCache:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def key(url: str, headers: Optional[Mapping[str, str]] = None) -> str:
+        '''Build the key of a response, which depends on the URL and the authorization of the request'''
+
+        authorization = CaseInsensitiveDict(headers or {}).get('Authorization', '')
+
+        return hashlib.sha256(f'{url}\n{authorization}'.encode()).hexdigest()
+
+    def get(self,
+            http_session: req.Session,
+            url: str,
+            headers: Optional[Mapping[str, str]] = None,
+            timeout: Optional[float] = None) -> req.Response:
+        '''
+        Return the response to a `GET` of `url` from the cache or request it with `http_session`
+
+        Responses other than `200 OK` are returned as they are and not stored.
+        '''
+
+        key = HttpCache.key(url, headers)
+        entry = self.__lookup(key)
+
+        if entry is not None and entry.fresh_until > time.time():
+            self.__count(hits=1)
+            return _cached_response(url, entry)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            validators = CaseInsensitiveDict(entry.headers)
+            if 'ETag' in validators:
+                request_headers['If-None-Match'] = validators['ETag']
+            if 'Last-Modified' in validators:
+                request_headers['If-Modified-Since'] = validators['Last-Modified']
+
+        response = http_session.get(url, headers=request_headers, timeout=timeout)
+
+        if response.status_code == 304 and entry is not None:
+            self.__count(revalidations=1)
+            debug(f'Revalidated {url}')
+
+            merged_headers = {**entry.headers, **_stored_headers(response.headers)}
+            entry = _Entry(merged_headers, entry.content, self.__fresh_until(merged_headers, time.time()) or 0.0)
+            self.__store(key, url, entry)
+
+            return _cached_response(url, entry)
+
+        self.__count(misses=1)
+
+        if response.status_code == 200:
+            stored_headers = _stored_headers(response.headers)
+            fresh_until = self.__fresh_until(stored_headers, time.time())
+            if fresh_until is not None:
+                self.__store(key, url, _Entry(stored_headers, response.content, fresh_until))
+
+        return response
+
+    def __fresh_until(self, headers: Mapping[str, str], now: float) -> Optional[float]:
+        '''Return until when a response with `headers` is fresh, or None if it must not be stored'''
+        # pylint: disable=too-many-return-statements
+
+        headers = CaseInsensitiveDict(headers)
+        directives = _cache_control(headers.get('Cache-Control', ''))
+        has_validator = 'ETag' in headers or 'Last-Modified' in headers
+
+        if 'no-store' in directives:
+            return None
+
+        if 'no-cache' in directives:
+            return now if has_validator else None
+
+        max_age = directives.get('max-age')
+        if max_age is not None and max_age.isdigit():
+            return now + int(max_age)
+
+        expires = _parse_http_date(headers.get('Expires'))
+        if expires is not None:
+            return expires
+
+        if has_validator:
+            return now
+
+        if self.__default_ttl_seconds <= 0:
+            return None
+
+        return now + self.__default_ttl_seconds
+
+    def __lookup(self, key: str) -> Optional[_Entry]:
+        '''Return the entry for `key` and mark it as recently used'''
+
+        with self.__lock:
+            connection = self.__open_connection()
+            with connection:
+                row = connection.execute(
+                    'SELECT headers, content, fresh_until FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                connection.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+
+        return _Entry(json.loads(row[0]), bytes(row[1]), row[2])
+
+    def __store(self, key: str, url: str, entry: _Entry) -> None:
+        '''Store an entry and evict the least recently used ones beyond `max_entries`'''
+
+        with self.__lock:
+            connection = self.__open_connection()
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO responses (key, url, headers, content, fresh_until, used_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, url, json.dumps(entry.headers), entry.content, entry.fresh_until, time.time())
+                )
+                connection.execute(
+                    'DELETE FROM responses WHERE key IN '
+                    '(SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                    (self.__max_entries,)
+                )
+
+    def __count(self, hits: int = 0, revalidations: int = 0, misses: int = 0) -> None:
+        '''Add to the statistics'''
+
+        with self.__lock:
+            self.__hits += hits
+            self.__revalidations += revalidations
+            self.__misses += misses
+
+    def invalidate(self, url_prefix: str = '') -> int:
+        '''Remove the responses whose URL starts with `url_prefix` and return their number'''
+
+        pattern = url_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        with self.__lock:
+            connection = self.__open_connection()
+            with connection:
+                return connection.execute("DELETE FROM responses WHERE url LIKE ? ESCAPE '\\'", (pattern,)).rowcount
+
+    def clear(self) -> None:
+        '''Remove all responses and reset the statistics'''
+
+        with self.__lock:
+            connection = self.__open_connection()
+            with connection:
+                connection.execute('DELETE FROM responses')
+
+            self.__hits = 0
+            self.__revalidations = 0
+            self.__misses = 0
+
+    @property
+    def stats(self) -> HttpCacheStats:
+        '''Return the statistics of this cache since it was created'''
+
+        with self.__lock:
+            entries = self.__open_connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+            return HttpCacheStats(
+                hits=self.__hits,
+                revalidations=self.__revalidations,
+                misses=self.__misses,
+                entries=entries,
+            )
+
+    def close(self) -> None:
+        '''Close the database. The cache cannot be used afterwards.'''
+
+        with self.__lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+    def __open_connection(self) -> sqlite3.Connection:
+        '''Return the database connection or raise if the cache was closed'''
+
+        if self.__connection is None:
+            raise InputException('The HTTP cache is closed')
+
+        return self.__connection
+
+
+def _stored_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    '''Select the headers of a response that are stored'''
+
+    headers = CaseInsensitiveDict(headers)
+
+    return {name: headers[name] for name in STORED_HEADERS if name in headers}
+
+
+def _cache_control(value: str) -> Dict[str, Optional[str]]:
+    '''Parse the directives of a `Cache-Control` header'''
+
+    directives: Dict[str, Optional[str]] = {}
+    for directive in value.split(','):
+        (name, _, argument) = directive.partition('=')
+        name = name.strip().lower()
+        if name:
+            directives[name] = argument.strip().strip('"') if argument else None
+
+    return directives
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    '''Parse an HTTP date into a timestamp'''
+
+    if value is None:
+        return None
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return date.timestamp()
+
+
+def _cached_response(url: str, entry: _Entry) -> req.Response:
+    '''Build a `200 OK` response from a stored entry'''
+
+    response = req.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response.encoding = req.utils.get_encoding_from_headers(response.headers)
+    response._content = entry.content  # pylint: disable=protected-access
+
+    return response
@@ -0,0 +1,478 @@
+'''
+Instrumentation of the calls to a Geo Engine instance
+
+Instruments are added to a session and receive an `OperationStart` and an `OperationEnd` event for every
+instrumented call, e.g. `Workflow.get_xarray`. The end event carries the time spent in each phase:
+connecting, waiting for the first byte, downloading and decoding.
+'''
+
+from __future__ import annotations
+
+import bisect
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from logging import warning
+from os import PathLike
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, \
+    TypeVar, Union, cast
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PHASE_CONNECT = 'connect'
+'''Establishing new connections, including the TLS handshake'''
+
+PHASE_TTFB = 'ttfb'
+'''Waiting for the first byte of the responses after sending the requests, i.e. the server compute time'''
+
+PHASE_DOWNLOAD = 'download'
+'''Receiving the response bodies'''
+
+PHASE_DECODE = 'decode'
+'''Decoding the responses into arrays, images or data frames'''
+
+PHASES = (PHASE_CONNECT, PHASE_TTFB, PHASE_DOWNLOAD, PHASE_DECODE)
+
+# latency bucket bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class OperationStart(NamedTuple):
+    '''The start of an instrumented operation'''
+
+    operation_id: int
+    name: str
+    endpoint: str
+    start_time: float
+
+
+class OperationEnd(NamedTuple):
+    '''The end of an instrumented operation with the accumulated metrics of all its requests'''
+
+    operation_id: int
+    name: str
+    endpoint: str
+    start_time: float
+    duration_seconds: float
+    status_code: Optional[int]
+    requests: int
+    retries: int
+    bytes_sent: int
+    bytes_received: int
+    phases: Dict[str, float]
+    error: Optional[BaseException]
+
+
+class Instrument:
+    '''
+    Base class for receivers of operation events
+
+    Override `on_start` and `on_end`. Both are called on the thread that runs the operation and should return
+    quickly. Exceptions are logged and do not affect the operation.
+    '''
+
+    def on_start(self, event: OperationStart) -> None:
+        '''Handle the start of an operation'''
+
+    def on_end(self, event: OperationEnd) -> None:
+        '''Handle the end of an operation'''
+
+
+class Operation:  # pylint: disable=too-many-instance-attributes
+    '''
+    The metrics of a running operation
+
+    Requests and phases may be recorded concurrently by the worker threads of the operation.
+    '''
+
+    __ids: Iterator[int] = itertools.count(1)
+
+    __lock: Lock
+
+    def __init__(self, name: str, endpoint: str) -> None:
+        '''Start a new operation'''
+        self.operation_id = next(Operation.__ids)
+        self.name = name
+        self.endpoint = endpoint
+        self.start_time = time.time()
+        self.status_code: Optional[int] = None
+        self.requests = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.phases: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.__start = time.perf_counter()
+        self.__lock = Lock()
+
+    def record_request(self,  # pylint: disable=too-many-arguments
+                       status_code: Optional[int],
+                       bytes_sent: int,
+                       bytes_received: int,
+                       connect_seconds: float,
+                       ttfb_seconds: float,
+                       download_seconds: float) -> None:
+        '''Add the metrics of a finished request'''
+
+        with self.__lock:
+            self.requests += 1
+            if status_code is not None:
+                self.status_code = status_code
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+            self.phases[PHASE_CONNECT] += connect_seconds
+            self.phases[PHASE_TTFB] += ttfb_seconds
+            self.phases[PHASE_DOWNLOAD] += download_seconds
+
+    def record_download(self, bytes_received: int, seconds: float) -> None:
+        '''Add a response body that was streamed after the request finished'''
+
+        with self.__lock:
+            self.bytes_received += bytes_received
+            self.phases[PHASE_DOWNLOAD] += seconds
+
+    def record_retry(self) -> None:
+        '''Count a retried request'''
+
+        with self.__lock:
+            self.retries += 1
+
+    def add_phase(self, phase_name: str, seconds: float) -> None:
+        '''Add time to a phase'''
+
+        with self.__lock:
+            self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def start_event(self) -> OperationStart:
+        '''Return the start event of this operation'''
+        return OperationStart(self.operation_id, self.name, self.endpoint, self.start_time)
+
+    def end_event(self, error: Optional[BaseException] = None) -> OperationEnd:
+        '''Return the end event of this operation'''
+
+        with self.__lock:
+            return OperationEnd(
+                operation_id=self.operation_id,
+                name=self.name,
+                endpoint=self.endpoint,
+                start_time=self.start_time,
+                duration_seconds=time.perf_counter() - self.__start,
+                status_code=self.status_code,
+                requests=self.requests,
+                retries=self.retries,
+                bytes_sent=self.bytes_sent,
+                bytes_received=self.bytes_received,
+                phases=dict(self.phases),
+                error=error,
+            )
+
+
+_current_operation: ContextVar[Optional[Operation]] = ContextVar('geoengine_operation', default=None)
+
+# returns the instruments of the current session, set by the session module to avoid a cyclic import
+_instruments_provider: Callable[[], Sequence[Instrument]] = lambda: ()
+
+
+def set_instruments_provider(provider: Callable[[], Sequence[Instrument]]) -> None:
+    '''Set the function that returns the instruments of the current session'''
+    global _instruments_provider  # pylint: disable=global-statement
+    _instruments_provider = provider
+
+
+def current_operation() -> Optional[Operation]:
+    '''Return the operation that is running in the current context, if it is instrumented'''
+    return _current_operation.get()
+
+
+def _notify(instruments: Sequence[Instrument], method: str, event: Any) -> None:
+    '''Call `method` of all instruments with `event` and log their errors'''
+
+    for instrument in instruments:
+        try:
+            getattr(instrument, method)(event)
+        except Exception as error:  # pylint: disable=broad-except
+            warning(f'Instrument {instrument!r} failed to handle {type(event).__name__}: {error!r}')
+
+
+@contextmanager
+def run_operation(instruments: Sequence[Instrument], name: str, endpoint: str) -> Iterator[Optional[Operation]]:
+    '''
+    Run an operation and report it to `instruments`
+
+    Operations that run within another operation are accounted to the outer one.
+    '''
+
+    if not instruments or current_operation() is not None:
+        yield current_operation()
+        return
+
+    operation = Operation(name, endpoint)
+    _notify(instruments, 'on_start', operation.start_event())
+
+    token = _current_operation.set(operation)
+    try:
+        yield operation
+    except BaseException as error:
+        _notify(instruments, 'on_end', operation.end_event(error))
+        raise
+    else:
+        _notify(instruments, 'on_end', operation.end_event())
+    finally:
+        _current_operation.reset(token)
+
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+def instrumented(name: str, endpoint: str) -> Callable[[F], F]:
+    '''Decorate a function as an operation that is reported to the instruments of the current session'''
+
+    def decorator(function: F) -> F:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            instruments = _instruments_provider()
+            if not instruments:
+                return function(*args, **kwargs)
+
+            with run_operation(instruments, name, endpoint):
+                return function(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def bind_operation(function: F) -> F:
+    '''Run `function` within the current operation, e.g. on the worker thread of a thread pool'''
+
+    operation = current_operation()
+    if operation is None:
+        return function
+
+    @wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        token = _current_operation.set(operation)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_operation.reset(token)
+
+    return cast(F, wrapper)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    '''Account the time of the block to phase `name` of the current operation'''
+
+    operation = current_operation()
+    if operation is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        operation.add_phase(name, time.perf_counter() - start)
+
+
+class Histogram:
+    '''A histogram of observed values with fixed bucket bounds'''
+
+    bounds: Tuple[float, ...]
+    counts: List[int]
+    count: int
+    sum: float
+    min: float
+    max: float
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        '''Create an empty histogram whose last bucket holds all values above the last bound'''
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def __repr__(self) -> str:
+        return f'Histogram(count={self.count!r}, mean={self.mean!r}, max={self.max!r})'
+
+    def observe(self, value: float) -> None:
+        '''Add a value'''
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        '''The mean of all values'''
+        return self.sum / self.count if self.count > 0 else 0.0
+
+    def quantile(self, q: float) -> float:
+        '''Estimate the `q`-quantile by interpolating within its bucket'''
+
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for (i, bucket_count) in enumerate(self.counts):
+            if bucket_count > 0 and cumulative + bucket_count >= rank:
+                lower = max(self.bounds[i - 1] if i > 0 else self.min, self.min)
+                upper = min(self.bounds[i] if i < len(self.bounds) else self.max, self.max)
+                return lower + (upper - lower) * max(rank - cumulative, 0) / bucket_count
+            cumulative += bucket_count
+
+        return self.max
+
+
+class HistogramCollector(Instrument):
+    '''
+    An instrument that collects the durations and phases of all operations in memory
+
+    The histograms are keyed by operation name and metric, which is `total` for the duration of the operation
+    or the name of a phase.
+    '''
+
+    __histograms: Dict[Tuple[str, str], Histogram]
+    __counters: Dict[Tuple[str, str], int]
+    __bounds: Tuple[float, ...]
+    __lock: Lock
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        '''Create a collector whose histograms have the bucket `bounds` in seconds'''
+        self.__bounds = tuple(bounds)
+        self.__histograms = {}
+        self.__counters = {}
+        self.__lock = Lock()
+
+    def on_end(self, event: OperationEnd) -> None:
+        with self.__lock:
+            for (metric, value) in [('total', event.duration_seconds), *event.phases.items()]:
+                key = (event.name, metric)
+                if key not in self.__histograms:
+                    self.__histograms[key] = Histogram(self.__bounds)
+                self.__histograms[key].observe(value)
+
+            for (counter, value) in [('errors', int(event.error is not None)), ('requests', event.requests),
+                                     ('retries', event.retries), ('bytes_sent', event.bytes_sent),
+                                     ('bytes_received', event.bytes_received)]:
+                self.__counters[(event.name, counter)] = self.__counters.get((event.name, counter), 0) + value
+
+    def histogram(self, name: str, metric: str = 'total') -> Optional[Histogram]:
+        '''Return the histogram of `metric` for the operation `name`, if it was observed'''
+
+        with self.__lock:
+            return self.__histograms.get((name, metric))
+
+    def counter(self, name: str, counter: str) -> int:
+        '''Return the sum of `errors`, `requests`, `retries`, `bytes_sent` or `bytes_received` of `name`'''
+
+        with self.__lock:
+            return self.__counters.get((name, counter), 0)
+
+    def summary(self) -> pd.DataFrame:
+        '''Return the count, mean, median, 95th percentile and maximum of all histograms in seconds'''
+
+        with self.__lock:
+            rows = [
+                {
+                    'operation': name,
+                    'metric': metric,
+                    'count': histogram.count,
+                    'mean': histogram.mean,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'max': histogram.max,
+                }
+                for ((name, metric), histogram) in sorted(self.__histograms.items())
+            ]
+
+        import pandas  # pylint: disable=import-outside-toplevel
+
+        return pandas.DataFrame(rows, columns=['operation', 'metric', 'count', 'mean', 'p50', 'p95', 'max'])
+
+    def reset(self) -> None:
+        '''Remove all observations'''
+
+        with self.__lock:
+            self.__histograms.clear()
+            self.__counters.clear()
+
+
+class OtlpJsonFileExporter(Instrument):
+    '''
+    An instrument that appends every operation as an OpenTelemetry span to a file
+
+    Each line of the file is an OTLP/JSON `ExportTraceServiceRequest`, which can be read by the
+    OpenTelemetry Collector's `otlpjsonfile` receiver or any other OTLP tooling, without running a service.
+    '''
+
+    __path: str
+    __service_name: str
+    __lock: Lock
+
+    def __init__(self, path: Union[str, PathLike], service_name: str = 'geoengine-python') -> None:
+        '''Create an exporter that appends to the file at `path`'''
+        self.__path = os.fspath(path)
+        self.__service_name = service_name
+        self.__lock = Lock()
+
+    def __repr__(self) -> str:
+        return f'OtlpJsonFileExporter(path={self.__path!r}, service_name={self.__service_name!r})'
+
+    def on_end(self, event: OperationEnd) -> None:
+        start_nanos = int(event.start_time * 1e9)
+
+        attributes: Dict[str, Union[str, int, float]] = {
+            'geoengine.endpoint': event.endpoint,
+            'geoengine.requests': event.requests,
+            'geoengine.retries': event.retries,
+            'geoengine.bytes_sent': event.bytes_sent,
+            'geoengine.bytes_received': event.bytes_received,
+        }
+        if event.status_code is not None:
+            attributes['http.response.status_code'] = event.status_code
+        for (phase_name, seconds) in event.phases.items():
+            attributes[f'geoengine.phase.{phase_name}.seconds'] = seconds
+
+        status: Dict[str, Any] = {'code': 1}
+        if event.error is not None:
+            status = {'code': 2, 'message': f'{type(event.error).__name__}: {event.error}'}
+
+        span = {
+            'traceId': os.urandom(16).hex(),
+            'spanId': os.urandom(8).hex(),
+            'name': event.name,
+            'kind': 3,  # client
+            'startTimeUnixNano': str(start_nanos),
+            'endTimeUnixNano': str(start_nanos + int(event.duration_seconds * 1e9)),
+            'attributes': [_otlp_attribute(key, value) for (key, value) in attributes.items()],
+            'status': status,
+        }
+
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', self.__service_name)]},
+            'scopeSpans': [{'scope': {'name': 'geoengine'}, 'spans': [span]}],
+        }]})
+
+        with self.__lock, open(self.__path, 'a', encoding='utf-8') as file:
+            file.write(line + '\n')
+
+
+def _otlp_attribute(key: str, value: Union[str, int, float]) -> Dict[str, Any]:
+    '''Encode an attribute as an OTLP/JSON `KeyValue`'''
+
+    if isinstance(value, str):
+        return {'key': key, 'value': {'stringValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    return {'key': key, 'value': {'doubleValue': value}}
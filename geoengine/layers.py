@@ -3,19 +3,23 @@ A wrapper around the layer and layerDb API
 '''
 
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import auto
 from io import StringIO
+import itertools
 import os
-from typing import Any, Dict, Generic, List, NewType, Optional, TypeVar, Union, cast
+from typing import Any, Deque, Dict, Generic, Iterator, List, NewType, Optional, TypeVar, Union, cast
 from uuid import UUID
 import json
 import urllib
-import requests as req
 from strenum import LowercaseStrEnum
 from geoengine import api
-from geoengine.auth import get_session
-from geoengine.error import GeoEngineException, ModificationNotOnLayerDbException, check_response_for_error
+from geoengine.auth import Session, get_session
+from geoengine.error import GeoEngineException, InputException, ModificationNotOnLayerDbException, \
+    check_response_for_error
+from geoengine.instrumentation import bind_operation, instrumented
 from geoengine.tasks import Task, TaskId
 from geoengine.types import Symbology
 
@@ -26,6 +30,8 @@ LayerProviderId = NewType('LayerProviderId', UUID)
 LAYER_DB_PROVIDER_ID = LayerProviderId(UUID('ce5e84db-cbf9-48a2-9a32-d4b7cc56ea74'))
 LAYER_DB_ROOT_COLLECTION_ID = LayerCollectionId('05102bb3-a855-4a37-8a8a-30026a91fef1')
 
+DEFAULT_PAGE_SIZE = 20
+
 
 class LayerCollectionListingType(LowercaseStrEnum):
     LAYER = auto()
@@ -181,33 +187,10 @@ class LayerCollection:
 
         assert len(response_pages) > 0, 'No response pages'
 
-        def parse_listing(response: api.LayerCollectionListingResponse) -> Listing:
-            item_type = LayerCollectionListingType(item_response['type'])
-
-            if item_type is LayerCollectionListingType.LAYER:
-                layer_id_response = cast(api.LayerAndProviderIdResponse, response['id'])
-                return LayerListing(
-                    listing_id=LayerId(layer_id_response['layerId']),
-                    provider_id=LayerProviderId(UUID(layer_id_response['providerId'])),
-                    name=item_response['name'],
-                    description=item_response['description'],
-                )
-
-            if item_type is LayerCollectionListingType.COLLECTION:
-                collection_id_response = cast(api.LayerCollectionAndProviderIdResponse, response['id'])
-                return LayerCollectionListing(
-                    listing_id=LayerCollectionId(collection_id_response['collectionId']),
-                    provider_id=LayerProviderId(UUID(collection_id_response['providerId'])),
-                    name=item_response['name'],
-                    description=item_response['description'],
-                )
-
-            assert False, 'Invalid listing type'
-
         items = []
         for response in response_pages:
             for item_response in response['items']:
-                items.append(parse_listing(item_response))
+                items.append(_listing_from_response(item_response))
 
         response = response_pages[0]
 
@@ -498,7 +481,7 @@ class Layer:
         session = get_session()
 
         layer_id_quote = urllib.parse.quote_plus(str(self.layer_id))
-        response = req.post(
+        response = session.requests_session.post(
             url=f'{session.server_url}/layers/{self.provider_id}/{layer_id_quote}/dataset',
             headers=session.admin_auth_header,
             timeout=timeout
@@ -524,25 +507,67 @@ class Layer:
         })
 
 
+@instrumented('layer_collection', '/layers/collections')
 def layer_collection(layer_collection_id: Optional[LayerCollectionId] = None,
                      layer_provider_id: LayerProviderId = LAYER_DB_PROVIDER_ID,
-                     timeout: int = 60) -> LayerCollection:
+                     timeout: int = 60,
+                     page_size: int = DEFAULT_PAGE_SIZE,
+                     max_workers: int = 4) -> LayerCollection:
     '''
     Retrieve a layer collection that contains layers and layer collections.
+
+    The items are requested in pages of `page_size`. If the first page is full, the following pages are
+    requested concurrently on a thread pool of at most `max_workers`.
     '''
+    # pylint: disable=too-many-arguments
 
-    session = get_session()
+    pages = list(_layer_collection_pages(layer_collection_id, layer_provider_id, timeout, page_size, max_workers))
+
+    return LayerCollection.from_response(pages)
+
+
+def layer_collection_items(layer_collection_id: Optional[LayerCollectionId] = None,
+                           layer_provider_id: LayerProviderId = LAYER_DB_PROVIDER_ID,
+                           timeout: int = 60,
+                           page_size: int = DEFAULT_PAGE_SIZE,
+                           max_workers: int = 4) -> Iterator[Listing]:
+    '''
+    Iterate lazily over the layers and layer collections of a layer collection.
+
+    The items are yielded in order as soon as their page arrives, while the following pages are requested
+    concurrently on a thread pool of at most `max_workers`. Stopping the iteration stops requesting pages.
+    '''
+    # pylint: disable=too-many-arguments
 
-    request = '/layers/collections' if layer_collection_id is None \
-        else f'/layers/collections/{layer_provider_id}/{urllib.parse.quote_plus(str(layer_collection_id))}'
+    for page in _layer_collection_pages(layer_collection_id, layer_provider_id, timeout, page_size, max_workers):
+        for item_response in page['items']:
+            yield _listing_from_response(item_response)
 
-    page_limit = 20
-    pages: List[api.LayerCollectionResponse] = []
 
-    offset = 0
-    while True:
-        response = req.get(
-            f'{session.server_url}{request}?offset={offset}&limit={page_limit}',
+def _layer_collection_pages(layer_collection_id: Optional[LayerCollectionId],
+                            layer_provider_id: LayerProviderId,
+                            timeout: int,
+                            page_size: int,
+                            max_workers: int) -> Iterator[api.LayerCollectionResponse]:
+    '''
+    Request the pages of a layer collection and yield them in order
+
+    The first page is always yielded. If it is full, `max_workers` pages are kept in flight until a page is
+    not full anymore, which ends the collection. Pages after the end are discarded.
+    '''
+
+    if page_size < 1:
+        raise InputException('page_size must be positive')
+    if max_workers < 1:
+        raise InputException('max_workers must be positive')
+
+    session = get_session()
+
+    request = _layer_collection_path(layer_collection_id, layer_provider_id)
+
+    def fetch_page(offset: int) -> api.LayerCollectionResponse:
+        response = session.requests_session.cached_get(
+            f'{session.server_url}{request}?offset={offset}&limit={page_size}',
             headers=session.admin_or_normal_auth_header,
             timeout=timeout,
         )
@@ -550,19 +575,74 @@ def layer_collection(layer_collection_id: Optional[LayerCollectionId] = None,
         if not response.ok:
             raise GeoEngineException(response.json())
 
-        page: api.LayerCollectionResponse = response.json()
+        return response.json()
 
-        if len(page['items']) < page_limit:
-            if len(pages) == 0 or len(page['items']) > 0:  # we need at least one page before breaking
-                pages.append(page)
-            break
+    first_page = fetch_page(0)
+    yield first_page  # we need at least one page for the name and description
 
-        pages.append(page)
-        offset += page_limit
+    if len(first_page['items']) < page_size:
+        return
 
-    return LayerCollection.from_response(pages)
+    offsets = itertools.count(page_size, page_size)
+    fetch = bind_operation(fetch_page)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: Deque[Future] = deque(executor.submit(fetch, next(offsets)) for _ in range(max_workers))
+
+        try:
+            while pending:
+                page: api.LayerCollectionResponse = pending.popleft().result()
+
+                if len(page['items']) < page_size:
+                    if len(page['items']) > 0:
+                        yield page
+                    return
+
+                # request the next page before the consumer processes this one
+                pending.append(executor.submit(fetch, next(offsets)))
+                yield page
+        finally:
+            for future in pending:
+                future.cancel()
 
 
+def _listing_from_response(response: api.LayerCollectionListingResponse) -> Listing:
+    '''Parse an item of a layer collection response to a `LayerListing` or `LayerCollectionListing`'''
+
+    item_type = LayerCollectionListingType(response['type'])
+
+    if item_type is LayerCollectionListingType.LAYER:
+        layer_id_response = cast(api.LayerAndProviderIdResponse, response['id'])
+        return LayerListing(
+            listing_id=LayerId(layer_id_response['layerId']),
+            provider_id=LayerProviderId(UUID(layer_id_response['providerId'])),
+            name=response['name'],
+            description=response['description'],
+        )
+
+    if item_type is LayerCollectionListingType.COLLECTION:
+        collection_id_response = cast(api.LayerCollectionAndProviderIdResponse, response['id'])
+        return LayerCollectionListing(
+            listing_id=LayerCollectionId(collection_id_response['collectionId']),
+            provider_id=LayerProviderId(UUID(collection_id_response['providerId'])),
+            name=response['name'],
+            description=response['description'],
+        )
+
+    assert False, 'Invalid listing type'
+
+
+def _layer_collection_path(layer_collection_id: Optional[LayerCollectionId],
+                           layer_provider_id: LayerProviderId) -> str:
+    '''Return the path of a layer collection or of the root collection if `layer_collection_id` is None'''
+
+    if layer_collection_id is None:
+        return '/layers/collections'
+
+    return f'/layers/collections/{layer_provider_id}/{urllib.parse.quote_plus(str(layer_collection_id))}'
+
+
+@instrumented('layer', '/layers')
 def layer(layer_id: LayerId,
           layer_provider_id: LayerProviderId = LAYER_DB_PROVIDER_ID,
           timeout: int = 60) -> Layer:
@@ -572,7 +652,7 @@ def layer(layer_id: LayerId,
 
     session = get_session()
 
-    response = req.get(
+    response = session.requests_session.cached_get(
         f'{session.server_url}/layers/{layer_provider_id}/{urllib.parse.quote_plus(layer_id)}',
         headers=session.admin_or_normal_auth_header,
         timeout=timeout,
@@ -584,6 +664,12 @@ def layer(layer_id: LayerId,
     return Layer.from_response(response.json())
 
 
+def _invalidate_layers(session: Session) -> None:
+    '''Remove the cached layers and layer collections after a change of the layer database'''
+
+    session.requests_session.invalidate_cache(f'{session.server_url}/layerDb/', f'{session.server_url}/layers/')
+
+
 def _delete_layer_from_collection(collection_id: LayerCollectionId,
                                   layer_id: LayerId,
                                   timeout: int = 60) -> None:
@@ -591,7 +677,7 @@ def _delete_layer_from_collection(collection_id: LayerCollectionId,
 
     session = get_session()
 
-    response = req.delete(
+    response = session.requests_session.delete(
         f'{session.server_url}/layerDb/collections/{collection_id}/layers/{layer_id}',
         headers=session.admin_auth_header,
         timeout=timeout,
@@ -600,6 +686,8 @@ def _delete_layer_from_collection(collection_id: LayerCollectionId,
     if not response.ok:
         raise GeoEngineException(response.json())
 
+    _invalidate_layers(session)
+
 
 def _delete_layer_collection_from_collection(parent_id: LayerCollectionId,
                                              collection_id: LayerCollectionId,
@@ -608,7 +696,7 @@ def _delete_layer_collection_from_collection(parent_id: LayerCollectionId,
 
     session = get_session()
 
-    response = req.delete(
+    response = session.requests_session.delete(
         f'{session.server_url}/layerDb/collections/{parent_id}/collections/{collection_id}',
         headers=session.admin_auth_header,
         timeout=timeout,
@@ -617,6 +705,8 @@ def _delete_layer_collection_from_collection(parent_id: LayerCollectionId,
     if not response.ok:
         raise GeoEngineException(response.json())
 
+    _invalidate_layers(session)
+
 
 def _delete_layer_collection(collection_id: LayerCollectionId,
                              timeout: int = 60) -> None:
@@ -624,7 +714,7 @@ def _delete_layer_collection(collection_id: LayerCollectionId,
 
     session = get_session()
 
-    response = req.delete(
+    response = session.requests_session.delete(
         f'{session.server_url}/layerDb/collections/{collection_id}',
         headers=session.admin_auth_header,
         timeout=timeout,
@@ -633,6 +723,8 @@ def _delete_layer_collection(collection_id: LayerCollectionId,
     if not response.ok:
         raise GeoEngineException(response.json())
 
+    _invalidate_layers(session)
+
 
 def _add_layer_collection_to_collection(name: str,
                                         description: str,
@@ -642,7 +734,7 @@ def _add_layer_collection_to_collection(name: str,
 
     session = get_session()
 
-    response = req.post(
+    response = session.requests_session.post(
         f'{session.server_url}/layerDb/collections/{parent_collection_id}/collections',
         headers=session.admin_auth_header,
         json={
@@ -655,6 +747,8 @@ def _add_layer_collection_to_collection(name: str,
     if not response.ok:
         raise GeoEngineException(response.json())
 
+    _invalidate_layers(session)
+
     return LayerCollectionId(response.json()['id'])
 
 
@@ -665,7 +759,7 @@ def _add_existing_layer_collection_to_collection(collection_id: LayerCollectionI
 
     session = get_session()
 
-    response = req.post(
+    response = session.requests_session.post(
         f'{session.server_url}/layerDb/collections/{parent_collection_id}/collections/{collection_id}',
         headers=session.admin_auth_header,
         timeout=timeout,
@@ -674,6 +768,8 @@ def _add_existing_layer_collection_to_collection(collection_id: LayerCollectionI
     if not response.ok:
         raise GeoEngineException(response.json())
 
+    _invalidate_layers(session)
+
 
 def _add_layer_to_collection(name: str,
                              description: str,
@@ -686,7 +782,7 @@ def _add_layer_to_collection(name: str,
 
     session = get_session()
 
-    response = req.post(
+    response = session.requests_session.post(
         f'{session.server_url}/layerDb/collections/{collection_id}/layers',
         headers=session.admin_auth_header,
         json={
@@ -701,6 +797,8 @@ def _add_layer_to_collection(name: str,
     if not response.ok:
         raise GeoEngineException(response.json())
 
+    _invalidate_layers(session)
+
     return LayerId(response.json()['id'])
 
 
@@ -711,7 +809,7 @@ def _add_existing_layer_to_collection(layer_id: LayerId,
 
     session = get_session()
 
-    response = req.post(
+    response = session.requests_session.post(
         f'{session.server_url}/layerDb/collections/{collection_id}/layers/{layer_id}',
         headers=session.admin_auth_header,
         timeout=timeout,
@@ -719,3 +817,5 @@ def _add_existing_layer_to_collection(layer_id: LayerId,
 
     if not response.ok:
         raise GeoEngineException(response.json())
+
+    _invalidate_layers(session)
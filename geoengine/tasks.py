@@ -9,10 +9,9 @@ from enum import Enum
 from typing import Dict, List, Tuple
 from uuid import UUID
 
-import requests as req
-
 from geoengine.auth import get_session
 from geoengine.error import check_response_for_error, GeoEngineException
+from geoengine.instrumentation import instrumented
 
 
 class TaskId:
@@ -198,6 +197,7 @@ class Task:
 
         return self.__task_id == other.__task_id  # pylint: disable=protected-access
 
+    @instrumented('task_status', '/tasks/status')
     def get_status(self, timeout: int = 3600) -> TaskStatusInfo:
         '''
         Returns the status of a task in a Geo Engine instance
@@ -206,7 +206,7 @@ class Task:
 
         task_id_str = str(self.__task_id)
 
-        response = req.get(
+        response = session.requests_session.get(
             url=f'{session.server_url}/tasks/{task_id_str}/status',
             headers=session.auth_header,
             timeout=timeout
@@ -216,6 +216,7 @@ class Task:
 
         return TaskStatusInfo.from_response(response.json())
 
+    @instrumented('task_abort', '/tasks/abort')
     def abort(self, force: bool = False, timeout: int = 3600) -> None:
         '''
         Abort a running task in a Geo Engine instance
@@ -226,7 +227,7 @@ class Task:
 
         force_str = str(force).lower()
 
-        response = req.get(
+        response = session.requests_session.get(
             url=f'{session.server_url}/tasks/{task_id_str}/abort?force={force_str}',
             headers=session.auth_header,
             timeout=timeout
@@ -268,7 +269,7 @@ def get_task_list(timeout: int = 3600) -> List[Tuple[Task, TaskStatusInfo]]:
     '''
     session = get_session()
 
-    response = req.get(
+    response = session.requests_session.get(
         url=f'{session.server_url}/tasks/list',
         headers=session.auth_header,
         timeout=timeout
@@ -0,0 +1,249 @@
+'''
+Direct access to the pixels of uncompressed GeoTiffs
+
+Uncompressed GeoTiffs store their pixels as plain arrays, so they can be read from the response buffer
+without decoding them with GDAL and without copying the buffer into an in-memory file first.
+'''
+
+from __future__ import annotations
+
+import struct
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from geoengine.error import InputException
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIGURATION = 284
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_SAMPLE_FORMAT = 339
+
+# the struct formats of the TIFF field types BYTE, SHORT and LONG
+FIELD_TYPE_FORMATS = {1: 'B', 3: 'H', 4: 'I'}
+
+SAMPLE_FORMAT_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+class TiffLayout(NamedTuple):
+    '''The pixel layout of the first image of an uncompressed TIFF'''
+
+    width: int
+    height: int
+    band_count: int
+    dtype: np.dtype
+    block_width: int
+    block_height: int
+    tiled: bool
+    planar: bool
+    offsets: Tuple[int, ...]
+
+    @property
+    def blocks_across(self) -> int:
+        '''The number of blocks per row of blocks'''
+        return -(-self.width // self.block_width)
+
+    @property
+    def blocks_down(self) -> int:
+        '''The number of rows of blocks'''
+        return -(-self.height // self.block_height)
+
+    def block_offset(self, band: int, block_row: int, block_column: int) -> int:
+        '''Return the byte offset of a block, where `band` is 1-based and only relevant for planar layouts'''
+        index = block_row * self.blocks_across + block_column
+        if self.planar:
+            index += (band - 1) * self.blocks_across * self.blocks_down
+        return self.offsets[index]
+
+
+def read_tiff_layout(buffer: Buffer) -> Optional[TiffLayout]:
+    '''
+    Read the layout of the first image of a TIFF
+
+    Returns None if the buffer is no classic TIFF, if it is compressed or if its samples cannot be
+    represented as a numpy array.
+    '''
+    # pylint: disable=too-many-return-statements,too-many-locals
+
+    data = memoryview(buffer)
+    if len(data) < 8:
+        return None
+
+    byte_order = {b'II': '<', b'MM': '>'}.get(bytes(data[:2]))
+    if byte_order is None:
+        return None
+
+    (magic, ifd_offset) = struct.unpack_from(byte_order + 'HI', data, 2)
+    if magic != 42:  # BigTIFF and others
+        return None
+
+    try:
+        tags = _read_ifd(data, byte_order, ifd_offset)
+    except struct.error:
+        return None
+
+    if tags.get(TAG_COMPRESSION, (1,))[0] != 1:
+        return None
+
+    count = tags.get(TAG_SAMPLES_PER_PIXEL, (1,))[0]
+    bits = set(tags.get(TAG_BITS_PER_SAMPLE, (1,)))
+    sample_formats = set(tags.get(TAG_SAMPLE_FORMAT, (1,)))
+    if len(bits) != 1 or len(sample_formats) != 1:
+        return None
+
+    (bits_per_sample,) = bits
+    kind = SAMPLE_FORMAT_KINDS.get(sample_formats.pop())
+    if kind is None or bits_per_sample not in (8, 16, 32, 64) or (kind == 'f' and bits_per_sample == 8):
+        return None
+
+    width = tags[TAG_IMAGE_WIDTH][0]
+    height = tags[TAG_IMAGE_LENGTH][0]
+    tiled = TAG_TILE_OFFSETS in tags
+
+    if tiled:
+        block_width = tags[TAG_TILE_WIDTH][0]
+        block_height = tags[TAG_TILE_LENGTH][0]
+        offsets = tags[TAG_TILE_OFFSETS]
+    else:
+        block_width = width
+        block_height = min(tags.get(TAG_ROWS_PER_STRIP, (height,))[0], height)
+        offsets = tags[TAG_STRIP_OFFSETS]
+
+    layout = TiffLayout(
+        width=width,
+        height=height,
+        band_count=count,
+        dtype=np.dtype(f'{byte_order}{kind}{bits_per_sample // 8}'),
+        block_width=block_width,
+        block_height=block_height,
+        tiled=tiled,
+        planar=tags.get(TAG_PLANAR_CONFIGURATION, (1,))[0] == 2,
+        offsets=offsets,
+    )
+
+    bands = layout.band_count if layout.planar else 1
+    if len(offsets) != layout.blocks_across * layout.blocks_down * bands:
+        return None
+
+    # all blocks must lie within the buffer
+    byte_counts = tags.get(TAG_TILE_BYTE_COUNTS if tiled else TAG_STRIP_BYTE_COUNTS)
+    if byte_counts is None or len(byte_counts) != len(offsets) or \
+            any(offset + byte_count > len(data) for (offset, byte_count) in zip(offsets, byte_counts)):
+        return None
+
+    return layout
+
+
+def _read_ifd(data: memoryview, byte_order: str, offset: int) -> Dict[int, Tuple[int, ...]]:
+    '''Read the values of all integer fields of an image file directory'''
+
+    (entry_count,) = struct.unpack_from(byte_order + 'H', data, offset)
+
+    tags = {}
+    for i in range(entry_count):
+        (tag, field_type, value_count, value_offset) = struct.unpack_from(
+            byte_order + 'HHII', data, offset + 2 + 12 * i
+        )
+
+        value_format = FIELD_TYPE_FORMATS.get(field_type)
+        if value_format is None:
+            continue
+
+        if value_count * struct.calcsize(value_format) <= 4:
+            value_offset = offset + 2 + 12 * i + 8  # the values are stored inline
+
+        tags[tag] = struct.unpack_from(f'{byte_order}{value_count}{value_format}', data, value_offset)
+
+    return tags
+
+
+def _block_array(buffer: Buffer, layout: TiffLayout, band: int, block_row: int, block_column: int) -> np.ndarray:
+    '''Return a view of the samples of `band` in a block, without the padding of tiles'''
+
+    rows = min(layout.block_height, layout.height - block_row * layout.block_height)
+    columns = min(layout.block_width, layout.width - block_column * layout.block_width)
+
+    # tiles are always complete, the last strip only contains the remaining rows
+    stored_rows = layout.block_height if layout.tiled else rows
+    samples_per_pixel = 1 if layout.planar else layout.band_count
+
+    block = np.frombuffer(
+        buffer,
+        dtype=layout.dtype,
+        count=stored_rows * layout.block_width * samples_per_pixel,
+        offset=layout.block_offset(band, block_row, block_column),
+    ).reshape(stored_rows, layout.block_width, samples_per_pixel)
+
+    return block[:rows, :columns, 0 if layout.planar else band - 1]
+
+
+def tiff_band_view(buffer: Buffer, layout: TiffLayout, band: int) -> Optional[np.ndarray]:
+    '''
+    Return a read-only view of a band in the buffer if the band is stored contiguously
+
+    This is the case for striped TIFFs whose strips follow each other without gaps.
+    Returns None for other layouts.
+    '''
+
+    if layout.tiled or not layout.dtype.isnative:
+        return None
+
+    samples_per_pixel = 1 if layout.planar else layout.band_count
+    row_bytes = layout.width * samples_per_pixel * layout.dtype.itemsize
+
+    first_offset = layout.block_offset(band, 0, 0)
+    for block_row in range(layout.blocks_down):
+        if layout.block_offset(band, block_row, 0) != first_offset + block_row * layout.block_height * row_bytes:
+            return None
+
+    pixels = np.frombuffer(
+        buffer,
+        dtype=layout.dtype,
+        count=layout.height * layout.width * samples_per_pixel,
+        offset=first_offset,
+    ).reshape(layout.height, layout.width, samples_per_pixel)
+
+    return pixels[:, :, 0 if layout.planar else band - 1]
+
+
+def read_tiff_bands(buffer: Buffer, layout: TiffLayout, indexes: Sequence[int], out: np.ndarray) -> None:
+    '''
+    Copy the 1-based bands `indexes` block by block into `out`, which has the shape `(bands, height, width)`
+
+    Every sample is copied exactly once, directly from the buffer into `out`.
+    '''
+
+    for (i, band) in enumerate(indexes):
+        for block_row in range(layout.blocks_down):
+            row = block_row * layout.block_height
+            for block_column in range(layout.blocks_across):
+                column = block_column * layout.block_width
+                block = _block_array(buffer, layout, band, block_row, block_column)
+                out[i, row:row + block.shape[0], column:column + block.shape[1]] = block
+
+
+def band_indexes(bands: Optional[Union[int, Sequence[int]]], count: int) -> List[int]:
+    '''Return the 1-based band indexes for an index, a sequence of indexes or None for all bands'''
+
+    if bands is None:
+        return list(range(1, count + 1))
+
+    indexes = [bands] if isinstance(bands, int) else list(bands)
+
+    for band in indexes:
+        if not 1 <= band <= count:
+            raise InputException(f'Band index {band} is out of range, the raster has {count} bands')
+
+    return indexes
@@ -0,0 +1,229 @@
+'''
+Tile grids and writers for rendering workflows as XYZ tile pyramids
+'''
+
+from __future__ import annotations
+
+import math
+import os
+import sqlite3
+from os import PathLike
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from geoengine.error import InputException
+from geoengine.types import BoundingBox2D
+
+# tile boundaries computed from floating point bounds may be off by a tiny amount
+TILE_EDGE_TOLERANCE = 1e-9
+
+
+class Tile(NamedTuple):
+    '''The index of a tile in a tile pyramid, with rows `y` counted from the top like in XYZ and WMTS'''
+
+    z: int
+    x: int
+    y: int
+
+    @property
+    def tms_y(self) -> int:
+        '''The row of the tile counted from the bottom, as used by TMS and MBTiles'''
+        return (1 << self.z) - 1 - self.y
+
+
+class TileGrid:
+    '''
+    A tile matrix set in which every zoom level doubles the number of tiles along both axes
+
+    At zoom level 0, the `bounds` are split into `columns` times `rows` tiles.
+    '''
+
+    __srs: str
+    __bounds: BoundingBox2D
+    __columns: int
+    __rows: int
+
+    def __init__(self, srs: str, bounds: BoundingBox2D, columns: int = 1, rows: int = 1) -> None:
+        '''Initialize a new `TileGrid` object'''
+        if columns < 1 or rows < 1:
+            raise InputException('Tile grid: Must have at least one tile at zoom level 0')
+
+        self.__srs = srs
+        self.__bounds = bounds
+        self.__columns = columns
+        self.__rows = rows
+
+    def __repr__(self) -> str:
+        return f'TileGrid(srs={self.__srs!r}, bounds={self.__bounds.as_bbox_tuple()!r}, ' \
+            f'columns={self.__columns!r}, rows={self.__rows!r})'
+
+    @property
+    def srs(self) -> str:
+        '''The spatial reference system of the grid'''
+        return self.__srs
+
+    @property
+    def bounds(self) -> BoundingBox2D:
+        '''The bounds that are covered by the grid'''
+        return self.__bounds
+
+    def shape(self, zoom: int) -> Tuple[int, int]:
+        '''Return the number of `(rows, columns)` of tiles at `zoom`'''
+        if zoom < 0:
+            raise InputException('Zoom level: Must not be negative')
+
+        return (self.__rows << zoom, self.__columns << zoom)
+
+    def tile_extent(self, zoom: int) -> Tuple[float, float]:
+        '''Return the `(width, height)` of a tile at `zoom` in units of the srs'''
+        (rows, columns) = self.shape(zoom)
+        return (self.__bounds.x_axis_size() / columns, self.__bounds.y_axis_size() / rows)
+
+    def tile_bounds(self, tile: Tile) -> BoundingBox2D:
+        '''Return the spatial bounds of `tile`'''
+        (rows, columns) = self.shape(tile.z)
+        if not (0 <= tile.x < columns and 0 <= tile.y < rows):
+            raise InputException(f'Tile {tile} is outside of the grid')
+
+        (width, height) = self.tile_extent(tile.z)
+        bounds = self.__bounds
+
+        xmax = bounds.xmax if tile.x == columns - 1 else bounds.xmin + (tile.x + 1) * width
+        ymin = bounds.ymin if tile.y == rows - 1 else bounds.ymax - (tile.y + 1) * height
+
+        return BoundingBox2D(bounds.xmin + tile.x * width, ymin, xmax, bounds.ymax - tile.y * height)
+
+    def tiles(self, bounds: BoundingBox2D, zoom_levels: Iterable[int]) -> List[Tile]:
+        '''
+        Return all tiles that intersect `bounds` at the given zoom levels
+
+        The tiles are ordered by zoom level and then row by row, starting at the upper left corner.
+        '''
+
+        tiles: List[Tile] = []
+
+        for zoom in zoom_levels:
+            (rows, columns) = self.shape(zoom)
+            (width, height) = self.tile_extent(zoom)
+
+            def tile_range(low: float, high: float, count: int) -> range:
+                first = max(math.floor(low + TILE_EDGE_TOLERANCE), 0)
+                last = min(math.ceil(high - TILE_EDGE_TOLERANCE), count)
+                return range(first, last)
+
+            row_range = tile_range((self.__bounds.ymax - bounds.ymax) / height,
+                                   (self.__bounds.ymax - bounds.ymin) / height, rows)
+            column_range = tile_range((bounds.xmin - self.__bounds.xmin) / width,
+                                      (bounds.xmax - self.__bounds.xmin) / width, columns)
+
+            tiles.extend(Tile(zoom, x, y) for y in row_range for x in column_range)
+
+        return tiles
+
+
+WEB_MERCATOR_EXTENT = 20037508.342789244
+
+WEB_MERCATOR = TileGrid(
+    'EPSG:3857',
+    BoundingBox2D(-WEB_MERCATOR_EXTENT, -WEB_MERCATOR_EXTENT, WEB_MERCATOR_EXTENT, WEB_MERCATOR_EXTENT),
+)
+'''The XYZ grid of common web maps'''
+
+WORLD_CRS84_QUAD = TileGrid('EPSG:4326', BoundingBox2D(-180.0, -90.0, 180.0, 90.0), columns=2, rows=1)
+'''The WMTS grid for geographic coordinates with two tiles at zoom level 0'''
+
+
+def write_png_directory(tiles: Iterable[Tuple[Tile, bytes]], path: Union[str, PathLike]) -> int:
+    '''
+    Write PNG encoded tiles into a `{z}/{x}/{y}.png` directory tree at `path`
+
+    Returns the number of written tiles.
+    '''
+
+    count = 0
+
+    for (tile, png) in tiles:
+        directory = os.path.join(path, str(tile.z), str(tile.x))
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, f'{tile.y}.png'), 'wb') as file:
+            file.write(png)
+
+        count += 1
+
+    return count
+
+
+def write_mbtiles(tiles: Iterable[Tuple[Tile, bytes]],  # pylint: disable=too-many-locals
+                  path: Union[str, PathLike],
+                  grid: TileGrid = WEB_MERCATOR,
+                  name: Optional[str] = None,
+                  description: str = '') -> int:
+    '''
+    Write PNG encoded tiles of a web mercator pyramid into the MBTiles database at `path`
+
+    Existing tiles with the same index are replaced. Returns the number of written tiles.
+    '''
+
+    import pyproj  # pylint: disable=import-outside-toplevel
+
+    if grid.srs != 'EPSG:3857':
+        raise InputException('MBTiles only support the web mercator grid')
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+
+    zoom_levels = set()
+    tile_bounds: Optional[Tuple[float, float, float, float]] = None
+    count = 0
+
+    connection = sqlite3.connect(os.fspath(path))
+    try:
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+            connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS metadata_index ON metadata (name)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tiles '
+                '(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)'
+            )
+            connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)'
+            )
+
+            for (tile, png) in tiles:
+                connection.execute(
+                    'INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+                    (tile.z, tile.x, tile.tms_y, sqlite3.Binary(png))
+                )
+
+                zoom_levels.add(tile.z)
+                bounds = grid.tile_bounds(tile).as_bbox_tuple()
+                tile_bounds = bounds if tile_bounds is None else (
+                    min(tile_bounds[0], bounds[0]),
+                    min(tile_bounds[1], bounds[1]),
+                    max(tile_bounds[2], bounds[2]),
+                    max(tile_bounds[3], bounds[3]),
+                )
+                count += 1
+
+            metadata: Dict[str, str] = {
+                'name': name,
+                'description': description,
+                'format': 'png',
+                'type': 'overlay',
+                'version': '1.0',
+            }
+
+            if tile_bounds is not None:
+                metadata['minzoom'] = str(min(zoom_levels))
+                metadata['maxzoom'] = str(max(zoom_levels))
+
+                transformer = pyproj.Transformer.from_crs(grid.srs, 'EPSG:4326', always_xy=True)
+                (west, south) = transformer.transform(tile_bounds[0], tile_bounds[1])
+                (east, north) = transformer.transform(tile_bounds[2], tile_bounds[3])
+                metadata['bounds'] = ','.join(repr(round(value, 6)) for value in (west, south, east, north))
+
+            connection.executemany('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)', metadata.items())
+    finally:
+        connection.close()
+
+    return count
@@ -0,0 +1,467 @@
+'''
+HTTP transport shared by all calls to a Geo Engine instance
+'''
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logging import debug
+from typing import Any, BinaryIO, Callable, Collection, FrozenSet, Iterable, Iterator, List, Mapping, NamedTuple, \
+    Optional
+
+import requests as req
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from geoengine.http_cache import HttpCache
+from geoengine.instrumentation import current_operation
+
+
+class ConnectionPoolConfig:
+    '''
+    Configuration of the connection pool that is owned by a `Session`
+
+    Parameters
+    ----------
+    pool_connections : The number of per-host connection pools to keep
+    pool_maxsize : The maximum number of connections that are kept alive per host
+    pool_block : If True, block when all `pool_maxsize` connections of a host are in use instead of
+        opening an additional, non-pooled connection. This enforces a hard per-host limit.
+    keep_alive : If False, connections are closed after each request
+    '''
+
+    pool_connections: int
+    pool_maxsize: int
+    pool_block: bool
+    keep_alive: bool
+
+    def __init__(self,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 pool_block: bool = False,
+                 keep_alive: bool = True) -> None:
+        '''Initialize a new `ConnectionPoolConfig` object'''
+        if pool_connections < 1 or pool_maxsize < 1:
+            raise ValueError('Connection pool sizes must be positive')
+
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+
+    def __repr__(self) -> str:
+        return f'ConnectionPoolConfig(pool_connections={self.pool_connections!r}, ' \
+            f'pool_maxsize={self.pool_maxsize!r}, pool_block={self.pool_block!r}, keep_alive={self.keep_alive!r})'
+
+
+class _ConnectTiming(threading.local):  # pylint: disable=too-few-public-methods
+    '''The time that the current thread spent establishing connections'''
+    seconds: float = 0.0
+
+
+_connect_timing = _ConnectTiming()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    '''An HTTP connection that accounts the time of establishing it to the current thread'''
+
+    def connect(self) -> None:
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.seconds += time.perf_counter() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    '''An HTTPS connection that accounts the time of establishing it, including TLS, to the current thread'''
+
+    def connect(self) -> None:
+        start = time.perf_counter()
+        try:
+            super().connect()  # pylint: disable=no-member
+        finally:
+            _connect_timing.seconds += time.perf_counter() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    '''An `HTTPAdapter` whose connections measure how long it takes to establish them'''
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+RETRYABLE_STATUS_CODES: FrozenSet[int] = frozenset({429, 502, 503, 504})
+
+IDEMPOTENT_METHODS: FrozenSet[str] = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+RETRYABLE_EXCEPTIONS = (req.ConnectionError, req.Timeout, req.exceptions.ChunkedEncodingError)
+
+
+class RetryPolicy:
+    '''
+    Policy for retrying idempotent requests that failed with a transient error
+
+    Requests are retried on connection errors, timeouts and the given status codes. Between attempts,
+    the session waits for a random time of up to `backoff_seconds * 2 ** (attempt - 1)`, but at most
+    `max_backoff_seconds`. A `Retry-After` header of the server is honored instead, unless it asks for
+    more than `max_retry_after_seconds`, in which case the response is returned as is.
+
+    Parameters
+    ----------
+    max_attempts : The maximum number of attempts per request, including the first one
+    status_codes : The response status codes that are retried
+    methods : The HTTP methods that are retried. Only add methods that are idempotent on the server.
+    backoff_seconds : The base of the exponential backoff
+    max_backoff_seconds : The upper bound of the backoff between two attempts
+    max_retry_after_seconds : The longest `Retry-After` that is waited for
+    '''
+
+    max_attempts: int
+    status_codes: FrozenSet[int]
+    methods: FrozenSet[str]
+    backoff_seconds: float
+    max_backoff_seconds: float
+    max_retry_after_seconds: float
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 max_attempts: int = 4,
+                 status_codes: Collection[int] = RETRYABLE_STATUS_CODES,
+                 methods: Collection[str] = IDEMPOTENT_METHODS,
+                 backoff_seconds: float = 0.5,
+                 max_backoff_seconds: float = 30.0,
+                 max_retry_after_seconds: float = 120.0) -> None:
+        '''Initialize a new `RetryPolicy` object'''
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be positive')
+        if backoff_seconds < 0 or max_backoff_seconds < 0 or max_retry_after_seconds < 0:
+            raise ValueError('Backoff times must not be negative')
+
+        self.max_attempts = max_attempts
+        self.status_codes = frozenset(status_codes)
+        self.methods = frozenset(method.upper() for method in methods)
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_retry_after_seconds = max_retry_after_seconds
+
+    def __repr__(self) -> str:
+        return f'RetryPolicy(max_attempts={self.max_attempts!r}, status_codes={sorted(self.status_codes)!r}, ' \
+            f'methods={sorted(self.methods)!r}, backoff_seconds={self.backoff_seconds!r}, ' \
+            f'max_backoff_seconds={self.max_backoff_seconds!r}, ' \
+            f'max_retry_after_seconds={self.max_retry_after_seconds!r})'
+
+    def backoff(self, attempt: int) -> float:
+        '''Return a jittered backoff in seconds after the failed `attempt`, counted from 1'''
+        return random.uniform(0.0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1)))
+
+    def response_delay(self, response: req.Response, attempt: int) -> Optional[float]:
+        '''
+        Return the seconds to wait before retrying after `response`, or None if it must not be retried
+        '''
+
+        if response.status_code not in self.status_codes:
+            return None
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is None:
+            return self.backoff(attempt)
+        if retry_after > self.max_retry_after_seconds:
+            return None
+        return retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    '''Parse a `Retry-After` header that is either a number of seconds or an HTTP date'''
+
+    if value is None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryEvent(NamedTuple):
+    '''A failed attempt of a request that is about to be retried'''
+
+    method: str
+    url: str
+    attempt: int
+    status_code: Optional[int]
+    error: Optional[BaseException]
+    delay_seconds: float
+
+
+class RetryingSession(req.Session):
+    '''
+    A `requests.Session` that retries requests according to its `retry_policy`
+
+    Every retry is reported to the `retry_hooks` before waiting for the next attempt.
+    Requests within an instrumented operation report their timings and retries to the operation.
+    Requests made with `cached_get` are answered from the `http_cache` if one is set.
+    '''
+
+    retry_policy: Optional[RetryPolicy]
+    retry_hooks: List[Callable[[RetryEvent], None]]
+    http_cache: Optional[HttpCache]
+
+    def __init__(self, retry_policy: Optional[RetryPolicy] = None, http_cache: Optional[HttpCache] = None) -> None:
+        '''Initialize a session that does not retry if `retry_policy` is None'''
+        super().__init__()
+        self.retry_policy = retry_policy
+        self.retry_hooks = []
+        self.http_cache = http_cache
+
+    def cached_get(self,
+                   url: str,
+                   headers: Optional[Mapping[str, str]] = None,
+                   timeout: Optional[float] = None) -> req.Response:
+        '''Send a `GET` request through the `http_cache`, or directly if there is none'''
+
+        http_cache = self.http_cache
+        if http_cache is None:
+            return self.get(url, headers=headers, timeout=timeout)
+
+        return http_cache.get(self, url, headers, timeout)
+
+    def invalidate_cache(self, *url_prefixes: str) -> None:
+        '''Remove the responses whose URL starts with one of `url_prefixes` from the `http_cache`, if there is one'''
+
+        http_cache = self.http_cache
+        if http_cache is None:
+            return
+
+        for url_prefix in url_prefixes:
+            http_cache.invalidate(url_prefix)
+
+    def send(self, request: req.PreparedRequest, **kwargs: Any) -> req.Response:  # type: ignore[override]
+        '''Send a prepared request and retry it on transient errors'''
+
+        policy = self.retry_policy
+        if policy is None or str(request.method).upper() not in policy.methods:
+            return self.__send_timed(request, **kwargs)
+
+        attempt = 1
+        while True:
+            try:
+                response = self.__send_timed(request, **kwargs)
+            except RETRYABLE_EXCEPTIONS as error:
+                if attempt >= policy.max_attempts:
+                    raise
+                event = RetryEvent(str(request.method), str(request.url), attempt, None, error,
+                                   policy.backoff(attempt))
+            else:
+                delay = policy.response_delay(response, attempt) if attempt < policy.max_attempts else None
+                if delay is None:
+                    return response
+
+                response.close()
+                event = RetryEvent(str(request.method), str(request.url), attempt, response.status_code, None, delay)
+
+            debug(f'Retrying {event.method} {event.url} in {event.delay_seconds:.2f}s after attempt {attempt} '
+                  f'failed with {event.status_code if event.error is None else repr(event.error)}')
+
+            for hook in self.retry_hooks:
+                hook(event)
+
+            operation = current_operation()
+            if operation is not None:
+                operation.record_retry()
+
+            time.sleep(event.delay_seconds)
+            attempt += 1
+
+    def __send_timed(self, request: req.PreparedRequest, **kwargs: Any) -> req.Response:
+        '''Send a prepared request and record its phases in the current operation'''
+
+        operation = current_operation()
+        if operation is None:
+            return super().send(request, **kwargs)
+
+        connect_seconds_before = _connect_timing.seconds
+        streamed_bytes = [0]
+        if isinstance(request.body, (bytes, str)):
+            bytes_sent = len(request.body)
+        elif isinstance(request.body, Iterator):
+            # a streamed body is only counted while it is sent
+            request.body = _count_chunks(request.body, streamed_bytes)
+            bytes_sent = 0
+        else:
+            bytes_sent = 0
+        start = time.perf_counter()
+
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            connect_seconds = _connect_timing.seconds - connect_seconds_before
+            operation.record_request(None, bytes_sent + streamed_bytes[0], 0, connect_seconds,
+                                     time.perf_counter() - start - connect_seconds, 0.0)
+            raise
+
+        total_seconds = time.perf_counter() - start
+        connect_seconds = _connect_timing.seconds - connect_seconds_before
+        # `elapsed` ends when the headers are parsed, the body of a non-streamed response is read afterwards
+        headers_seconds = min(response.elapsed.total_seconds(), total_seconds)
+        streamed = kwargs.get('stream', False)
+
+        operation.record_request(
+            response.status_code,
+            bytes_sent + streamed_bytes[0],
+            0 if streamed else len(response.content),
+            connect_seconds,
+            max(headers_seconds - connect_seconds, 0.0),
+            0.0 if streamed else total_seconds - headers_seconds,
+        )
+
+        return response
+
+
+def _count_chunks(chunks: Iterator[bytes], counter: List[int]) -> Iterator[bytes]:
+    '''Pass on `chunks` and add their sizes to `counter[0]`'''
+
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def create_http_session(pool_config: Optional[ConnectionPoolConfig] = None,
+                        retry_policy: Optional[RetryPolicy] = None,
+                        http_cache: Optional[HttpCache] = None) -> RetryingSession:
+    '''
+    Create a `requests.Session` with a connection pool according to `pool_config`
+
+    All requests to the same host reuse the pooled connections, so only the first request
+    pays for the TCP and TLS handshakes. If `retry_policy` is given, idempotent requests are retried
+    on transient errors. If `http_cache` is given, metadata requests are cached in it.
+    '''
+
+    if pool_config is None:
+        pool_config = ConnectionPoolConfig()
+
+    http_session = RetryingSession(retry_policy, http_cache)
+
+    adapter = TimedHTTPAdapter(
+        pool_connections=pool_config.pool_connections,
+        pool_maxsize=pool_config.pool_maxsize,
+        pool_block=pool_config.pool_block,
+    )
+    http_session.mount('http://', adapter)
+    http_session.mount('https://', adapter)
+
+    if not pool_config.keep_alive:
+        http_session.headers['Connection'] = 'close'
+
+    return http_session
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadProgress(NamedTuple):
+    '''The progress of a streaming download'''
+
+    bytes_done: int
+    total_bytes: Optional[int]
+    elapsed_seconds: float
+
+    @property
+    def throughput(self) -> float:
+        '''The average throughput in bytes per second'''
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.bytes_done / self.elapsed_seconds
+
+    def __str__(self) -> str:
+        total = '?' if self.total_bytes is None else str(self.total_bytes)
+        return f'{self.bytes_done}/{total} bytes in {self.elapsed_seconds:.2f}s ' \
+            f'({self.throughput / (1024 * 1024):.2f} MiB/s)'
+
+
+def stream_response_to_file(response: req.Response,
+                            file: BinaryIO,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE,
+                            progress: Optional[Callable[[DownloadProgress], None]] = None) -> DownloadProgress:
+    '''
+    Write the body of a streamed `response` to `file` chunk by chunk
+
+    At most `chunk_size` bytes of the body are held in memory at any time.
+    If `progress` is given, it is called after every chunk.
+    '''
+
+    content_length = response.headers.get('Content-Length')
+    total_bytes = int(content_length) if content_length is not None and content_length.isdigit() else None
+
+    start = time.perf_counter()
+    bytes_done = 0
+
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        file.write(chunk)
+        bytes_done += len(chunk)
+
+        if progress is not None:
+            progress(DownloadProgress(bytes_done, total_bytes, time.perf_counter() - start))
+
+    result = DownloadProgress(bytes_done, total_bytes, time.perf_counter() - start)
+
+    debug(f'Downloaded {result}')
+
+    operation = current_operation()
+    if operation is not None:
+        operation.record_download(result.bytes_done, result.elapsed_seconds)
+
+    return result
+
+
+def multipart_stream(field_name: str, content: Iterable[bytes], boundary: str) -> Iterator[bytes]:
+    '''
+    Wrap `content` into a `multipart/form-data` body with a single file field
+
+    Both the field name and the file name are `field_name`, like `requests` sends `files={field_name: content}`.
+    Sending the result as `data` streams the body with chunked transfer encoding.
+    '''
+
+    yield f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{field_name}"\r\n\r\n' \
+        .encode()
+    yield from content
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def gzip_stream(content: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    '''Compress a stream of bytes into a gzip stream, e.g., for a body with `Content-Encoding: gzip`'''
+
+    compressor = zlib.compressobj(level, wbits=16 + zlib.MAX_WBITS)
+
+    for chunk in content:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
@@ -6,7 +6,8 @@ Different type mappings of geo engine types
 
 from __future__ import annotations
 from abc import abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
+import calendar
 from uuid import UUID
 from enum import Enum
 from typing import Dict, Optional, Tuple, cast, List
@@ -144,6 +145,28 @@ class TimeInterval:
     def is_instant(self) -> bool:
         return self.end is None
 
+    def time_steps(self, step: TimeStep) -> List[datetime]:
+        '''
+        Return the start of every time step within the interval
+
+        The end of the interval is exclusive. An instant consists of a single time step.
+        '''
+
+        if step.step < 1:
+            raise InputException("Time step: Must be positive")
+
+        if self.end is None or self.start == self.end:
+            return [self.start]
+
+        steps = []
+        current = self.start
+        while current < self.end:
+            steps.append(current)
+            # always compute from the start to prevent month-end drift
+            current = step.add_to(self.start, len(steps))
+
+        return steps
+
     def to_api_dict(self, as_millis=False) -> api.TimeInterval:
         '''convert to a dict that can be used in the API'''
         if as_millis:
@@ -317,6 +340,109 @@ class QueryRectangle:
         '''
         return self.__srs
 
+    @property
+    def raster_shape(self) -> Tuple[int, int]:
+        '''
+        Return the number of pixels `(height, width)` of a raster query with this rectangle
+        '''
+        height = round(self.__spatial_bounds.y_axis_size() / self.__resolution.y_resolution)
+        width = round(self.__spatial_bounds.x_axis_size() / self.__resolution.x_resolution)
+        return (height, width)
+
+    def with_spatial_bounds(self, spatial_bounds: BoundingBox2D) -> QueryRectangle:
+        '''
+        Return a copy of this query rectangle with different spatial bounds
+        '''
+        return QueryRectangle(spatial_bounds, self.__time_interval, self.__resolution, self.__srs)
+
+    def with_time_interval(self, time_interval: TimeInterval) -> QueryRectangle:
+        '''
+        Return a copy of this query rectangle with a different time interval
+        '''
+        return QueryRectangle(self.__spatial_bounds, time_interval, self.__resolution, self.__srs)
+
+    def raster_window(self, window: Tuple[Tuple[int, int], Tuple[int, int]]) -> QueryRectangle:
+        '''
+        Return the rectangle of the pixels `((row_start, row_stop), (column_start, column_stop))` of a raster
+        query with this rectangle
+        '''
+
+        ((row_start, row_stop), (column_start, column_stop)) = window
+        (height, width) = self.raster_shape
+
+        if not (0 <= row_start < row_stop <= height and 0 <= column_start < column_stop <= width):
+            raise InputException(f"Window: Must be a non-empty part of the raster of shape {(height, width)}")
+
+        bounds = self.__spatial_bounds
+        resolution = self.__resolution
+
+        return self.with_spatial_bounds(BoundingBox2D(
+            bounds.xmin + column_start * resolution.x_resolution,
+            bounds.ymin if row_stop == height else bounds.ymax - row_stop * resolution.y_resolution,
+            bounds.xmax if column_stop == width else bounds.xmin + column_stop * resolution.x_resolution,
+            bounds.ymax - row_start * resolution.y_resolution,
+        ))
+
+    def raster_tiles(self, tile_shape: Tuple[int, int]) -> List[Tuple[Tuple[int, int], QueryRectangle]]:
+        '''
+        Split the rectangle into a grid of tiles that line up with the spatial resolution
+
+        Each tile is returned together with its pixel offset `(row, column)` from the upper left corner.
+        Tiles at the right and lower border may be smaller than `tile_shape`.
+        '''
+        # pylint: disable=too-many-locals
+
+        (tile_height, tile_width) = tile_shape
+        if tile_height < 1 or tile_width < 1:
+            raise InputException("Tile shape: Must be positive")
+
+        (height, width) = self.raster_shape
+        bounds = self.__spatial_bounds
+        resolution = self.__resolution
+
+        tiles = []
+        for row in range(0, height, tile_height):
+            row_end = min(row + tile_height, height)
+            ymax = bounds.ymax - row * resolution.y_resolution
+            ymin = bounds.ymin if row_end == height else bounds.ymax - row_end * resolution.y_resolution
+
+            for column in range(0, width, tile_width):
+                column_end = min(column + tile_width, width)
+                xmin = bounds.xmin + column * resolution.x_resolution
+                xmax = bounds.xmax if column_end == width else bounds.xmin + column_end * resolution.x_resolution
+
+                tiles.append(((row, column), self.with_spatial_bounds(BoundingBox2D(xmin, ymin, xmax, ymax))))
+
+        return tiles
+
+    def spatial_grid(self, grid_shape: Tuple[int, int]) -> List[QueryRectangle]:
+        '''
+        Split the spatial bounds of the rectangle into a grid of `(rows, columns)` equally sized cells
+
+        The cells are returned row by row, starting at the upper left corner.
+        '''
+
+        (rows, columns) = grid_shape
+        if rows < 1 or columns < 1:
+            raise InputException("Grid shape: Must be positive")
+
+        bounds = self.__spatial_bounds
+        cell_height = bounds.y_axis_size() / rows
+        cell_width = bounds.x_axis_size() / columns
+
+        cells = []
+        for row in range(rows):
+            ymax = bounds.ymax - row * cell_height
+            ymin = bounds.ymin if row == rows - 1 else bounds.ymax - (row + 1) * cell_height
+
+            for column in range(columns):
+                xmin = bounds.xmin + column * cell_width
+                xmax = bounds.xmax if column == columns - 1 else bounds.xmin + (column + 1) * cell_width
+
+                cells.append(self.with_spatial_bounds(BoundingBox2D(xmin, ymin, xmax, ymax)))
+
+        return cells
+
 
 class ResultDescriptor:  # pylint: disable=too-few-public-methods
     '''
@@ -785,6 +911,33 @@ class TimeStep:
             'granularity': self.granularity.to_api_enum(),
         })
 
+    def add_to(self, time: datetime, times: int = 1) -> datetime:
+        '''
+        Advance `time` by `times` steps
+
+        Month and year steps keep the day of month if possible and use the last day of the month otherwise.
+        '''
+
+        amount = self.step * times
+
+        if self.granularity in (TimeStepGranularity.MONTHS, TimeStepGranularity.YEARS):
+            months = amount if self.granularity == TimeStepGranularity.MONTHS else 12 * amount
+            (year, month) = divmod(time.month - 1 + months, 12)
+            year += time.year
+            month += 1
+            day = min(time.day, calendar.monthrange(year, month)[1])
+            return time.replace(year=year, month=month, day=day)
+
+        seconds_per_unit = {
+            TimeStepGranularity.MILLIS: 0.001,
+            TimeStepGranularity.SECONDS: 1,
+            TimeStepGranularity.MINUTES: 60,
+            TimeStepGranularity.HOURS: 60 * 60,
+            TimeStepGranularity.DAYS: 24 * 60 * 60,
+        }
+
+        return time + timedelta(seconds=seconds_per_unit[self.granularity] * amount)
+
 
 @dataclass
 class Provenance:
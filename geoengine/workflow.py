@@ -1,37 +1,66 @@
+# pylint: disable=too-many-lines
+
 '''
 A workflow representation and methods on workflows
 '''
 
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+import re
+import shutil
+import tempfile
 import urllib.parse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from enum import Enum
 from io import BytesIO
 from logging import debug
 from os import PathLike
-from typing import Any, Dict, List, Optional, Union, Type
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, ClassVar, Deque, Dict, Iterable, Iterator, List, NamedTuple, \
+    Optional, Sequence, Tuple, Union, Type, cast
 from uuid import UUID
+from weakref import WeakKeyDictionary
 
-import geopandas as gpd
 import numpy as np
-import rasterio.io
 import requests as req
-import rioxarray
-from PIL import Image
-from owslib.util import Authentication, ResponseWrapper
-from owslib.wcs import WebCoverageService
 # TODO: can be imported directly from `typing` with python >= 3.8
 from typing_extensions import TypedDict
-from vega import VegaLite
-from xarray import DataArray
 
 from geoengine import api
-from geoengine.auth import get_session
+from geoengine.auth import Session, get_session
+from geoengine.cache import ResultCache, get_result_cache
 from geoengine.colorizer import Colorizer
-from geoengine.error import MethodNotCalledOnPlotException, MethodNotCalledOnRasterException,\
-    MethodNotCalledOnVectorException, check_response_for_error
+from geoengine.error import InputException, MethodNotCalledOnPlotException, MethodNotCalledOnRasterException,\
+    MethodNotCalledOnVectorException, check_response_for_error, check_ows_response_for_error
+from geoengine.instrumentation import PHASE_DECODE, bind_operation, instrumented, phase
 from geoengine.tasks import Task, TaskId
-from geoengine.types import ProvenanceEntry, QueryRectangle, ResultDescriptor
+from geoengine.transport import DEFAULT_CHUNK_SIZE, DownloadProgress, stream_response_to_file
+from geoengine.tiff import band_indexes, read_tiff_bands, read_tiff_layout, tiff_band_view
+from geoengine.tiles import WEB_MERCATOR, Tile, TileGrid, write_mbtiles, write_png_directory
+from geoengine.types import BoundingBox2D, ProvenanceEntry, QueryRectangle, RasterResultDescriptor, ResultDescriptor, \
+    SpatialResolution, TimeInterval, TimeStep
+from geoengine.workflow_registry import get_workflow_registry, workflow_hash
+
+# geopandas, rasterio, xarray, PIL and vega are slow to import, so they are only loaded on first use
+if TYPE_CHECKING:
+    import geopandas as gpd
+    import httpx
+    import pyarrow
+    import rasterio.io
+    from PIL import Image
+    from rasterio.crs import CRS  # pylint: disable=no-name-in-module
+    from rasterio.transform import Affine
+    from vega import VegaLite
+    from xarray import DataArray
+
+    from geoengine.coverage import RasterCoverage
 
 
 # TODO: Define as recursive type when supported in mypy: https://github.com/python/mypy/issues/731
@@ -48,6 +77,32 @@ Y = TypedDict('Y', {'field': Field, 'type': str})
 Encoding = TypedDict('Encoding', {'x': X, 'x2': X2, 'y': Y})
 VegaSpec = TypedDict('VegaSpec', {'$schema': str, 'data': List[Values], 'mark': str, 'encoding': Encoding})
 
+RASTER_DATA_TYPE_TO_NUMPY: Dict[str, str] = {
+    'U8': 'uint8',
+    'U16': 'uint16',
+    'U32': 'uint32',
+    'U64': 'uint64',
+    'I8': 'int8',
+    'I16': 'int16',
+    'I32': 'int32',
+    'I64': 'int64',
+    'F32': 'float32',
+    'F64': 'float64',
+}
+
+
+# the statuses with which a WFS rejects an output format, besides a `400 Bad Request` with a format error
+UNSUPPORTED_FORMAT_STATUS_CODES = (406, 415, 501)
+UNKNOWN_FORMAT_ERROR = re.compile(r'(output|unknown|unsupported)[\s_-]?format', re.IGNORECASE)
+
+
+class VectorResultFormat(str, Enum):
+    '''The encoding in which vector results are transferred via WFS'''
+
+    GEOJSON = 'application/json'
+    ARROW = 'application/vnd.apache.arrow.stream'
+    GEOPARQUET = 'application/vnd.apache.parquet'
+
 
 class WorkflowId:
     '''
@@ -75,17 +130,80 @@ class WorkflowId:
         return str(self)
 
 
+class RasterTileProfile(NamedTuple):
+    '''The georeference of a raster that was assembled from tiles'''
+
+    crs: CRS
+    nodata: Optional[float]
+    transform: Affine
+
+    def to_xarray(self, array: np.ndarray, times: Optional[List[datetime]] = None) -> DataArray:
+        '''
+        Wrap a single band array into a georeferenced `DataArray`
+
+        The result is laid out like the one of `rioxarray.open_rasterio`.
+        If `times` is given, `array` must have the dimensions `(time, y, x)` instead.
+        '''
+
+        # pylint: disable=import-outside-toplevel
+        # rioxarray registers the `rio` accessor
+        import rioxarray  # pylint: disable=unused-import
+        from rioxarray.rioxarray import affine_to_coords
+        from xarray import DataArray
+
+        (height, width) = array.shape[-2:]
+        coords = affine_to_coords(self.transform, width, height)
+
+        attrs: Dict[str, Any] = {}
+        if self.nodata is not None:
+            attrs['_FillValue'] = self.nodata
+        attrs['scale_factor'] = 1.0
+        attrs['add_offset'] = 0.0
+
+        if times is None:
+            data_array = DataArray(
+                array[np.newaxis, :, :],
+                dims=('band', 'y', 'x'),
+                coords={'band': [1], 'y': coords['y'], 'x': coords['x']},
+                attrs=attrs,
+            )
+        else:
+            data_array = DataArray(
+                array,
+                dims=('time', 'y', 'x'),
+                coords={'time': _to_datetime64(times), 'y': coords['y'], 'x': coords['x']},
+                attrs=attrs,
+            )
+
+        rio: DataArray = data_array.rio
+        rio.write_crs(self.crs, inplace=True)
+        rio.write_transform(self.transform, inplace=True)
+        rio.update_attrs({
+            'crs': self.crs,
+            'res': rio.resolution(),
+            'transform': self.transform,
+        }, inplace=True)
+
+        return data_array
+
+
 class Workflow:
     '''
     Holds a workflow id and allows querying data
     '''
 
     __workflow_id: WorkflowId
-    __result_descriptor: ResultDescriptor
+
+    # result descriptors by workflow id for each session, shared by all instances
+    __result_descriptors: ClassVar[WeakKeyDictionary[Session, Dict[str, ResultDescriptor]]] = WeakKeyDictionary()
 
     def __init__(self, workflow_id: WorkflowId) -> None:
+        '''
+        Initialize a workflow
+
+        The result descriptor is queried on first use.
+        '''
         self.__workflow_id = workflow_id
-        self.__result_descriptor = self.__query_result_descriptor()
 
     def __str__(self) -> str:
         return str(self.__workflow_id)
@@ -100,15 +218,35 @@ class Workflow:
 
         session = get_session()
 
-        response = req.get(
+        response = session.requests_session.get(
             f'{session.server_url}/workflow/{self.__workflow_id}/metadata',
             headers=session.auth_header,
             timeout=timeout
-        ).json()
+        )
+
+        check_response_for_error(response)
+
+        response_json = response.json()
+
+        debug(response_json)
 
-        debug(response)
+        return ResultDescriptor.from_response(response_json)
 
-        return ResultDescriptor.from_response(response)
+    @property
+    def __result_descriptor(self) -> ResultDescriptor:
+        '''
+        The metadata of the workflow result, which is queried once per workflow id and session
+        '''
+
+        result_descriptors = Workflow.__result_descriptors.setdefault(get_session(), {})
+        key = str(self.__workflow_id)
+
+        result_descriptor = result_descriptors.get(key)
+        if result_descriptor is None:
+            result_descriptor = self.__query_result_descriptor()
+            result_descriptors[key] = result_descriptor
+
+        return result_descriptor
 
     def get_result_descriptor(self) -> ResultDescriptor:
         '''
@@ -117,12 +255,13 @@ class Workflow:
 
         return self.__result_descriptor
 
+    @instrumented('workflow_definition', '/workflow')
     def workflow_definition(self, timeout: int = 60) -> Dict[str, Any]:
         '''Return the workflow definition for this workflow'''
 
         session = get_session()
 
-        response = req.get(
+        response = session.requests_session.cached_get(
             f'{session.server_url}/workflow/{self.__workflow_id}',
             headers=session.auth_header,
             timeout=timeout
@@ -130,22 +269,39 @@ class Workflow:
 
         return response
 
-    def __get_wfs_url(self, bbox: QueryRectangle) -> str:
+    def __cache_key(self, *parts: Any) -> str:
+        '''Build a result cache key for this workflow on the current server and for the current user'''
+
+        session = get_session()
+
+        return ResultCache.key(session.server_url, session.cache_scope, str(self.__workflow_id), *parts)
+
+    def __cached_content(self, fetch: Callable[[], bytes], *key_parts: Any) -> bytes:
+        '''Return the result of `fetch` from the result cache if it is enabled and store it otherwise'''
+
+        cache = get_result_cache()
+        if cache is None:
+            return fetch()
+
+        key = self.__cache_key(*key_parts)
+
+        content = cache.get(key)
+        if content is None:
+            content = fetch()
+            cache.put(key, content)
+
+        return content
+
+    def __get_wfs_url(
+        self,
+        bbox: QueryRectangle,
+        output_format: VectorResultFormat = VectorResultFormat.GEOJSON
+    ) -> str:
         '''Build a WFS url from a workflow and a `QueryRectangle`'''
 
         session = get_session()
 
-        params = dict(
-            service='WFS',
-            version="2.0.0",
-            request='GetFeature',
-            outputFormat='application/json',
-            typeNames=f'{self.__workflow_id}',
-            bbox=bbox.bbox_str,
-            time=bbox.time_str,
-            srsName=bbox.srs,
-            queryResolution=str(bbox.spatial_resolution)
-        )
+        params = _wfs_params(self.__workflow_id, bbox, output_format)
 
         wfs_url = req.Request(
             'GET', url=f'{session.server_url}/wfs/{self.__workflow_id}', params=params).prepare().url
@@ -173,55 +329,225 @@ class Workflow:
         headers = " -H ".join(headers_list)
         return command.format(method=wfs_request.method, headers=headers, uri=wfs_request.url)
 
-    def get_dataframe(self, bbox: QueryRectangle, timeout: int = 3600) -> gpd.GeoDataFrame:
+    def __request_wfs_features(self, bbox: QueryRectangle, timeout: int = 3600) -> Dict[str, Any]:
+        '''Query a workflow and return the WFS result as a parsed GeoJSON feature collection'''
+
+        def fetch() -> bytes:
+            session = get_session()
+
+            wfs_url = self.__get_wfs_url(bbox)
+
+            data_response = session.requests_session.get(wfs_url, headers=session.auth_header, timeout=timeout)
+
+            check_response_for_error(data_response)
+
+            return data_response.content
+
+        content = self.__cached_content(fetch, 'wfs', bbox, VectorResultFormat.GEOJSON.value)
+
+        with phase(PHASE_DECODE):
+            return json.loads(content)
+
+    def __request_wfs_table(
+        self,
+        bbox: QueryRectangle,
+        output_format: VectorResultFormat,
+        timeout: int = 3600
+    ) -> Union[pyarrow.Table, Dict[str, Any]]:
+        '''
+        Query a workflow for a binary columnar WFS result and return it as an Arrow table
+
+        If the server cannot produce `output_format`, the GeoJSON result is returned instead.
+        '''
+
+        if output_format == VectorResultFormat.GEOJSON:
+            return self.__request_wfs_features(bbox, timeout)
+
+        cache = get_result_cache()
+        cache_key = self.__cache_key('wfs', bbox, output_format.value)
+        geo_json_cache_key = self.__cache_key('wfs', bbox, VectorResultFormat.GEOJSON.value)
+
+        if cache is not None:
+            content = cache.get(cache_key)
+            if content is not None:
+                return _decode_arrow_table(content, output_format)
+
+            # a GeoJSON result is stored if the server did not produce `output_format` before
+            content = cache.get(geo_json_cache_key)
+            if content is not None:
+                with phase(PHASE_DECODE):
+                    return json.loads(content)
+
+        session = get_session()
+
+        wfs_url = self.__get_wfs_url(bbox, output_format)
+
+        data_response = session.requests_session.get(wfs_url, headers=session.auth_header, timeout=timeout)
+
+        if _is_unsupported_format_response(data_response):
+            debug(f'WFS cannot produce {output_format.value}, falling back to GeoJSON: {data_response.text}')
+            return self.__request_wfs_features(bbox, timeout)
+
+        check_response_for_error(data_response)
+
+        content_type = data_response.headers.get('Content-Type', '').split(';')[0].strip()
+
+        if content_type == VectorResultFormat.GEOJSON.value:
+            # the server ignored the requested format
+            if cache is not None:
+                cache.put(geo_json_cache_key, data_response.content)
+
+            with phase(PHASE_DECODE):
+                return json.loads(data_response.content)
+
+        table = _decode_arrow_table(data_response.content, output_format)
+
+        if cache is not None:
+            cache.put(cache_key, data_response.content)
+
+        return table
+
+    @instrumented('get_dataframe', '/wfs')
+    def get_dataframe(
+        self,
+        bbox: QueryRectangle,
+        timeout: int = 3600,
+        output_format: VectorResultFormat = VectorResultFormat.GEOJSON
+    ) -> gpd.GeoDataFrame:
         '''
         Query a workflow and return the WFS result as a GeoPandas `GeoDataFrame`
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        timeout : HTTP request timeout in seconds
+        output_format : The encoding of the transferred result. The binary formats `ARROW` and `GEOPARQUET` \
+            are smaller and faster to decode than GeoJSON and require `pyarrow`. If the server cannot produce \
+            them, GeoJSON is used instead.
         '''
 
         if not self.__result_descriptor.is_vector_result():
             raise MethodNotCalledOnVectorException()
 
-        session = get_session()
+        data = self.__request_wfs_table(bbox, output_format, timeout)
 
-        wfs_url = self.__get_wfs_url(bbox)
+        with phase(PHASE_DECODE):
+            if isinstance(data, dict):
+                return _geo_json_with_time_to_geopandas(data, bbox.srs)
 
-        data_response = req.get(wfs_url, headers=session.auth_header, timeout=timeout)
+            return _arrow_table_to_geopandas(data, bbox.srs)
 
-        check_response_for_error(data_response)
+    @instrumented('get_arrow_table', '/wfs')
+    def get_arrow_table(
+        self,
+        bbox: QueryRectangle,
+        timeout: int = 3600,
+        output_format: VectorResultFormat = VectorResultFormat.ARROW
+    ) -> pyarrow.Table:
+        '''
+        Query a workflow and return the WFS result as a `pyarrow.Table`
+
+        The geometries are stored as WKB in the column `geometry`, described by GeoParquet metadata.
+        If the server cannot produce `output_format`, the GeoJSON result is converted instead.
+        Requires the optional dependency `pyarrow`.
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        timeout : HTTP request timeout in seconds
+        output_format : The encoding of the transferred result
+        '''
+
+        if not self.__result_descriptor.is_vector_result():
+            raise MethodNotCalledOnVectorException()
+
+        _import_pyarrow()
+
+        data = self.__request_wfs_table(bbox, output_format, timeout)
+
+        with phase(PHASE_DECODE):
+            if isinstance(data, dict):
+                return _geopandas_to_arrow_table(_geo_json_with_time_to_geopandas(data, bbox.srs))
+
+            return _with_geo_metadata(data, 'geometry', bbox.srs)
+
+    def get_dataframe_batches(
+        self,
+        bbox: QueryRectangle,
+        grid_shape: Tuple[int, int] = (4, 4),
+        timeout: int = 3600
+    ) -> Iterator[gpd.GeoDataFrame]:
+        '''
+        Query a workflow cell by cell and return the WFS result as an iterator of GeoPandas `GeoDataFrame` batches
+
+        The query is split into a grid of `grid_shape` spatial cells that are requested one after another.
+        Each cell is converted and yielded on its own, so the peak memory is bounded by the largest cell and
+        not by the whole result. Empty cells are skipped.
+
+        Features that cross the border of a cell are returned for all cells they intersect.
+        They are only yielded for the cell that contains a representative point of them, so concatenating all
+        batches yields each feature once, even if several features are identical.
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        grid_shape : The number of `(rows, columns)` to split the query into
+        timeout : HTTP request timeout in seconds per cell
+        '''
+
+        if not self.__result_descriptor.is_vector_result():
+            raise MethodNotCalledOnVectorException()
 
-        data = data_response.json()
+        cells = bbox.spatial_grid(grid_shape)
 
-        def geo_json_with_time_to_geopandas(geo_json):
-            '''
-            GeoJson has no standard for time, so we parse the when field
-            separately and attach it to the data frame as columns `start`
-            and `end`.
-            '''
+        def batches() -> Iterator[gpd.GeoDataFrame]:
+            for (index, cell) in enumerate(cells):
+                data = self.__request_wfs_features(cell, timeout)
 
-            data = gpd.GeoDataFrame.from_features(geo_json)
-            data = data.set_crs(bbox.srs, allow_override=True)
+                if len(data['features']) == 0:
+                    continue
 
-            start = [f['when']['start'] for f in geo_json['features']]
-            end = [f['when']['end'] for f in geo_json['features']]
+                frame = _geo_json_with_time_to_geopandas(data, bbox.srs)
+                del data
 
-            # TODO: find a good way to infer BoT/EoT
+                bounds = cell.spatial_bounds
+                feature_bounds = frame.geometry.bounds
+                is_interior = (feature_bounds['minx'] > bounds.xmin) & (feature_bounds['maxx'] < bounds.xmax) \
+                    & (feature_bounds['miny'] > bounds.ymin) & (feature_bounds['maxy'] < bounds.ymax)
 
-            data['start'] = gpd.pd.to_datetime(start, errors='coerce')
-            data['end'] = gpd.pd.to_datetime(end, errors='coerce')
+                # features that touch a cell border belong to the cell of their representative point
+                keep = is_interior.to_numpy(copy=True)
+                border = np.flatnonzero(~keep)
+                if len(border) > 0:
+                    (x, y) = _representative_points(frame.geometry.iloc[border], bbox.spatial_bounds)
+                    keep[border] = _cell_contains(bounds, bbox.spatial_bounds, x, y) | (np.isnan(x) & (index == 0))
 
-            return data
+                if keep.all():
+                    yield frame
+                elif keep.any():
+                    yield frame[keep].reset_index(drop=True)
 
-        return geo_json_with_time_to_geopandas(data)
+        return batches()
 
-    def wms_get_map_as_image(self, bbox: QueryRectangle, colorizer: Colorizer) -> Image:
+    @instrumented('wms_get_map_as_image', '/wms')
+    def wms_get_map_as_image(self, bbox: QueryRectangle, colorizer: Colorizer, timeout: int = 3600) -> Image:
         '''Return the result of a WMS request as a PIL Image'''
 
         wms_request = self.__wms_get_map_request(bbox, colorizer)
-        response = req.Session().send(wms_request)
 
-        check_response_for_error(response)
+        def fetch() -> bytes:
+            response = get_session().requests_session.send(wms_request, timeout=timeout)
+
+            check_response_for_error(response)
+
+            return response.content
 
-        return Image.open(BytesIO(response.content))
+        content = self.__cached_content(fetch, 'wms', bbox, 'image/png', colorizer.to_json())
+
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+
+        with phase(PHASE_DECODE):
+            return Image.open(BytesIO(content))
 
     def __wms_get_map_request(self,
                               bbox: QueryRectangle,
@@ -233,29 +559,10 @@ class Workflow:
 
         session = get_session()
 
-        width = int((bbox.spatial_bounds.xmax - bbox.spatial_bounds.xmin) / bbox.spatial_resolution.x_resolution)
-        height = int((bbox.spatial_bounds.ymax - bbox.spatial_bounds.ymin) / bbox.spatial_resolution.y_resolution)
-
-        colorizer_colorizer_str = 'custom:' + colorizer.to_json()
-
-        params = dict(
-            service='WMS',
-            version='1.3.0',
-            request="GetMap",
-            layers=str(self),
-            time=bbox.time_str,
-            crs=bbox.srs,
-            bbox=bbox.bbox_ogc_str,
-            width=width,
-            height=height,
-            format='image/png',
-            styles=colorizer_colorizer_str,
-        )
-
         return req.Request(
             'GET',
             url=f'{session.server_url}/wms/{str(self)}',
-            params=params,
+            params=_wms_params(self.__workflow_id, bbox, colorizer),
             headers=session.auth_header
         ).prepare()
 
@@ -269,6 +576,167 @@ class Workflow:
         headers = " -H ".join(headers_list)
         return command.format(method=wms_request.method, headers=headers, uri=wms_request.url)
 
+    def __wms_get_tile_pngs(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        tiles: List[Tile],
+        time: TimeInterval,
+        colorizer: Colorizer,
+        tile_size: int,
+        grid: TileGrid,
+        max_workers: int,
+        timeout: int,
+        cache: Optional[ResultCache]
+    ) -> Iterator[Tuple[Tile, bytes]]:
+        '''
+        Fetch PNG encoded tiles concurrently and yield them in the order of `tiles`
+
+        At most `2 * max_workers` tiles are buffered, so the pyramid can be larger than the memory.
+        '''
+
+        session = get_session()
+        colorizer_hash = hashlib.sha256(colorizer.to_json().encode()).hexdigest()
+
+        def fetch(tile: Tile) -> bytes:
+            (width, height) = grid.tile_extent(tile.z)
+            tile_bbox = QueryRectangle(
+                grid.tile_bounds(tile),
+                time,
+                SpatialResolution(width / tile_size, height / tile_size),
+                grid.srs
+            )
+
+            cache_key = self.__cache_key('wms-tile', grid.srs, tile, tile_size, tile_bbox, colorizer_hash)
+            if cache is not None:
+                content = cache.get(cache_key)
+                if content is not None:
+                    return content
+
+            response = session.requests_session.get(
+                f'{session.server_url}/wms/{self.__workflow_id}',
+                params=_wms_params(self.__workflow_id, tile_bbox, colorizer, (tile_size, tile_size)),
+                headers=session.auth_header,
+                timeout=timeout,
+            )
+
+            check_response_for_error(response)
+
+            if cache is not None:
+                cache.put(cache_key, response.content)
+
+            return response.content
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending: Deque[Tuple[Tile, Future[bytes]]] = deque()
+
+            for tile in tiles:
+                pending.append((tile, executor.submit(bind_operation(fetch), tile)))
+
+                if len(pending) >= 2 * max_workers:
+                    (done_tile, future) = pending.popleft()
+                    yield (done_tile, future.result())
+
+            while pending:
+                (done_tile, future) = pending.popleft()
+                yield (done_tile, future.result())
+
+    def wms_get_tiles(  # pylint: disable=too-many-arguments
+        self,
+        bounds: BoundingBox2D,
+        time: TimeInterval,
+        colorizer: Colorizer,
+        zoom_levels: Iterable[int],
+        tile_size: int = 256,
+        grid: TileGrid = WEB_MERCATOR,
+        max_workers: int = 8,
+        timeout: int = 3600,
+        cache: Optional[ResultCache] = None
+    ) -> Iterator[Tuple[Tile, Image]]:
+        '''
+        Render the tiles of a tile pyramid via WMS and return them as PIL Images
+
+        Parameters
+        ----------
+        bounds : The area to cover in the srs of the `grid`. All tiles that intersect it are rendered.
+        time : The time instance or interval of the tiles
+        colorizer : The colorizer of the tiles
+        zoom_levels : The zoom levels to render, e.g., `range(0, 6)`
+        tile_size : The width and height of the tiles in pixels
+        grid : The tile grid, which defaults to the XYZ grid of web maps
+        max_workers : The maximum number of concurrent tile requests
+        timeout : HTTP request timeout in seconds
+        cache : The cache for the rendered tiles, which defaults to the global result cache if it is enabled. \
+            Tiles are cached by their index, size, time and colorizer.
+        '''
+
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+
+        return (
+            (tile, Image.open(BytesIO(png)))
+            for (tile, png) in self.__wms_tiles(
+                bounds, time, colorizer, zoom_levels, tile_size, grid, max_workers, timeout, cache
+            )
+        )
+
+    @instrumented('wms_download_tiles', '/wms')
+    def wms_download_tiles(  # pylint: disable=too-many-arguments
+        self,
+        path: Union[str, PathLike],
+        bounds: BoundingBox2D,
+        time: TimeInterval,
+        colorizer: Colorizer,
+        zoom_levels: Iterable[int],
+        tile_size: int = 256,
+        grid: TileGrid = WEB_MERCATOR,
+        max_workers: int = 8,
+        timeout: int = 3600,
+        cache: Optional[ResultCache] = None
+    ) -> int:
+        '''
+        Render the tiles of a tile pyramid via WMS and write them to `path`
+
+        If `path` ends with `.mbtiles`, the tiles are written into an MBTiles database, which requires the
+        web mercator grid. Otherwise, they are written into a `{z}/{x}/{y}.png` directory tree.
+        See `wms_get_tiles` for the other parameters. Returns the number of written tiles.
+        '''
+
+        tiles = self.__wms_tiles(bounds, time, colorizer, zoom_levels, tile_size, grid, max_workers, timeout, cache)
+
+        if os.fspath(path).endswith('.mbtiles'):
+            return write_mbtiles(tiles, path, grid)
+
+        return write_png_directory(tiles, path)
+
+    def __wms_tiles(  # pylint: disable=too-many-arguments
+        self,
+        bounds: BoundingBox2D,
+        time: TimeInterval,
+        colorizer: Colorizer,
+        zoom_levels: Iterable[int],
+        tile_size: int,
+        grid: TileGrid,
+        max_workers: int,
+        timeout: int,
+        cache: Optional[ResultCache]
+    ) -> Iterator[Tuple[Tile, bytes]]:
+        '''Validate a tile pyramid request and fetch its PNG encoded tiles'''
+
+        if not self.__result_descriptor.is_raster_result():
+            raise MethodNotCalledOnRasterException()
+
+        if tile_size < 1:
+            raise InputException('tile_size must be positive')
+
+        if max_workers < 1:
+            raise InputException('max_workers must be positive')
+
+        if cache is None:
+            cache = get_result_cache()
+
+        tiles = grid.tiles(bounds, zoom_levels)
+
+        return self.__wms_get_tile_pngs(tiles, time, colorizer, tile_size, grid, max_workers, timeout, cache)
+
+    @instrumented('plot_chart', '/plot')
     def plot_chart(self, bbox: QueryRectangle, timeout: int = 3600) -> VegaLite:
         '''
         Query a workflow and return the plot chart result as a vega plot
@@ -286,15 +754,20 @@ class Workflow:
         plot_url = f'{session.server_url}/plot/{self}?bbox={spatial_bounds}&crs={bbox.srs}&time={time}'\
             f'&spatialResolution={resolution}'
 
-        response = req.get(plot_url, headers=session.auth_header, timeout=timeout)
+        def fetch() -> bytes:
+            response = session.requests_session.get(plot_url, headers=session.auth_header, timeout=timeout)
 
-        check_response_for_error(response)
+            check_response_for_error(response)
+
+            return response.content
 
-        response_json: JsonType = response.json()
+        response_json: JsonType = json.loads(self.__cached_content(fetch, 'plot', bbox))
         assert isinstance(response_json, Dict)
 
         vega_spec: VegaSpec = json.loads(response_json['data']['vegaString'])
 
+        from vega import VegaLite  # pylint: disable=import-outside-toplevel
+
         return VegaLite(vega_spec)
 
     def __request_wcs(
@@ -302,11 +775,15 @@ class Workflow:
         bbox: QueryRectangle,
         timeout=3600,
         file_format: str = 'image/tiff',
-        force_no_data_value: Optional[float] = None
-    ) -> ResponseWrapper:
+        force_no_data_value: Optional[float] = None,
+        stream: bool = False
+    ) -> req.Response:
         '''
         Query a workflow and return the coverage
 
+        The GetCoverage request is sent directly over the session's connection pool,
+        so there is no additional GetCapabilities round trip per call.
+
         Parameters
         ----------
         bbox : A bounding box for the query
@@ -314,6 +791,7 @@ class Workflow:
         file_format : The format of the returned raster
         force_no_data_value: If not None, use this value as no data value for the requested raster data. \
             Otherwise, use the Geo Engine will produce masked rasters.
+        stream : If True, the response body is not downloaded before it is accessed
         '''
 
         if not self.__result_descriptor.is_raster_result():
@@ -321,33 +799,17 @@ class Workflow:
 
         session = get_session()
 
-        # TODO: properly build CRS string for bbox
-        crs = f'urn:ogc:def:crs:{bbox.srs.replace(":", "::")}'
-
-        wcs_url = f'{session.server_url}/wcs/{self.__workflow_id}'
-        wcs = WebCoverageService(
-            wcs_url,
-            version='1.1.1',
-            auth=Authentication(auth_delegate=session.requests_bearer_auth()),
+        response = session.requests_session.get(
+            f'{session.server_url}/wcs/{self.__workflow_id}',
+            params=_wcs_params(self.__workflow_id, bbox, file_format, force_no_data_value),
+            headers=session.auth_header,
+            timeout=timeout,
+            stream=stream,
         )
 
-        [resx, resy] = bbox.resolution_ogc
-
-        no_data_value = ""
-        if force_no_data_value is not None:
-            no_data_value = str(float(force_no_data_value))
+        check_ows_response_for_error(response)
 
-        return wcs.getCoverage(
-            identifier=f'{self.__workflow_id}',
-            bbox=bbox.bbox_ogc,
-            time=[urllib.parse.quote_plus(bbox.time_str)],
-            format=file_format,
-            crs=crs,
-            resx=resx,
-            resy=resy,
-            timeout=timeout,
-            nodatavalue=no_data_value,
-        )
+        return response
 
     def __get_wcs_tiff_as_memory_file(
         self,
@@ -366,45 +828,283 @@ class Workflow:
             Otherwise, use the Geo Engine will produce masked rasters.
         '''
 
-        response = self.__request_wcs(bbox, timeout, 'image/tiff', force_no_data_value).read()
+        import rasterio.io  # pylint: disable=import-outside-toplevel
 
-        # response is checked via `raise_on_error` in `getCoverage` / `openUrl`
-
-        memory_file = rasterio.io.MemoryFile(response)
+        memory_file = rasterio.io.MemoryFile(self.__get_wcs_tiff(bbox, timeout, force_no_data_value))
 
         return memory_file
 
-    def get_array(
+    def __get_wcs_tiff(
         self,
         bbox: QueryRectangle,
         timeout=3600,
         force_no_data_value: Optional[float] = None
+    ) -> bytes:
+        '''Query a workflow and return the raster result as GeoTiff bytes'''
+
+        return self.__cached_content(
+            lambda: self.__request_wcs(bbox, timeout, 'image/tiff', force_no_data_value).content,
+            'wcs', bbox, 'image/tiff', force_no_data_value
+        )
+
+    @contextmanager
+    def __open_wcs_tiff_from_disk(
+        self,
+        bbox: QueryRectangle,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None,
+        progress: Optional[Callable[[DownloadProgress], None]] = None
+    ) -> Iterator[rasterio.io.DatasetReader]:
+        '''
+        Query a workflow, stream the raster result into a temporary GeoTiff and open it
+
+        The coverage is never held in memory as a whole. The temporary file is removed on exit.
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        timeout : HTTP request timeout in seconds
+        force_no_data_value: If not None, use this value as no data value for the requested raster data. \
+            Otherwise, use the Geo Engine will produce masked rasters.
+        progress : A callback that receives the `DownloadProgress` after every chunk
+        '''
+
+        import rasterio  # pylint: disable=import-outside-toplevel
+
+        cache = get_result_cache()
+        cache_key = self.__cache_key('wcs', bbox, 'image/tiff', force_no_data_value)
+
+        cached_path = cache.get_path(cache_key) if cache is not None else None
+        if cached_path is not None:
+            with rasterio.open(cached_path) as dataset:
+                yield dataset
+            return
+
+        with tempfile.TemporaryDirectory(prefix='geoengine-') as directory:
+            file_path = os.path.join(directory, 'coverage.tiff')
+
+            with self.__request_wcs(bbox, timeout, 'image/tiff', force_no_data_value, stream=True) as response, \
+                    open(file_path, 'wb') as file:
+                stream_response_to_file(response, file, progress=progress)
+
+            if cache is not None:
+                cache.put_file(cache_key, file_path, link=True)
+
+            with rasterio.open(file_path) as dataset:
+                yield dataset
+
+    def __get_wcs_cube(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        time_slices: List[QueryRectangle],
+        tile_shape: Optional[Tuple[int, int]] = None,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None,
+        max_workers: int = 4,
+        spool_to_disk: bool = False,
+        out: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, RasterTileProfile]:
+        '''
+        Query a workflow slice by slice and tile by tile and assemble the raster result in one preallocated array
+
+        All `time_slices` must have the same spatial bounds and resolution. The result has the shape
+        `(time, rows, columns)`. The requests are sent concurrently on a thread pool of at most `max_workers`
+        threads and each response is read directly into its window of the result array.
+        If `tile_shape` is None, every time slice is fetched with a single request.
+        If `out` is given, the result is read into it. Otherwise, if `spool_to_disk` is True,
+        the result array is a memory-mapped temporary file.
+        '''
+
+        from rasterio.transform import Affine  # pylint: disable=import-outside-toplevel
+
+        if max_workers < 1:
+            raise InputException('max_workers must be positive')
+
+        (height, width) = time_slices[0].raster_shape
+
+        if out is not None and out.shape != (len(time_slices), height, width):
+            raise InputException(f'out: Must have the shape {(len(time_slices), height, width)}, got {out.shape}')
+        if tile_shape is None:
+            tile_shape = (height, width)
+
+        jobs = [
+            (time_index, row, column, tile_bbox)
+            for (time_index, slice_bbox) in enumerate(time_slices)
+            for ((row, column), tile_bbox) in slice_bbox.raster_tiles(tile_shape)
+        ]
+
+        lock = Lock()
+        result: Dict[str, Any] = {}
+
+        def fetch_tile(job: Tuple[int, int, int, QueryRectangle]) -> None:
+            (time_index, row, column, tile_bbox) = job
+            (tile_height, tile_width) = tile_bbox.raster_shape
+
+            with self.__get_wcs_tiff_as_memory_file(
+                tile_bbox,
+                timeout,
+                force_no_data_value
+            ) as memfile, memfile.open() as dataset:
+                if (dataset.height, dataset.width) != (tile_height, tile_width):
+                    raise InputException(
+                        f'Tile at ({row}, {column}) has shape {(dataset.height, dataset.width)}, '
+                        f'expected {(tile_height, tile_width)}'
+                    )
+
+                with lock:
+                    if 'array' not in result:
+                        result['array'] = _output_array(
+                            out,
+                            (len(time_slices), height, width),
+                            dataset.dtypes[0],
+                            spool_to_disk
+                        )
+                        result['profile'] = RasterTileProfile(
+                            crs=dataset.crs,
+                            nodata=dataset.nodata,
+                            transform=dataset.transform * Affine.translation(-column, -row),
+                        )
+
+                array = result['array']
+                with phase(PHASE_DECODE):
+                    dataset.read(1, out=array[time_index, row:row + tile_height, column:column + tile_width])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # consume the iterator to propagate exceptions of the workers
+            for _ in executor.map(bind_operation(fetch_tile), jobs):
+                pass
+
+        return (result['array'], result['profile'])
+
+    @instrumented('get_array', '/wcs')
+    def get_array(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        bbox: QueryRectangle,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None,
+        tile_shape: Optional[Tuple[int, int]] = None,
+        max_workers: int = 4,
+        spool_to_disk: bool = False,
+        progress: Optional[Callable[[DownloadProgress], None]] = None,
+        out: Optional[np.ndarray] = None,
+        bands: Optional[Union[int, Sequence[int]]] = 1,
+        window: Optional[Tuple[Tuple[int, int], Tuple[int, int]]] = None,
+        zero_copy: bool = False
     ) -> np.ndarray:
         '''
         Query a workflow and return the raster result as a numpy array
 
+        Uncompressed GeoTiff results are copied block by block from the response into the result array
+        instead of being decoded by GDAL.
+
         Parameters
         ----------
         bbox : A bounding box for the query
         timeout : HTTP request timeout in seconds
         force_no_data_value: If not None, use this value as no data value for the requested raster data. \
             Otherwise, use the Geo Engine will produce masked rasters.
+        tile_shape: If not None, split the query into tiles of `(rows, columns)` pixels that are fetched \
+            concurrently. The result is the same as for a single request.
+        max_workers: The maximum number of concurrent tile requests
+        spool_to_disk: If True, stream the coverage to a temporary file instead of holding it in memory. \
+            The returned array is then memory-mapped to a temporary file as well.
+        progress: A callback that receives the `DownloadProgress` while spooling a single request to disk
+        out: A preallocated array to read the result into, which is returned. It must have the shape and \
+            data type of the result.
+        bands: The 1-based index of the band to read, which results in a 2D array, or a sequence of indexes or \
+            None for all bands, which results in a 3D array of shape `(bands, rows, columns)`. Tiled queries \
+            only support a single band.
+        window: If not None, only query the pixels `((row_start, row_stop), (column_start, column_stop))` \
+            of `bbox`
+        zero_copy: If True and the result is a single band of an uncompressed, striped GeoTiff, return a \
+            read-only view of the response instead of copying it
         '''
 
-        with self.__get_wcs_tiff_as_memory_file(
-            bbox,
-            timeout,
-            force_no_data_value
-        ) as memfile, memfile.open() as dataset:
-            array = dataset.read(1)
+        if window is not None:
+            bbox = bbox.raster_window(window)
+
+        if tile_shape is not None:
+            if not isinstance(bands, int):
+                raise InputException('Tiled queries only support a single band')
+            if bands != 1:
+                raise InputException(f'Band index {bands} is out of range, tiled queries only read the first band')
+
+            (cube, _profile) = self.__get_wcs_cube(
+                [bbox],
+                tile_shape,
+                timeout,
+                force_no_data_value,
+                max_workers,
+                spool_to_disk,
+                out=None if out is None else out[np.newaxis]
+            )
+            return cube[0] if out is None else out
+
+        if spool_to_disk:
+            with self.__open_wcs_tiff_from_disk(bbox, timeout, force_no_data_value, progress) as dataset:
+                indexes = band_indexes(bands, dataset.count)
+                array = _output_array(out, _band_shape(bands, indexes, dataset.shape), dataset.dtypes[0], True)
+                with phase(PHASE_DECODE):
+                    dataset.read(bands if isinstance(bands, int) else indexes, out=array)
+
+                return array
+
+        content = self.__get_wcs_tiff(bbox, timeout, force_no_data_value)
+
+        with phase(PHASE_DECODE):
+            return _decode_tiff(content, bands, out, zero_copy)
+
+    @instrumented('open_coverage', '/wcs')
+    def open_coverage(  # pylint: disable=too-many-arguments
+        self,
+        bbox: QueryRectangle,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None,
+        spool_to_disk: bool = False,
+        progress: Optional[Callable[[DownloadProgress], None]] = None
+    ) -> RasterCoverage:
+        '''
+        Query a workflow once and keep the raster result open for repeated band, window and overview reads
 
-            return array
+        Close the returned `RasterCoverage` or use it as a context manager to release the coverage.
 
-    def get_xarray(
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        timeout : HTTP request timeout in seconds
+        force_no_data_value: If not None, use this value as no data value for the requested raster data. \
+            Otherwise, use the Geo Engine will produce masked rasters.
+        spool_to_disk: If True, stream the coverage to a temporary file instead of holding it in memory
+        progress: A callback that receives the `DownloadProgress` while spooling to disk
+        '''
+
+        from geoengine.coverage import RasterCoverage  # pylint: disable=import-outside-toplevel
+
+        resources = ExitStack()
+
+        try:
+            if spool_to_disk:
+                dataset = resources.enter_context(
+                    self.__open_wcs_tiff_from_disk(bbox, timeout, force_no_data_value, progress)
+                )
+            else:
+                memfile = resources.enter_context(
+                    self.__get_wcs_tiff_as_memory_file(bbox, timeout, force_no_data_value)
+                )
+                dataset = resources.enter_context(memfile.open())
+        except BaseException:
+            resources.close()
+            raise
+
+        return RasterCoverage(dataset, resources)
+
+    @instrumented('get_xarray', '/wcs')
+    def get_xarray(  # pylint: disable=too-many-arguments
         self,
         bbox: QueryRectangle,
         timeout=3600,
-        force_no_data_value: Optional[float] = None
+        force_no_data_value: Optional[float] = None,
+        tile_shape: Optional[Tuple[int, int]] = None,
+        max_workers: int = 4
     ) -> DataArray:
         '''
         Query a workflow and return the raster result as a georeferenced xarray
@@ -415,13 +1115,28 @@ class Workflow:
         timeout : HTTP request timeout in seconds
         force_no_data_value: If not None, use this value as no data value for the requested raster data. \
             Otherwise, use the Geo Engine will produce masked rasters.
+        tile_shape: If not None, split the query into tiles of `(rows, columns)` pixels that are fetched \
+            concurrently. The result is the same as for a single request.
+        max_workers: The maximum number of concurrent tile requests
         '''
 
-        with self.__get_wcs_tiff_as_memory_file(
-            bbox,
-            timeout,
-            force_no_data_value
-        ) as memfile, memfile.open() as dataset:
+        if tile_shape is not None:
+            (cube, profile) = self.__get_wcs_cube(
+                [bbox],
+                tile_shape,
+                timeout,
+                force_no_data_value,
+                max_workers
+            )
+            return profile.to_xarray(cube[0])
+
+        # pylint: disable=import-outside-toplevel
+        import rioxarray
+        from xarray import DataArray
+
+        memory_file = self.__get_wcs_tiff_as_memory_file(bbox, timeout, force_no_data_value)
+
+        with phase(PHASE_DECODE), memory_file as memfile, memfile.open() as dataset:
             data_array = rioxarray.open_rasterio(dataset)
 
             # helping mypy with inference
@@ -437,18 +1152,164 @@ class Workflow:
             # TODO: add time information to dataset
             return data_array.load()
 
-    # pylint: disable=too-many-arguments
-    def download_raster(
+    @instrumented('get_xarray_timeseries', '/wcs')
+    def get_xarray_timeseries(  # pylint: disable=too-many-arguments
+        self,
+        bbox: QueryRectangle,
+        time_step: TimeStep,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None,
+        tile_shape: Optional[Tuple[int, int]] = None,
+        max_workers: int = 4,
+        spool_to_disk: bool = False
+    ) -> DataArray:
+        '''
+        Query a workflow for a series of time slices and return the raster result as a georeferenced xarray
+
+        The time interval of `bbox` is split into steps of `time_step` and all slices are fetched concurrently.
+        Each slice is read directly into its position of a preallocated `(time, y, x)` array that
+        the resulting `DataArray` wraps without copying.
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        time_step : The distance between two time slices
+        timeout : HTTP request timeout in seconds
+        force_no_data_value: If not None, use this value as no data value for the requested raster data. \
+            Otherwise, use the Geo Engine will produce masked rasters.
+        tile_shape: If not None, additionally split each slice into tiles of `(rows, columns)` pixels
+        max_workers: The maximum number of concurrent requests
+        spool_to_disk: If True, the array is memory-mapped to a temporary file instead of held in memory
+        '''
+
+        times = bbox.time.time_steps(time_step)
+
+        (cube, profile) = self.__get_wcs_cube(
+            [bbox.with_time_interval(TimeInterval(time)) for time in times],
+            tile_shape,
+            timeout,
+            force_no_data_value,
+            max_workers,
+            spool_to_disk
+        )
+
+        return profile.to_xarray(cube, times=times)
+
+    def get_lazy_xarray(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        bbox: QueryRectangle,
+        tile_shape: Tuple[int, int] = (512, 512),
+        time_step: Optional[TimeStep] = None,
+        timeout=3600,
+        force_no_data_value: Optional[float] = None
+    ) -> DataArray:
+        '''
+        Query a workflow lazily and return the raster result as a Dask-backed georeferenced xarray
+
+        Every chunk of the array is a tile of `tile_shape` pixels (and a single time step) that is only fetched
+        via WCS when it is computed. Thus, reductions over large extents run with bounded memory and
+        in parallel on the Dask scheduler. The chunks use the global session, so use a thread-based scheduler.
+        Unless `force_no_data_value` is given, the first chunk is fetched right away to read the no data value of
+        the result, like `get_xarray` does.
+
+        Requires the optional dependency `dask`.
+
+        Parameters
+        ----------
+        bbox : A bounding box for the query
+        tile_shape : The `(rows, columns)` of the spatial chunks in pixels
+        time_step : If not None, split the time interval of the query into steps of this size. \
+            The result has the dimensions `(time, y, x)` instead of `(band, y, x)`.
+        timeout : HTTP request timeout in seconds per chunk
+        force_no_data_value: If not None, use this value as no data value for the requested raster data. \
+            Otherwise, use the Geo Engine will produce masked rasters.
+        '''
+
+        # pylint: disable=import-outside-toplevel
+        try:
+            import dask
+            import dask.array as da
+        except ImportError as error:
+            raise ImportError('`get_lazy_xarray` requires `dask`, install it with `pip install geoengine[dask]`') \
+                from error
+
+        from rasterio.crs import CRS  # pylint: disable=no-name-in-module
+        from rasterio.transform import from_origin
+
+        result_descriptor = self.__result_descriptor
+        if not isinstance(result_descriptor, RasterResultDescriptor):
+            raise MethodNotCalledOnRasterException()
+
+        dtype = np.dtype(RASTER_DATA_TYPE_TO_NUMPY[result_descriptor.data_type])
+
+        def fetch_chunk(chunk_bbox: QueryRectangle) -> np.ndarray:
+            return self.get_array(chunk_bbox, timeout, force_no_data_value).astype(dtype, copy=False)
+
+        times = bbox.time.time_steps(time_step) if time_step is not None else None
+        slice_bboxes = [bbox] if times is None else [bbox.with_time_interval(TimeInterval(time)) for time in times]
+
+        nodata = force_no_data_value
+        first_chunk: Optional[np.ndarray] = None
+        if force_no_data_value is None:
+            (_index, first_tile_bbox) = next(iter(slice_bboxes[0].raster_tiles(tile_shape)))
+            with self.__get_wcs_tiff_as_memory_file(first_tile_bbox, timeout) as memfile, \
+                    memfile.open() as dataset:
+                nodata = dataset.nodata
+                first_chunk = dataset.read(1).astype(dtype, copy=False)
+
+        def lazy_time_slice(slice_bbox: QueryRectangle, first_chunk: Optional[np.ndarray]) -> Any:
+            rows: Dict[int, List[Any]] = {}
+            for ((row, _column), tile_bbox) in slice_bbox.raster_tiles(tile_shape):
+                if first_chunk is not None:
+                    # the first chunk was already fetched for the no data value
+                    chunk = da.from_array(first_chunk, chunks=first_chunk.shape)
+                    first_chunk = None
+                else:
+                    chunk = da.from_delayed(
+                        dask.delayed(fetch_chunk)(tile_bbox),
+                        shape=tile_bbox.raster_shape,
+                        dtype=dtype,
+                    )
+                rows.setdefault(row, []).append(chunk)
+            return da.block(list(rows.values()))
+
+        profile = RasterTileProfile(
+            crs=CRS.from_user_input(bbox.srs),
+            nodata=nodata,
+            transform=from_origin(
+                bbox.spatial_bounds.xmin,
+                bbox.spatial_bounds.ymax,
+                bbox.spatial_resolution.x_resolution,
+                bbox.spatial_resolution.y_resolution,
+            ),
+        )
+
+        time_slices = [
+            lazy_time_slice(slice_bbox, first_chunk if index == 0 else None)
+            for (index, slice_bbox) in enumerate(slice_bboxes)
+        ]
+
+        if times is None:
+            return profile.to_xarray(time_slices[0])
+
+        return profile.to_xarray(da.stack(time_slices), times=times)
+
+    @instrumented('download_raster', '/wcs')
+    def download_raster(  # pylint: disable=too-many-arguments,too-many-locals
         self,
         bbox: QueryRectangle,
         file_path: str,
         timeout=3600,
         file_format: str = 'image/tiff',
-        force_no_data_value: Optional[float] = None
-    ) -> None:
+        force_no_data_value: Optional[float] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        progress: Optional[Callable[[DownloadProgress], None]] = None
+    ) -> DownloadProgress:
         '''
         Query a workflow and save the raster result as a file on disk
 
+        The response is streamed to the file in chunks, so the raster is never held in memory as a whole.
+
         Parameters
         ----------
         bbox : A bounding box for the query
@@ -457,13 +1318,30 @@ class Workflow:
         file_format : The format of the returned raster
         force_no_data_value: If not None, use this value as no data value for the requested raster data. \
             Otherwise, use the Geo Engine will produce masked rasters.
+        chunk_size : The maximum number of bytes that are buffered in memory
+        progress : A callback that receives the `DownloadProgress` after every chunk
         '''
 
-        response = self.__request_wcs(bbox, timeout, file_format, force_no_data_value)
+        cache = get_result_cache()
+        cache_key = self.__cache_key('wcs', bbox, file_format, force_no_data_value)
+
+        cached_path = cache.get_path(cache_key) if cache is not None else None
+        if cached_path is not None:
+            start = perf_counter()
+            shutil.copyfile(cached_path, file_path)
+            size = os.path.getsize(file_path)
+            return DownloadProgress(size, size, perf_counter() - start)
+
+        with self.__request_wcs(bbox, timeout, file_format, force_no_data_value, stream=True) as response, \
+                open(file_path, 'wb') as file:
+            result = stream_response_to_file(response, file, chunk_size, progress)
+
+        if cache is not None:
+            cache.put_file(cache_key, file_path)
 
-        with open(file_path, 'wb') as file:
-            file.write(response.read())
+        return result
 
+    @instrumented('get_provenance', '/workflow/provenance')
     def get_provenance(self, timeout: int = 60) -> List[ProvenanceEntry]:
         '''
         Query the provenance of the workflow
@@ -473,7 +1351,8 @@ class Workflow:
 
         provenance_url = f'{session.server_url}/workflow/{self.__workflow_id}/provenance'
 
-        response = req.get(provenance_url, headers=session.auth_header, timeout=timeout).json()
+        response = session.requests_session.cached_get(provenance_url, headers=session.auth_header,
+                                                       timeout=timeout).json()
 
         return [ProvenanceEntry.from_response(item) for item in response]
 
@@ -486,7 +1365,7 @@ class Workflow:
 
         provenance_url = f'{session.server_url}/workflow/{self.__workflow_id}/allMetadata/zip'
 
-        response = req.get(provenance_url, headers=session.auth_header, timeout=timeout).content
+        response = session.requests_session.get(provenance_url, headers=session.auth_header, timeout=timeout).content
 
         if isinstance(path, BytesIO):
             path.write(response)
@@ -514,7 +1393,7 @@ class Workflow:
             'query': query_rectangle,
         }
 
-        response = req.post(
+        response = session.requests_session.post(
             url=f'{session.server_url}/datasetFromWorkflow/{self.__workflow_id}',
             json=request_body,
             headers=session.auth_header,
@@ -526,28 +1405,555 @@ class Workflow:
         return Task(TaskId.from_response(response.json()))
 
 
-def register_workflow(workflow: Dict[str, Any], timeout: int = 60) -> Workflow:
+def _wfs_params(workflow_id: WorkflowId, bbox: QueryRectangle, output_format: VectorResultFormat) -> Dict[str, str]:
+    '''Build the parameters of a WFS GetFeature request'''
+
+    return dict(
+        service='WFS',
+        version="2.0.0",
+        request='GetFeature',
+        outputFormat=output_format.value,
+        typeNames=f'{workflow_id}',
+        bbox=bbox.bbox_str,
+        time=bbox.time_str,
+        srsName=bbox.srs,
+        queryResolution=str(bbox.spatial_resolution)
+    )
+
+
+def _wms_params(
+    workflow_id: WorkflowId,
+    bbox: QueryRectangle,
+    colorizer: Colorizer,
+    image_size: Optional[Tuple[int, int]] = None
+) -> Dict[str, Any]:
+    '''
+    Build the parameters of a WMS GetMap request for a PNG image
+
+    If `image_size` is None, the `(width, height)` of the image is derived from the resolution of `bbox`.
+    '''
+
+    if image_size is not None:
+        (width, height) = image_size
+    else:
+        width = int((bbox.spatial_bounds.xmax - bbox.spatial_bounds.xmin) / bbox.spatial_resolution.x_resolution)
+        height = int((bbox.spatial_bounds.ymax - bbox.spatial_bounds.ymin) / bbox.spatial_resolution.y_resolution)
+
+    colorizer_colorizer_str = 'custom:' + colorizer.to_json()
+
+    return dict(
+        service='WMS',
+        version='1.3.0',
+        request="GetMap",
+        layers=str(workflow_id),
+        time=bbox.time_str,
+        crs=bbox.srs,
+        bbox=bbox.bbox_ogc_str,
+        width=width,
+        height=height,
+        format='image/png',
+        styles=colorizer_colorizer_str,
+    )
+
+
+def _wcs_params(
+    workflow_id: WorkflowId,
+    bbox: QueryRectangle,
+    file_format: str = 'image/tiff',
+    force_no_data_value: Optional[float] = None
+) -> Dict[str, str]:
+    '''Build the parameters of a WCS GetCoverage request'''
+
+    # TODO: properly build CRS string for bbox
+    crs = f'urn:ogc:def:crs:{bbox.srs.replace(":", "::")}'
+
+    [resx, resy] = bbox.resolution_ogc
+
+    no_data_value = ""
+    if force_no_data_value is not None:
+        no_data_value = str(float(force_no_data_value))
+
+    return dict(
+        version='1.1.1',
+        request='GetCoverage',
+        service='WCS',
+        identifier=f'{workflow_id}',
+        boundingbox=','.join(repr(x) for x in bbox.bbox_ogc),
+        timesequence=bbox.time_str,
+        format=file_format,
+        store='False',
+        crs=crs,
+        resx=repr(resx),
+        resy=repr(resy),
+        nodatavalue=no_data_value,
+    )
+
+
+def _geo_json_with_time_to_geopandas(geo_json: Dict[str, Any], srs: str) -> gpd.GeoDataFrame:  # pylint: disable=too-many-locals
+    '''
+    GeoJson has no standard for time, so we parse the when field
+    separately and attach it to the data frame as columns `start`
+    and `end`.
+
+    The features are split into geometries, properties and time strings in a single pass.
+    All columns are then built at once instead of feature by feature.
+    '''
+
+    # pylint: disable=import-outside-toplevel
+    import geopandas as gpd
+    from shapely.geometry import shape
+
+    features = geo_json['features']
+    count = len(features)
+
+    geometries = np.empty(count, dtype=object)
+    properties: List[Dict[str, Any]] = [{}] * count
+    start = np.empty(count, dtype=object)
+    end = np.empty(count, dtype=object)
+
+    # 2D points are built from their coordinates, which is much faster than creating them one by one
+    point_coordinates = np.empty((count, 2), dtype=np.float64)
+    only_points = True
+
+    for (i, feature) in enumerate(features):
+        geometry = feature['geometry']
+        if only_points and geometry and geometry['type'] == 'Point' and len(geometry['coordinates']) == 2:
+            point_coordinates[i] = geometry['coordinates']
+        else:
+            if only_points:
+                only_points = False
+                for j in range(i):
+                    geometries[j] = shape(features[j]['geometry'])
+            geometries[i] = shape(geometry) if geometry else None
+
+        properties[i] = feature['properties'] or {}
+
+        when = feature['when']
+        start[i] = when['start']
+        end[i] = when['end']
+
+    if only_points:
+        geometry_array = gpd.points_from_xy(point_coordinates[:, 0], point_coordinates[:, 1], crs=srs)
+    else:
+        geometry_array = gpd.array.from_shapely(geometries, crs=srs)
+
+    data = gpd.GeoDataFrame(gpd.pd.DataFrame(properties), geometry=geometry_array)
+    data = data[['geometry'] + [column for column in data.columns if column != 'geometry']]
+
+    data['start'] = _parse_feature_times(start)
+    data['end'] = _parse_feature_times(end)
+
+    return data
+
+
+def _parse_feature_times(times: np.ndarray) -> gpd.pd.DatetimeIndex:
+    '''
+    Parse an array of ISO 8601 time strings into UTC timestamps
+
+    Times that are out of the range of pandas, like the begin and end of time of Geo Engine,
+    are clipped to `Timestamp.min` and `Timestamp.max`. Unparsable times become `NaT`.
+    '''
+
+    import geopandas as gpd  # pylint: disable=import-outside-toplevel
+
+    parsed = gpd.pd.to_datetime(times, utc=True, errors='coerce')
+
+    missing = np.flatnonzero(parsed.isna())
+    if len(missing) == 0:
+        return parsed
+
+    # only the unparsable values are inspected for the sign of an extended year
+    signs = np.array([time[:1] if isinstance(time, str) else '' for time in times[missing]])
+
+    values = parsed.tz_localize(None).to_numpy(copy=True)
+    values[missing[signs == '-']] = gpd.pd.Timestamp.min.to_datetime64()
+    values[missing[signs == '+']] = gpd.pd.Timestamp.max.to_datetime64()
+
+    return gpd.pd.DatetimeIndex(values).tz_localize('UTC')
+
+
+def _import_pyarrow() -> Any:
+    '''Import the optional dependency `pyarrow`'''
+
+    try:
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise ImportError('Binary vector results require `pyarrow`, install it with `pip install geoengine[arrow]`') \
+            from error
+
+    return pa
+
+
+def _is_unsupported_format_response(response: Union[req.Response, httpx.Response]) -> bool:
+    '''Check whether a WFS response of the sync or the async client rejects the requested output format'''
+
+    if response.status_code in UNSUPPORTED_FORMAT_STATUS_CODES:
+        return True
+
+    if response.status_code != 400:
+        return False
+
+    try:
+        error = response.json()
+    except ValueError:
+        return False
+
+    if not isinstance(error, dict):
+        return False
+
+    return any(
+        UNKNOWN_FORMAT_ERROR.search(str(error.get(field, ''))) is not None for field in ('error', 'message')
+    )
+
+
+def _decode_arrow_table(content: bytes, output_format: VectorResultFormat) -> pyarrow.Table:
+    '''Decode an Arrow IPC stream or a GeoParquet file without copying the buffer'''
+
+    pa = _import_pyarrow()
+    buffer = pa.py_buffer(content)
+
+    if output_format == VectorResultFormat.GEOPARQUET:
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        return pq.read_table(pa.BufferReader(buffer))
+
+    with pa.ipc.open_stream(buffer) as reader:
+        return reader.read_all()
+
+
+def _arrow_table_to_geopandas(table: pyarrow.Table, srs: str) -> gpd.GeoDataFrame:
+    '''
+    Convert an Arrow table with WKB geometries into a `GeoDataFrame`
+
+    The geometry columns are taken from the GeoParquet metadata, defaulting to `geometry`.
+    The time columns `start` and `end` are converted like the `when` field of GeoJSON results.
+    '''
+
+    import geopandas as gpd  # pylint: disable=import-outside-toplevel
+
+    pa = _import_pyarrow()
+
+    metadata = table.schema.metadata or {}
+    geo_metadata = json.loads(metadata[b'geo']) if b'geo' in metadata else {}
+    primary_column = geo_metadata.get('primary_column', 'geometry')
+    geometry_columns = list(geo_metadata.get('columns', {primary_column: {}}).keys())
+
+    for column in ['start', 'end']:
+        if column in table.column_names and pa.types.is_timestamp(table.schema.field(column).type):
+            table = table.set_column(
+                table.schema.get_field_index(column),
+                column,
+                _clip_arrow_timestamps(table.column(column)),
+            )
+
+    data = table.to_pandas()
+
+    for column in geometry_columns:
+        data[column] = gpd.GeoSeries.from_wkb(data[column], crs=srs)
+
+    # same column order as for GeoJSON results
+    data = gpd.GeoDataFrame(
+        data[[primary_column] + [column for column in data.columns if column != primary_column]],
+        geometry=primary_column,
+        crs=srs,
+    )
+
+    for column in ['start', 'end']:
+        if column not in data.columns:
+            continue
+        if data[column].dtype == object:
+            data[column] = _parse_feature_times(data[column].to_numpy())
+        elif data[column].dt.tz is None:
+            data[column] = data[column].dt.tz_localize('UTC')
+        else:
+            data[column] = data[column].dt.tz_convert('UTC')
+
+    return data
+
+
+def _clip_arrow_timestamps(column: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
+    '''
+    Clip timestamps to the range of pandas
+
+    Thus, the begin and end of time of Geo Engine map to `Timestamp.min` and `Timestamp.max` as for GeoJSON results.
+    '''
+
+    # pylint: disable=no-member  # the compute functions are generated at runtime
+
+    pa = _import_pyarrow()
+    import geopandas as gpd  # pylint: disable=import-outside-toplevel
+    import pyarrow.compute as pc  # pylint: disable=import-outside-toplevel
+
+    timestamp_type = column.type
+    nanos_per_unit = {'s': 1_000_000_000, 'ms': 1_000_000, 'us': 1_000, 'ns': 1}[timestamp_type.unit]
+
+    # round towards zero to stay within the range
+    lower = -(-gpd.pd.Timestamp.min.value // nanos_per_unit)
+    upper = gpd.pd.Timestamp.max.value // nanos_per_unit
+
+    values = column.cast(pa.int64())
+    nanos = pc.multiply(pc.min_element_wise(pc.max_element_wise(values, lower), upper), nanos_per_unit)
+    nanos = pc.if_else(pc.less(values, lower), gpd.pd.Timestamp.min.value, nanos)
+    nanos = pc.if_else(pc.greater(values, upper), gpd.pd.Timestamp.max.value, nanos)
+
+    return nanos.cast(pa.timestamp('ns', tz=timestamp_type.tz))
+
+
+def _geopandas_to_arrow_table(data: gpd.GeoDataFrame) -> pyarrow.Table:
+    '''Convert a `GeoDataFrame` into an Arrow table with WKB geometries and GeoParquet metadata'''
+
+    import geopandas as gpd  # pylint: disable=import-outside-toplevel
+
+    pa = _import_pyarrow()
+
+    table = pa.Table.from_pandas(gpd.pd.DataFrame(data.to_wkb()), preserve_index=False)
+
+    return _with_geo_metadata(table, data.geometry.name, data.crs)
+
+
+def _with_geo_metadata(table: pyarrow.Table, geometry_column: str, crs: Any) -> pyarrow.Table:
+    '''Describe the WKB `geometry_column` of `table` with GeoParquet metadata if it has none yet'''
+
+    import pyproj  # pylint: disable=import-outside-toplevel
+
+    metadata = table.schema.metadata or {}
+    if b'geo' in metadata:
+        return table
+
+    geo_metadata = {
+        'version': '0.4.0',
+        'primary_column': geometry_column,
+        'columns': {
+            geometry_column: {
+                'encoding': 'WKB',
+                'crs': pyproj.CRS.from_user_input(crs).to_json_dict() if crs is not None else None,
+            },
+        },
+    }
+
+    return table.replace_schema_metadata({
+        **metadata,
+        b'geo': json.dumps(geo_metadata).encode(),
+    })
+
+
+def _representative_points(geometries: gpd.GeoSeries, bounds: BoundingBox2D) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Return the coordinates of a point on each geometry that lies within `bounds`
+
+    Geometries that do not intersect `bounds` are represented by their nearest point within it and missing or empty
+    geometries by `NaN`.
+    '''
+
+    points = geometries.representative_point()
+    x = points.x.to_numpy(dtype=float, copy=True)
+    y = points.y.to_numpy(dtype=float, copy=True)
+
+    outside = ~np.isnan(x) & ((x < bounds.xmin) | (x > bounds.xmax) | (y < bounds.ymin) | (y > bounds.ymax))
+    if outside.any():
+        from shapely.geometry import box  # pylint: disable=import-outside-toplevel
+
+        clipped = geometries[outside].intersection(box(*bounds.as_bbox_tuple())).representative_point()
+        clipped_x = clipped.x.to_numpy(dtype=float)
+        clipped_y = clipped.y.to_numpy(dtype=float)
+
+        x[outside] = np.where(np.isnan(clipped_x), np.clip(x[outside], bounds.xmin, bounds.xmax), clipped_x)
+        y[outside] = np.where(np.isnan(clipped_y), np.clip(y[outside], bounds.ymin, bounds.ymax), clipped_y)
+
+    return (x, y)
+
+
+def _cell_contains(cell: BoundingBox2D, bounds: BoundingBox2D, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    '''
+    Check which points lie in a cell of a grid over `bounds`
+
+    Cells contain their lower and left borders and, at the border of the grid, their upper and right borders, so every
+    point within `bounds` lies in exactly one cell.
+    '''
+
+    return (x >= cell.xmin) & ((x < cell.xmax) | (cell.xmax == bounds.xmax)) \
+        & (y >= cell.ymin) & ((y < cell.ymax) | (cell.ymax == bounds.ymax))
+
+
+def _to_datetime64(times: List[datetime]) -> np.ndarray:
+    '''Convert datetimes to an array of timezone-naive UTC `datetime64` values'''
+
+    return np.array([
+        np.datetime64(time.astimezone(timezone.utc).replace(tzinfo=None) if time.tzinfo is not None else time, 'ns')
+        for time in times
+    ])
+
+
+def _band_shape(
+    bands: Optional[Union[int, Sequence[int]]],
+    indexes: List[int],
+    raster_shape: Tuple[int, int]
+) -> Tuple[int, ...]:
+    '''Return the shape of the result of reading `bands` of a raster'''
+
+    if isinstance(bands, int):
+        return raster_shape
+
+    return (len(indexes), *raster_shape)
+
+
+def _decode_tiff(
+    content: bytes,
+    bands: Optional[Union[int, Sequence[int]]],
+    out: Optional[np.ndarray],
+    zero_copy: bool
+) -> np.ndarray:
+    '''
+    Read bands of a GeoTiff response into `out` or a new array
+
+    Uncompressed GeoTiffs are copied block by block, all others are decoded by GDAL.
+    '''
+
+    layout = read_tiff_layout(content)
+
+    if layout is None:
+        import rasterio.io  # pylint: disable=import-outside-toplevel
+
+        with rasterio.io.MemoryFile(content) as memfile, memfile.open() as dataset:
+            indexes = band_indexes(bands, dataset.count)
+            if out is None:
+                return dataset.read(bands if isinstance(bands, int) else indexes)
+
+            array = _output_array(out, _band_shape(bands, indexes, dataset.shape), dataset.dtypes[0])
+            dataset.read(bands if isinstance(bands, int) else indexes, out=array)
+
+            return array
+
+    indexes = band_indexes(bands, layout.band_count)
+
+    if zero_copy and out is None and isinstance(bands, int):
+        view = tiff_band_view(content, layout, bands)
+        if view is not None:
+            return view
+
+    array = _output_array(
+        out,
+        _band_shape(bands, indexes, (layout.height, layout.width)),
+        layout.dtype.newbyteorder('=')
+    )
+    read_tiff_bands(content, layout, indexes, array if array.ndim == 3 else array[np.newaxis])
+
+    return array
+
+
+def _output_array(
+    out: Optional[np.ndarray],
+    array_shape: Tuple[int, ...],
+    dtype: Any,
+    spool_to_disk: bool = False
+) -> np.ndarray:
+    '''Check that `out` fits the result or allocate a new result array if it is None'''
+
+    if out is None:
+        return _allocate_array(array_shape, dtype, spool_to_disk)
+
+    if out.shape != array_shape:
+        raise InputException(f'out: Must have the shape {array_shape}, got {out.shape}')
+
+    if out.dtype != np.dtype(dtype):
+        raise InputException(f'out: Must have the data type {np.dtype(dtype)}, got {out.dtype}')
+
+    return out
+
+
+def _allocate_array(array_shape: Tuple[int, ...], dtype: str, spool_to_disk: bool = False) -> np.ndarray:
+    '''
+    Allocate an uninitialized array, either in memory or memory-mapped to an anonymous temporary file
+    '''
+
+    if not spool_to_disk:
+        return np.empty(array_shape, dtype=dtype)
+
+    with tempfile.TemporaryFile(prefix='geoengine-') as file:
+        # the memory map stays valid after the file handle is closed
+        return np.memmap(file, dtype=dtype, mode='w+', shape=array_shape)
+
+
+@instrumented('register_workflow', '/workflow')
+def register_workflow(workflow: Dict[str, Any], timeout: int = 60, deduplicate: bool = True) -> Workflow:
     '''
     Register a workflow in Geo Engine and receive a `WorkflowId`
+
+    If `deduplicate` is True, an identical workflow that was already registered on the same server
+    is looked up in the workflow registry instead of being sent again.
     '''
 
     session = get_session()
+    registry = get_workflow_registry()
+    content_hash = workflow_hash(workflow)
 
-    workflow_response = req.post(
+    if deduplicate:
+        known_id = registry.get(session.server_url, content_hash)
+        if known_id is not None:
+            return Workflow(WorkflowId(known_id))
+
+    workflow_response = session.requests_session.post(
         f'{session.server_url}/workflow',
         json=workflow,
         headers=session.auth_header,
         timeout=timeout
     ).json()
 
-    return Workflow(WorkflowId.from_response(workflow_response))
+    workflow_id = WorkflowId.from_response(workflow_response)
+
+    registry.put(session.server_url, content_hash, UUID(str(workflow_id)))
+
+    return Workflow(workflow_id)
+
+
+def register_workflows(workflows: List[Dict[str, Any]], timeout: int = 60, max_workers: int = 8) -> List[Workflow]:
+    '''
+    Register many workflows in Geo Engine
+
+    Only workflows that are unknown to the workflow registry are sent, each distinct one once and concurrently.
+    The result is in the order of `workflows`.
+    '''
+
+    if max_workers < 1:
+        raise InputException('max_workers must be positive')
+
+    session = get_session()
+    registry = get_workflow_registry()
+
+    content_hashes = [workflow_hash(workflow) for workflow in workflows]
+
+    unseen: Dict[str, Dict[str, Any]] = {}
+    for (content_hash, workflow) in zip(content_hashes, workflows):
+        if content_hash not in unseen and registry.get(session.server_url, content_hash) is None:
+            unseen[content_hash] = workflow
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(lambda workflow: register_workflow(workflow, timeout, deduplicate=False),
+                              unseen.values()):
+            pass
+
+    return [Workflow(WorkflowId(cast(UUID, registry.get(session.server_url, content_hash))))
+            for content_hash in content_hashes]
 
 
 def workflow_by_id(workflow_id: UUID) -> Workflow:
     '''
     Create a workflow object from a workflow id
-    '''
 
-    # TODO: check that workflow exists
+    The workflow is not checked for existence until it is used.
+    '''
 
     return Workflow(WorkflowId(workflow_id))
+
+
+def resolve_result_descriptors(workflows: List[Workflow], max_workers: int = 8) -> List[ResultDescriptor]:
+    '''
+    Query the result descriptors of many workflows concurrently
+
+    The result descriptors are memoized, so subsequent calls on the workflows do not cause further requests.
+    '''
+
+    if max_workers < 1:
+        raise InputException('max_workers must be positive')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda workflow: workflow.get_result_descriptor(), workflows))
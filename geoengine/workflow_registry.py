@@ -0,0 +1,167 @@
+'''
+A client-side registry of workflows that were already registered in Geo Engine
+'''
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+from os import PathLike
+from threading import Lock
+from typing import Any, ClassVar, Dict, Optional, Tuple, Union
+from uuid import UUID
+from weakref import WeakKeyDictionary
+
+from geoengine.auth import Session, get_session
+
+
+def canonicalize_workflow(workflow: Any) -> str:
+    '''
+    Serialize a workflow definition in a canonical form
+
+    Keys are sorted, whitespace is removed and integral floats are written as integers,
+    so equal operator graphs lead to equal strings.
+    '''
+
+    def normalize(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {str(key): normalize(item) for (key, item) in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(item) for item in value]
+        if isinstance(value, float) and math.isfinite(value) and value.is_integer():
+            return int(value)
+        return value
+
+    return json.dumps(normalize(workflow), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def workflow_hash(workflow: Any) -> str:
+    '''Return the content hash of a workflow definition'''
+
+    return hashlib.sha256(canonicalize_workflow(workflow).encode()).hexdigest()
+
+
+class WorkflowRegistry:
+    '''
+    Remembers the ids of registered workflows by their content hash and server
+
+    The ids are kept in memory and, if a `path` is given, in an SQLite database that persists across processes.
+    Without a persistent store, every session has its own in-memory registry.
+    '''
+
+    __path: Optional[str]
+    __ids: Dict[Tuple[str, str], UUID]
+    __connection: Optional[sqlite3.Connection] = None
+    __lock: Lock
+
+    persistent_registry: ClassVar[Optional[WorkflowRegistry]] = None
+    session_registries: ClassVar[WeakKeyDictionary[Session, WorkflowRegistry]] = WeakKeyDictionary()
+
+    def __init__(self, path: Optional[Union[str, PathLike]] = None) -> None:
+        '''Create a registry that is persisted in the SQLite database at `path` if it is given'''
+
+        self.__path = os.fspath(path) if path is not None else None
+        self.__ids = {}
+        self.__lock = Lock()
+
+        if self.__path is not None:
+            self.__connection = sqlite3.connect(self.__path, check_same_thread=False)
+            with self.__connection:
+                self.__connection.execute(
+                    'CREATE TABLE IF NOT EXISTS workflows ('
+                    'server_url TEXT NOT NULL, hash TEXT NOT NULL, workflow_id TEXT NOT NULL, '
+                    'PRIMARY KEY (server_url, hash))'
+                )
+
+    def __repr__(self) -> str:
+        return f'WorkflowRegistry(path={self.__path!r})'
+
+    def get(self, server_url: str, content_hash: str) -> Optional[UUID]:
+        '''Return the id of the workflow with `content_hash` on `server_url` if it is known'''
+
+        key = (server_url, content_hash)
+
+        with self.__lock:
+            workflow_id = self.__ids.get(key)
+            if workflow_id is not None or self.__connection is None:
+                return workflow_id
+
+            row = self.__connection.execute(
+                'SELECT workflow_id FROM workflows WHERE server_url = ? AND hash = ?',
+                key
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            workflow_id = UUID(row[0])
+            self.__ids[key] = workflow_id
+
+            return workflow_id
+
+    def put(self, server_url: str, content_hash: str, workflow_id: UUID) -> None:
+        '''Remember the id of the workflow with `content_hash` on `server_url`'''
+
+        with self.__lock:
+            self.__ids[(server_url, content_hash)] = workflow_id
+
+            if self.__connection is not None:
+                with self.__connection:
+                    self.__connection.execute(
+                        'INSERT OR REPLACE INTO workflows (server_url, hash, workflow_id) VALUES (?, ?, ?)',
+                        (server_url, content_hash, str(workflow_id))
+                    )
+
+    def __len__(self) -> int:
+        '''Return the number of known workflows'''
+
+        with self.__lock:
+            if self.__connection is None:
+                return len(self.__ids)
+            return self.__connection.execute('SELECT COUNT(*) FROM workflows').fetchone()[0]
+
+    def clear(self) -> None:
+        '''Forget all workflows'''
+
+        with self.__lock:
+            self.__ids.clear()
+
+            if self.__connection is not None:
+                with self.__connection:
+                    self.__connection.execute('DELETE FROM workflows')
+
+    def close(self) -> None:
+        '''Close the database of a persistent registry'''
+
+        with self.__lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+
+def set_workflow_store(path: Optional[Union[str, PathLike]]) -> Optional[WorkflowRegistry]:
+    '''
+    Persist the ids of registered workflows in the SQLite database at `path`
+
+    The store is shared by all sessions and processes that use it.
+    If `path` is None, the ids are only kept in memory for each session.
+    '''
+
+    if WorkflowRegistry.persistent_registry is not None:
+        WorkflowRegistry.persistent_registry.close()
+
+    WorkflowRegistry.persistent_registry = WorkflowRegistry(path) if path is not None else None
+
+    return WorkflowRegistry.persistent_registry
+
+
+def get_workflow_registry() -> WorkflowRegistry:
+    '''Return the persistent workflow registry if it is set or the in-memory registry of the current session'''
+
+    if WorkflowRegistry.persistent_registry is not None:
+        return WorkflowRegistry.persistent_registry
+
+    return WorkflowRegistry.session_registries.setdefault(get_session(), WorkflowRegistry())
@@ -168,6 +168,35 @@ class AuthTests(unittest.TestCase):
     def test_initialize_credentials_and_token(self):
         self.assertRaises(GeoEngineException, ge.initialize, "http://mock-instance", ("user", "pass"), "token")
 
+    def test_connection_pool(self):
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            ge.initialize("http://mock-instance",
+                          pool_config=ge.ConnectionPoolConfig(pool_maxsize=32, pool_block=True, keep_alive=False))
+
+            http_session = ge.get_session().requests_session
+
+            for prefix in ['http://', 'https://']:
+                adapter = http_session.adapters[prefix]
+                # pylint: disable=protected-access
+                self.assertEqual(adapter._pool_maxsize, 32)
+                self.assertTrue(adapter._pool_block)
+
+            self.assertEqual(http_session.headers['Connection'], 'close')
+
+            # the login request went through the pooled session as well
+            self.assertEqual(m.call_count, 1)
+            self.assertIs(ge.get_session().requests_session, http_session)
+
+    def test_invalid_connection_pool_config(self):
+        with self.assertRaises(ValueError):
+            ge.ConnectionPoolConfig(pool_maxsize=0)
+
 
 if __name__ == '__main__':
     unittest.main()
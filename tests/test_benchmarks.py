@@ -0,0 +1,69 @@
+'''Tests for the benchmark suite'''
+
+import os
+import tempfile
+import unittest
+
+import geoengine as ge
+from benchmarks.__main__ import main
+from benchmarks.server import StandInServer
+from benchmarks.suite import IMPORT_SCENARIO, SCENARIOS, compare_results, measure_import, read_results, \
+    run_benchmarks, write_results
+
+
+class BenchmarkTests(unittest.TestCase):
+    '''Benchmark test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+
+    def test_scenarios(self):
+        with StandInServer() as server:
+            results = run_benchmarks(server, list(SCENARIOS), repeats=2, quick=True, isolated=False)
+
+        self.assertEqual([(result.scenario, result.size) for result in results],
+                         [(scenario.name, scenario.sizes[0]) for scenario in SCENARIOS.values()])
+
+        for result in results:
+            self.assertEqual(result.repeats, 2)
+            self.assertLessEqual(result.min_seconds, result.p50_seconds)
+            self.assertLessEqual(result.p95_seconds, result.max_seconds)
+            self.assertGreater(result.bytes_per_call, 0)
+            self.assertGreater(result.calls_per_second, 0)
+            self.assertGreater(result.peak_rss_bytes, 0)
+
+        # a 256x256 uint16 coverage is transferred per call
+        self.assertGreater(results[0].bytes_per_call, 256 * 256 * 2)
+
+    def test_import(self):
+        result = measure_import(2)
+
+        self.assertEqual((result.scenario, result.repeats), (IMPORT_SCENARIO, 2))
+        self.assertGreater(result.min_seconds, 0.0)
+        self.assertGreater(result.peak_rss_bytes, 0)
+
+    def test_compare(self):
+        with StandInServer() as server:
+            old = run_benchmarks(server, ['wait_for_finish'], repeats=1, quick=True, isolated=False)
+
+        slower = [result._replace(p50_seconds=result.p50_seconds * 2) for result in old]
+        larger = [result._replace(peak_rss_bytes=result.peak_rss_bytes * 2) for result in old]
+
+        self.assertFalse(compare_results(old, old)[0].regressed)
+        self.assertTrue(compare_results(old, slower)[0].regressed)
+        self.assertFalse(compare_results(old, slower, threshold=1.5)[0].regressed)
+        self.assertTrue(compare_results(old, larger)[0].regressed)
+        self.assertEqual(compare_results(old, [result._replace(size=2) for result in old]), [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            (old_path, new_path) = (os.path.join(directory, 'old.json'), os.path.join(directory, 'new.json'))
+            write_results(old, old_path)
+            write_results(slower, new_path)
+
+            self.assertEqual(read_results(old_path), old)
+            self.assertEqual(main(['compare', old_path, old_path]), 0)
+            self.assertEqual(main(['compare', old_path, new_path]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+'''Tests for the result cache'''
+
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import requests_mock
+import geoengine as ge
+from tests.test_wcs import synthetic_coverage_callback
+
+
+class CacheTests(unittest.TestCase):
+    '''Result cache test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+        ge.disable_result_cache()
+
+    def tearDown(self) -> None:
+        ge.disable_result_cache()
+
+    def test_put_get(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ge.ResultCache(directory, max_bytes=1024)
+
+            self.assertIsNone(cache.get('foo'))
+
+            cache.put('foo', b'bar')
+            self.assertEqual(cache.get('foo'), b'bar')
+
+            cache.put('foo', b'baz!')
+            self.assertEqual(cache.get('foo'), b'baz!')
+
+            self.assertEqual(cache.stats, ge.CacheStats(hits=2, misses=1, evictions=0, entries=1, size_bytes=4))
+            self.assertAlmostEqual(cache.stats.hit_rate, 2 / 3)
+
+            # a failed write leaves no trace
+            with self.assertRaises(RuntimeError):
+                with cache.writer('broken') as file:
+                    file.write(b'partial')
+                    raise RuntimeError()
+
+            self.assertIsNone(cache.get('broken'))
+            self.assertEqual(os.listdir(directory), ['foo.result'])
+
+            # entries persist
+            self.assertEqual(ge.ResultCache(directory).get('foo'), b'baz!')
+            self.assertEqual(ge.ResultCache(directory).stats.size_bytes, 4)
+
+            cache.clear()
+            self.assertIsNone(cache.get('foo'))
+            self.assertEqual(cache.stats, ge.CacheStats(hits=0, misses=1, evictions=0, entries=0, size_bytes=0))
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ge.ResultCache(directory, max_bytes=30)
+
+            now = time.time()
+            for (i, key) in enumerate(['a', 'b', 'c']):
+                cache.put(key, bytes(10))
+                # file system timestamps may be coarse
+                os.utime(os.path.join(directory, f'{key}.result'), (now - 100 + i, now - 100 + i))
+
+            # `a` is used recently, so `b` is the least recently used entry
+            self.assertIsNotNone(cache.get('a'))
+
+            cache.put('d', bytes(10))
+
+            self.assertIsNone(cache.get('b'))
+            for key in ['a', 'c', 'd']:
+                self.assertIsNotNone(cache.get(key))
+
+            self.assertEqual(cache.stats.evictions, 1)
+            self.assertEqual(cache.stats.size_bytes, 30)
+
+    def test_key(self):
+        query = ge.QueryRectangle(
+            ge.BoundingBox2D(-180, -90, 180, 90),
+            ge.TimeInterval(datetime(2014, 4, 1, 12, tzinfo=timezone.utc)),
+            ge.SpatialResolution(0.1, 0.1),
+        )
+        same_query = ge.QueryRectangle(
+            ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+            ge.TimeInterval(
+                datetime(2014, 4, 1, 14, tzinfo=timezone(timedelta(hours=2))),
+                datetime(2014, 4, 1, 12, tzinfo=timezone.utc),
+            ),
+            ge.SpatialResolution(0.1, 0.1),
+        )
+        other_query = ge.QueryRectangle(
+            ge.BoundingBox2D(-180, -90, 180, 90),
+            ge.TimeInterval(datetime(2014, 4, 1, 13, tzinfo=timezone.utc)),
+            ge.SpatialResolution(0.1, 0.1),
+        )
+
+        self.assertEqual(ge.ResultCache.key('wcs', query, None), ge.ResultCache.key('wcs', same_query, None))
+        self.assertNotEqual(ge.ResultCache.key('wcs', query, None), ge.ResultCache.key('wcs', other_query, None))
+        self.assertNotEqual(ge.ResultCache.key('wcs', query, None), ge.ResultCache.key('wcs', query, 0.0))
+
+    def test_workflow_results(self):
+        source = np.arange(1, 12 * 20 + 1, dtype=np.uint16).reshape(12, 20)
+
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62/metadata',
+                  json={
+                      "type": "raster",
+                      "dataType": "U16",
+                      "spatialReference": "EPSG:4326",
+                      "measurement": {
+                              "type": "unitless"
+                      }
+                  })
+
+            wcs_matcher = m.get('http://mock-instance/wcs/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62',
+                                content=synthetic_coverage_callback(source, 18.0, 15.0))
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62'))
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime(2014, 4, 1, 12, tzinfo=timezone.utc)),
+                resolution=ge.SpatialResolution(18.0, 15.0),
+            )
+
+            # disabled by default
+            workflow.get_array(query)
+            workflow.get_array(query)
+            self.assertEqual(wcs_matcher.call_count, 2)
+
+            cache = ge.enable_result_cache(os.path.join(directory, 'cache'))
+            self.assertIs(ge.get_result_cache(), cache)
+
+            m.reset_mock()
+
+            for _ in range(2):
+                self.assertTrue(np.array_equal(workflow.get_array(query), source))
+                self.assertTrue(np.array_equal(workflow.get_array(query, tile_shape=(6, 10)), source))
+                self.assertTrue(np.array_equal(workflow.get_array(query, spool_to_disk=True), source))
+
+            # the single request, the tiles and the spooled request with the same key as the single one
+            self.assertEqual(wcs_matcher.call_count, 1 + 4)
+
+            # a different no data value is a different result
+            workflow.get_array(query, force_no_data_value=0.0)
+            self.assertEqual(wcs_matcher.call_count, 1 + 4 + 1)
+
+            # downloads share the entry of the single request
+            file_path = os.path.join(directory, 'download.tiff')
+            workflow.download_raster(query, file_path)
+            first_download = open(file_path, 'rb').read()  # pylint: disable=consider-using-with
+            os.remove(file_path)
+
+            progress = workflow.download_raster(query, file_path)
+            self.assertEqual(wcs_matcher.call_count, 1 + 4 + 1)
+            self.assertEqual(progress.bytes_done, len(first_download))
+            with open(file_path, 'rb') as file:
+                self.assertEqual(file.read(), first_download)
+
+            stats = cache.stats
+            self.assertEqual(stats.misses, 1 + 4 + 1)
+            self.assertEqual(stats.hits, 1 + 4 + 2 + 2)
+            self.assertEqual(stats.entries, 1 + 4 + 1)
+
+    def test_results_are_per_user(self):
+        source = np.arange(1, 12 * 20 + 1, dtype=np.uint16).reshape(12, 20)
+        user_ids = {'alice@example.com': '6f2f5a79-bf4e-4b6b-8d43-5e3ac7c8e3a1',
+                    'bob@example.com': 'f6a9a8a1-3c1f-4f6e-9b0e-1d2d8e7b9a44'}
+
+        def login(request, _context):
+            email = request.json()['email']
+            return {
+                'id': str(uuid4()),
+                'user': {'id': user_ids[email], 'email': email, 'realName': email},
+                'created': '2021-01-01T00:00:00Z',
+                'validUntil': '2031-01-01T00:00:00Z',
+                'project': None,
+                'view': None,
+            }
+
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/login', json=login)
+            m.get('http://mock-instance/workflow/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62/metadata',
+                  json={
+                      "type": "raster",
+                      "dataType": "U16",
+                      "spatialReference": "EPSG:4326",
+                      "measurement": {
+                              "type": "unitless"
+                      }
+                  })
+            wcs_matcher = m.get('http://mock-instance/wcs/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62',
+                                content=synthetic_coverage_callback(source, 18.0, 15.0))
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime(2014, 4, 1, 12, tzinfo=timezone.utc)),
+                resolution=ge.SpatialResolution(18.0, 15.0),
+            )
+
+            # both users share one cache directory
+            for email in ['alice@example.com', 'bob@example.com', 'alice@example.com']:
+                ge.enable_result_cache(os.path.join(directory, 'cache'))
+                ge.initialize("http://mock-instance", credentials=(email, 'secret'))
+
+                workflow = ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62'))
+                self.assertTrue(np.array_equal(workflow.get_array(query), source))
+
+                ge.reset(False)
+
+            # the second session of the first user reuses its result
+            self.assertEqual(wcs_matcher.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+'''Tests for the layer catalog'''
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+import requests_mock
+
+import geoengine as ge
+from geoengine.layers import LayerCollectionListingType
+
+PROVIDER_ID = 'ce5e84db-cbf9-48a2-9a32-d4b7cc56ea74'
+ROOT_ID = '05102bb3-a855-4a37-8a8a-30026a91fef1'
+
+
+def listing(kind: str, item_id: str, name: str, description: str = '') -> Dict:
+    '''Create an item of a layer collection response'''
+
+    id_key = 'layerId' if kind == 'layer' else 'collectionId'
+
+    return {
+        'type': kind,
+        'id': {id_key: item_id, 'providerId': PROVIDER_ID},
+        'name': name,
+        'description': description,
+    }
+
+
+class MockLayerTree:
+    '''Serves a mutable layer tree and counts the requests per collection'''
+
+    def __init__(self) -> None:
+        '''Start with an empty tree'''
+        self.collections: Dict[str, Tuple[str, List[Dict]]] = {}
+        self.failing: set = set()
+        self.requests: Dict[str, int] = {}
+
+    def register(self, mocker: requests_mock.Mocker) -> None:
+        '''Register the root and all collections'''
+
+        mocker.get('http://mock-instance/layers/collections', json=self.callback(ROOT_ID))
+        for collection_id in ['a', 'b', 'c']:
+            mocker.get(f'http://mock-instance/layers/collections/{PROVIDER_ID}/{collection_id}',
+                       json=self.callback(collection_id))
+
+    def callback(self, collection_id: str):
+        '''Return a response callback for a collection'''
+
+        def respond(_request, context):
+            self.requests[collection_id] = self.requests.get(collection_id, 0) + 1
+
+            if collection_id in self.failing:
+                context.status_code = 500
+                return {'error': 'Internal', 'message': 'failed'}
+
+            (name, items) = self.collections[collection_id]
+            return {
+                'id': {'collectionId': collection_id, 'providerId': PROVIDER_ID},
+                'name': name,
+                'description': '',
+                'items': items,
+                'entryLabel': None,
+                'properties': [],
+            }
+
+        return respond
+
+
+class CatalogTests(unittest.TestCase):
+    '''Catalog test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+
+    def test_crawl_and_search(self):  # pylint: disable=too-many-statements
+        tree = MockLayerTree()
+        tree.collections = {
+            ROOT_ID: ('Layers', [
+                listing('collection', 'a', 'Satellite', 'Remote sensing products'),
+                listing('collection', 'b', 'Climate'),
+                listing('layer', 'land-cover', 'Land Cover', 'Land cover derived from MODIS'),
+            ]),
+            # `b` is listed twice and `a` and `b` list each other
+            'a': ('Satellite', [
+                listing('layer', 'ndvi', 'NDVI', 'Vegetation index from MODIS'),
+                listing('collection', 'b', 'Climate'),
+            ]),
+            'b': ('Climate', [
+                listing('layer', 'precipitation', 'Precipitation', 'Monthly precipitation sums'),
+                listing('collection', 'a', 'Satellite', 'Remote sensing products'),
+            ]),
+        }
+
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+            tree.register(m)
+
+            ge.initialize("http://mock-instance")
+
+            catalog = ge.LayerCatalog(os.path.join(directory, 'catalog.sqlite'))
+
+            stats = catalog.crawl(max_workers=2)
+            self.assertEqual((stats.collections_loaded, stats.collections_unchanged, stats.collections_skipped),
+                             (3, 0, 0))
+            self.assertEqual(stats.errors, [])
+            self.assertEqual(tree.requests, {ROOT_ID: 1, 'a': 1, 'b': 1})
+            self.assertEqual(len(catalog), 7)
+
+            [ndvi] = catalog.search('vegetation')
+            self.assertEqual(ndvi, ge.CatalogEntry(
+                kind=LayerCollectionListingType.LAYER,
+                provider_id=ge.LayerProviderId(UUID(PROVIDER_ID)),
+                item_id='ndvi',
+                name='NDVI',
+                description='Vegetation index from MODIS',
+                parent_provider_id=ge.LayerProviderId(UUID(PROVIDER_ID)),
+                parent_collection_id=ge.LayerCollectionId('a'),
+            ))
+            self.assertIsInstance(ndvi.listing(), ge.LayerListing)
+
+            self.assertEqual({entry.item_id for entry in catalog.search('modis')}, {'land-cover', 'ndvi'})
+            self.assertEqual([entry.item_id for entry in catalog.search('land cov')], ['land-cover'])
+            self.assertEqual({entry.parent_collection_id for entry in catalog.search(
+                'satellite', kind=LayerCollectionListingType.COLLECTION)}, {ROOT_ID, 'b'})
+            self.assertEqual(catalog.search('"*'), [])
+            catalog.close()
+
+            # the catalog is persisted and fresh collections are not loaded again
+            catalog = ge.LayerCatalog(os.path.join(directory, 'catalog.sqlite'))
+            self.assertEqual(len(catalog), 7)
+
+            stats = catalog.crawl(max_age_seconds=3600)
+            self.assertEqual((stats.collections_loaded, stats.collections_unchanged, stats.collections_skipped),
+                             (0, 1, 2))
+            self.assertEqual(tree.requests, {ROOT_ID: 2, 'a': 1, 'b': 1})
+
+            # changed collections are rewritten and removed ones are dropped
+            tree.collections[ROOT_ID] = (tree.collections[ROOT_ID][0], tree.collections[ROOT_ID][1][:1])
+            tree.collections['a'] = ('Satellite', [listing('layer', 'evi', 'EVI', 'Enhanced vegetation index')])
+
+            stats = catalog.crawl()
+            self.assertEqual((stats.collections_loaded, stats.collections_removed), (2, 1))
+            self.assertEqual(catalog.search('precipitation'), [])
+            self.assertEqual([entry.item_id for entry in catalog.search('vegetation')], ['evi'])
+            self.assertEqual(len(catalog), 2)
+
+            # failures are reported and keep the previous entries
+            tree.failing.add('a')
+            stats = catalog.crawl()
+            self.assertEqual([(error.collection_id, type(error.error)) for error in stats.errors],
+                             [('a', ge.GeoEngineException)])
+            self.assertEqual(len(catalog), 2)
+
+            catalog.close()
+            with self.assertRaises(ge.InputException):
+                catalog.search('vegetation')
+
+    def test_index_consistency(self):
+        tree = MockLayerTree()
+        tree.collections = {
+            ROOT_ID: ('Layers', [
+                listing('layer', 'ndvi', 'NDVI', 'Vegetation index from MODIS'),
+                listing('layer', 'land-cover', 'Land Cover', 'Land cover derived from MODIS'),
+                # an item that is listed twice is indexed once
+                listing('layer', 'ndvi', 'NDVI', 'Vegetation index from MODIS'),
+            ]),
+        }
+
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+            tree.register(m)
+
+            ge.initialize("http://mock-instance")
+
+            path = os.path.join(directory, 'catalog.sqlite')
+
+            # a catalog of an older schema is rebuilt
+            with sqlite3.connect(path) as connection:
+                connection.execute('CREATE TABLE entries (name TEXT)')
+            connection.close()
+
+            with ge.LayerCatalog(path) as catalog:
+                catalog.crawl()
+                self.assertEqual(len(catalog), 2)
+                self.assertEqual([entry.item_id for entry in catalog.search('vegetation')], ['ndvi'])
+
+            # the full-text index refers to the entries by their id, which survives a vacuum
+            with sqlite3.connect(path) as connection:
+                connection.execute('VACUUM')
+                connection.execute("INSERT INTO entries_fts (entries_fts) VALUES ('integrity-check')")
+            connection.close()
+
+            with ge.LayerCatalog(path) as catalog:
+                self.assertEqual([entry.item_id for entry in catalog.search('vegetation')], ['ndvi'])
+                self.assertEqual([entry.item_id for entry in catalog.search('land cover')], ['land-cover'])
+
+                tree.collections[ROOT_ID] = ('Layers', [listing('layer', 'evi', 'EVI', 'Enhanced vegetation index')])
+                catalog.crawl()
+
+                self.assertEqual([entry.item_id for entry in catalog.search('vegetation')], ['evi'])
+                self.assertEqual(catalog.search('modis'), [])
+
+            with sqlite3.connect(path) as connection:
+                connection.execute("INSERT INTO entries_fts (entries_fts) VALUES ('integrity-check')")
+            connection.close()
+
+    def test_max_depth(self):
+        tree = MockLayerTree()
+        tree.collections = {
+            ROOT_ID: ('Layers', [listing('collection', 'a', 'Satellite')]),
+            'a': ('Satellite', [listing('collection', 'c', 'Sentinel')]),
+            'c': ('Sentinel', [listing('layer', 's2', 'Sentinel-2')]),
+        }
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+            tree.register(m)
+
+            ge.initialize("http://mock-instance")
+
+            with ge.LayerCatalog() as catalog:
+                catalog.crawl(max_depth=1)
+                self.assertEqual(tree.requests, {ROOT_ID: 1, 'a': 1})
+                self.assertEqual(catalog.search('sentinel')[0].item_id, 'c')
+
+                catalog.crawl(ge.LayerCollectionId('c'))
+                self.assertEqual(catalog.search('sentinel 2')[0].item_id, 's2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+'''Tests for the HTTP cache of metadata responses'''
+
+import os
+import tempfile
+import unittest
+from typing import Any, Dict
+from unittest import mock
+from uuid import UUID
+
+import requests_mock
+
+import geoengine as ge
+from geoengine.datasets import DatasetId
+
+WORKFLOW_ID = UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62')
+WORKFLOW_URL = f'http://mock-instance/workflow/{WORKFLOW_ID}'
+PROVENANCE_URL = f'http://mock-instance/workflow/{WORKFLOW_ID}/provenance'
+
+WORKFLOW = {
+    'type': 'Raster',
+    'operator': {
+        'type': 'GdalSource',
+        'params': {'data': 'ndvi'}
+    }
+}
+
+LAYER_DB_URL = 'http://mock-instance/layers/collections/ce5e84db-cbf9-48a2-9a32-d4b7cc56ea74/' \
+    '05102bb3-a855-4a37-8a8a-30026a91fef1?offset=0&limit=20'
+
+LAYER_DB: Dict[str, Any] = {
+    'description': 'Root collection for LayerDB',
+    'entryLabel': None,
+    'id': {
+        'collectionId': '05102bb3-a855-4a37-8a8a-30026a91fef1',
+        'providerId': 'ce5e84db-cbf9-48a2-9a32-d4b7cc56ea74',
+    },
+    'items': [],
+    'name': 'LayerDB',
+    'properties': [],
+}
+
+COLLECTION_LISTING = {
+    'description': 'test description',
+    'id': {
+        'collectionId': '490ef009-aa7a-44b0-bbef-73cfb5916b55',
+        'providerId': 'ce5e84db-cbf9-48a2-9a32-d4b7cc56ea74',
+    },
+    'name': 'my test collection',
+    'type': 'collection',
+}
+
+PROVENANCE = [{
+    'data': [{'type': 'internal', 'datasetId': '36574dc3-560a-4b09-9d22-d5945f2b8093'}],
+    'provenance': {'citation': 'Sample Citation', 'license': 'Sample License', 'uri': 'http://example.org/'}
+}]
+
+
+class HttpCacheTests(unittest.TestCase):
+    '''HTTP cache test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+
+    def initialize(self, m, http_cache, admin_token=None):
+        '''Create an anonymous session that uses `http_cache`'''
+        m.post('http://mock-instance/anonymous', json={
+            "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+            "project": None,
+            "view": None
+        })
+
+        ge.initialize("http://mock-instance", admin_token=admin_token, http_cache=http_cache)
+
+    def test_revalidation(self):
+        with requests_mock.Mocker() as m, ge.HttpCache() as http_cache:
+            self.initialize(m, http_cache)
+            self.assertIs(ge.get_session().http_cache, http_cache)
+
+            matcher = m.get(WORKFLOW_URL, [
+                {'json': WORKFLOW, 'headers': {'ETag': '"v1"'}},
+                {'status_code': 304, 'headers': {'ETag': '"v1"'}},
+                {'json': {**WORKFLOW, 'type': 'Vector'}, 'headers': {'ETag': '"v2"'}},
+            ])
+
+            workflow = ge.workflow_by_id(WORKFLOW_ID)
+
+            self.assertEqual(workflow.workflow_definition(), WORKFLOW)
+            self.assertNotIn('If-None-Match', matcher.last_request.headers)
+
+            # an unchanged response is revalidated instead of downloaded
+            self.assertEqual(workflow.workflow_definition(), WORKFLOW)
+            self.assertEqual(matcher.last_request.headers['If-None-Match'], '"v1"')
+
+            # a changed response replaces the stored one
+            self.assertEqual(workflow.workflow_definition()['type'], 'Vector')
+            self.assertEqual(matcher.call_count, 3)
+
+            self.assertEqual(http_cache.stats, ge.HttpCacheStats(hits=0, revalidations=1, misses=2, entries=1))
+
+    def test_freshness(self):
+        with requests_mock.Mocker() as m, ge.HttpCache(default_ttl_seconds=60) as http_cache:
+            self.initialize(m, http_cache)
+
+            workflow = ge.workflow_by_id(WORKFLOW_ID)
+
+            # `max-age` takes precedence over the validators
+            matcher = m.get(WORKFLOW_URL, json=WORKFLOW, headers={
+                'Cache-Control': 'private, max-age=3600',
+                'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+            })
+            workflow.workflow_definition()
+            workflow.workflow_definition()
+            self.assertEqual(matcher.call_count, 1)
+
+            # without validators, responses are reused for the default TTL
+            matcher = m.get(PROVENANCE_URL, json=PROVENANCE)
+            with mock.patch('geoengine.http_cache.time.time', return_value=1000.0):
+                self.assertEqual(len(workflow.get_provenance()), 1)
+            with mock.patch('geoengine.http_cache.time.time', return_value=1059.0):
+                self.assertEqual(len(workflow.get_provenance()), 1)
+            self.assertEqual(matcher.call_count, 1)
+            with mock.patch('geoengine.http_cache.time.time', return_value=1061.0):
+                self.assertEqual(len(workflow.get_provenance()), 1)
+            self.assertEqual(matcher.call_count, 2)
+
+            self.assertEqual(http_cache.stats.hits, 2)
+
+            # errors and `no-store` responses are not stored
+            http_cache.clear()
+            m.get(WORKFLOW_URL, [
+                {'status_code': 404, 'json': {'error': 'NotFound', 'message': 'missing'}},
+                {'json': WORKFLOW, 'headers': {'Cache-Control': 'no-store'}},
+            ])
+            workflow.workflow_definition()
+            workflow.workflow_definition()
+            self.assertEqual(http_cache.stats, ge.HttpCacheStats(hits=0, revalidations=0, misses=2, entries=0))
+
+    def test_persistence(self):
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'http-cache.sqlite')
+
+            with ge.HttpCache(path) as http_cache:
+                self.initialize(m, http_cache)
+
+                matcher = m.get(WORKFLOW_URL, json=WORKFLOW, headers={'Cache-Control': 'max-age=3600'})
+                ge.workflow_by_id(WORKFLOW_ID).workflow_definition()
+
+            with ge.HttpCache(path) as http_cache:
+                ge.get_session().http_cache = http_cache
+
+                self.assertEqual(ge.workflow_by_id(WORKFLOW_ID).workflow_definition(), WORKFLOW)
+                self.assertEqual(matcher.call_count, 1)
+
+                # responses are not shared between users
+                key = ge.HttpCache.key(WORKFLOW_URL, ge.get_session().auth_header)
+                self.assertNotEqual(key, ge.HttpCache.key(WORKFLOW_URL, {'Authorization': 'Bearer other'}))
+
+                self.assertEqual(http_cache.invalidate('http://mock-instance/workflow/'), 1)
+                self.assertEqual(http_cache.stats.entries, 0)
+
+            with self.assertRaises(ge.InputException):
+                http_cache.clear()
+
+            ge.get_session().http_cache = None
+            ge.workflow_by_id(WORKFLOW_ID).workflow_definition()
+            self.assertEqual(matcher.call_count, 2)
+
+    def test_invalidation_after_writes(self):
+        with requests_mock.Mocker() as m, ge.HttpCache() as http_cache:
+            self.initialize(m, http_cache, admin_token='8aca8875-425a-4ef1-8ee6-cdfc62dd7525')
+
+            listing_matcher = m.get(LAYER_DB_URL, [
+                {'json': LAYER_DB, 'headers': {'Cache-Control': 'max-age=3600'}},
+                {'json': {**LAYER_DB, 'items': [COLLECTION_LISTING]}, 'headers': {'Cache-Control': 'max-age=3600'}},
+                {'json': LAYER_DB, 'headers': {'Cache-Control': 'max-age=3600'}},
+            ])
+            m.post('http://mock-instance/layerDb/collections/05102bb3-a855-4a37-8a8a-30026a91fef1/collections',
+                   json={'id': '490ef009-aa7a-44b0-bbef-73cfb5916b55'})
+            m.delete('http://mock-instance/layerDb/collections/05102bb3-a855-4a37-8a8a-30026a91fef1/collections/'
+                     '490ef009-aa7a-44b0-bbef-73cfb5916b55')
+
+            self.assertEqual(len(ge.layer_collection('05102bb3-a855-4a37-8a8a-30026a91fef1').items), 0)
+            self.assertEqual(len(ge.layer_collection('05102bb3-a855-4a37-8a8a-30026a91fef1').items), 0)
+            self.assertEqual(listing_matcher.call_count, 1)
+
+            # a write to the layer database is visible to the next read
+            root = ge.layer_collection('05102bb3-a855-4a37-8a8a-30026a91fef1')
+            root.add_collection('my test collection', 'test description')
+            collection = ge.layer_collection('05102bb3-a855-4a37-8a8a-30026a91fef1')
+            self.assertEqual([item.name for item in collection.items], ['my test collection'])
+            self.assertEqual(listing_matcher.call_count, 2)
+
+            collection.remove_item(0)
+            self.assertEqual(len(ge.layer_collection('05102bb3-a855-4a37-8a8a-30026a91fef1').items), 0)
+            self.assertEqual(listing_matcher.call_count, 3)
+
+            # adding or deleting a dataset invalidates the dataset responses
+            volumes_matcher = m.get('http://mock-instance/dataset/volumes',
+                                    json=[{'name': 'test_data', 'path': '.'}],
+                                    headers={'Cache-Control': 'max-age=3600'})
+            m.delete('http://mock-instance/dataset/36574dc3-560a-4b09-9d22-d5945f2b8093')
+
+            ge.volumes()
+            ge.volumes()
+            self.assertEqual(volumes_matcher.call_count, 1)
+
+            ge.delete_dataset(DatasetId(UUID('36574dc3-560a-4b09-9d22-d5945f2b8093')))
+            ge.volumes()
+            self.assertEqual(volumes_matcher.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
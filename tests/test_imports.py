@@ -0,0 +1,54 @@
+'''Tests for the lazy imports of the package'''
+
+import json
+import subprocess
+import sys
+import unittest
+
+import geoengine as ge
+
+HEAVY_MODULES = ['geopandas', 'matplotlib', 'owslib', 'pandas', 'PIL', 'pkg_resources', 'pyproj', 'rasterio',
+                 'vega', 'xarray']
+
+
+def loaded_heavy_modules(code: str) -> list:
+    '''Run `code` in a fresh interpreter and return the heavy modules that were loaded afterwards'''
+
+    probe = subprocess.run(
+        [sys.executable, '-c', f'{code}\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'],
+        capture_output=True, check=True, text=True
+    )
+    modules = json.loads(probe.stdout)
+
+    return [name for name in HEAVY_MODULES if name in modules]
+
+
+class ImportTests(unittest.TestCase):
+    '''Import test runner'''
+
+    def test_import_is_lazy(self):
+        self.assertEqual(loaded_heavy_modules('import geoengine'), [])
+
+        # sessions, tasks and layers work without the heavy dependencies
+        self.assertEqual(loaded_heavy_modules(
+            'import geoengine as ge\n'
+            'ge.initialize, ge.reset, ge.tasks.Task, ge.layer_collection, ge.workflow_by_id, ge.QueryRectangle\n'
+            'ge.get_session; ge.DEFAULT_USER_AGENT'
+        ), [])
+
+        self.assertIn('rasterio', loaded_heavy_modules('import geoengine as ge\nge.RasterCoverage'))
+
+    def test_attributes(self):
+        self.assertIs(ge.Workflow, ge.workflow.Workflow)
+        self.assertIs(ge.api, sys.modules['geoengine.api'])
+        self.assertEqual(ge.DEFAULT_USER_AGENT, f'geoengine-python/{ge.__version__}')
+        self.assertEqual(ge.default_user_agent(), ge.DEFAULT_USER_AGENT)
+        self.assertIn('upload_dataframe', dir(ge))
+        self.assertIn('upload_dataframe', ge.__all__)
+
+        with self.assertRaises(AttributeError):
+            ge.does_not_exist  # pylint: disable=pointless-statement
+
+
+if __name__ == '__main__':
+    unittest.main()
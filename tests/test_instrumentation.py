@@ -0,0 +1,269 @@
+'''Tests for the instrumentation of operations'''
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+from typing import List, Union
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import UUID
+
+import numpy as np
+import requests
+import requests_mock
+
+import geoengine as ge
+from geoengine.tasks import CompletedTaskStatusInfo, Task, TaskId, TaskStatus
+from tests.test_wcs import synthetic_coverage_callback
+
+
+RESULT_DESCRIPTOR = {
+    "type": "raster",
+    "dataType": "U16",
+    "spatialReference": "EPSG:4326",
+    "measurement": {
+        "type": "unitless"
+    }
+}
+
+
+class RecordingInstrument(ge.Instrument):
+    '''Records all events'''
+
+    def __init__(self) -> None:
+        self.events: List[Union[ge.OperationStart, ge.OperationEnd]] = []
+
+    def on_start(self, event: ge.OperationStart) -> None:
+        self.events.append(event)
+
+    def on_end(self, event: ge.OperationEnd) -> None:
+        self.events.append(event)
+
+
+class FailingInstrument(ge.Instrument):
+    '''Fails on every event'''
+
+    def on_end(self, event: ge.OperationEnd) -> None:
+        raise ValueError('broken instrument')
+
+
+class TaskStatusHandler(BaseHTTPRequestHandler):
+    '''Serves an anonymous session and a completed task over HTTP/1.1'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.send_json({"id": "c4983c3e-9b53-47ae-bda9-382223bd5081", "project": None, "view": None})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.send_json({'status': 'completed', 'info': 'generic info', 'timeTotal': '00:00:05'})
+
+    def send_json(self, body):
+        '''Send a JSON response that keeps the connection alive'''
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class InstrumentationTests(unittest.TestCase):
+    '''Instrumentation test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+
+    def test_operations(self):  # pylint: disable=too-many-statements
+        source = np.arange(1, 12 * 20 + 1, dtype=np.uint16).reshape(12, 20)
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62/metadata',
+                  json=RESULT_DESCRIPTOR)
+
+            coverage = synthetic_coverage_callback(source, 18.0, 15.0)
+            responses = []
+
+            def wcs_callback(request, context):
+                content = coverage(request, context)
+                responses.append(content)
+                return content
+
+            wcs_matcher = m.get('http://mock-instance/wcs/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62',
+                                content=wcs_callback)
+
+            ge.initialize("http://mock-instance", retry_policy=ge.RetryPolicy(backoff_seconds=0.0))
+
+            recorder = RecordingInstrument()
+            collector = ge.HistogramCollector()
+            ge.get_session().add_instrument(recorder)
+            ge.get_session().add_instrument(FailingInstrument())
+            ge.get_session().add_instrument(collector)
+
+            workflow = ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62'))
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime(2014, 4, 1, 12, tzinfo=timezone.utc)),
+                resolution=ge.SpatialResolution(18.0, 15.0),
+            )
+
+            with self.assertLogs(level='WARNING'):
+                self.assertTrue(np.array_equal(workflow.get_array(query), source))
+
+            self.assertEqual(len(recorder.events), 2)
+            (start, end) = (recorder.events[0], recorder.events[1])
+            self.assertIsInstance(start, ge.OperationStart)
+            self.assertEqual((start.name, start.endpoint), ('get_array', '/wcs'))
+            self.assertEqual(end.operation_id, start.operation_id)
+            self.assertEqual(end.status_code, 200)
+            self.assertEqual(end.requests, 2)  # the metadata and the coverage
+            self.assertEqual(end.retries, 0)
+            self.assertEqual(end.bytes_received, len(json.dumps(RESULT_DESCRIPTOR)) + len(responses[0]))
+            self.assertGreater(end.phases['decode'], 0.0)
+            self.assertLessEqual(sum(end.phases.values()), end.duration_seconds)
+            self.assertIsNone(end.error)
+
+            # tiles are fetched on worker threads and transient errors are retried
+            recorder.events.clear()
+            responses.clear()
+            m.get('http://mock-instance/wcs/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62', [
+                {'status_code': 503},
+                {'content': wcs_callback},
+            ])
+
+            with self.assertLogs(level='WARNING'):
+                workflow.get_xarray(query, tile_shape=(6, 20))
+
+            end = recorder.events[-1]
+            self.assertEqual(end.name, 'get_xarray')
+            self.assertEqual(end.requests, 3)
+            self.assertEqual(end.retries, 1)
+            self.assertEqual(end.bytes_received, sum(len(content) for content in responses))
+
+            # failures end the operation with the error
+            recorder.events.clear()
+            m.get('http://mock-instance/wcs/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62', status_code=500)
+
+            with self.assertRaises(requests.HTTPError), self.assertLogs(level='WARNING'):
+                workflow.get_array(query)
+
+            end = recorder.events[-1]
+            self.assertIsInstance(end.error, requests.HTTPError)
+            self.assertEqual(end.status_code, 500)
+
+            self.assertEqual(collector.histogram('get_array').count, 2)
+            self.assertEqual(collector.histogram('get_xarray', 'ttfb').count, 1)
+            self.assertIsNone(collector.histogram('get_dataframe'))
+            self.assertEqual(collector.counter('get_array', 'errors'), 1)
+            self.assertEqual(collector.counter('get_xarray', 'retries'), 1)
+
+            summary = collector.summary()
+            self.assertEqual(list(summary.columns), ['operation', 'metric', 'count', 'mean', 'p50', 'p95', 'max'])
+            self.assertEqual(len(summary), 2 * 5)
+
+            # without instruments, nothing is recorded
+            ge.get_session().remove_instrument(recorder)
+            ge.get_session().remove_instrument(collector)
+            wcs_matcher.reset()
+            with self.assertRaises(requests.HTTPError), self.assertLogs(level='WARNING'):
+                workflow.get_array(query)
+            self.assertEqual(collector.histogram('get_array').count, 2)
+
+    def test_connect_phase(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), TaskStatusHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        try:
+            ge.initialize(f'http://127.0.0.1:{server.server_address[1]}')
+
+            recorder = RecordingInstrument()
+            ge.get_session().add_instrument(recorder)
+
+            task = Task(TaskId(UUID('e07aec1e-387a-4d24-8041-fbfba37eae2b')))
+            for _ in range(2):
+                self.assertEqual(task.get_status(),
+                                 CompletedTaskStatusInfo(TaskStatus.COMPLETED, 'generic info', '00:00:05'))
+
+            ends = [event for event in recorder.events if isinstance(event, ge.OperationEnd)]
+            self.assertEqual([end.name for end in ends], ['task_status', 'task_status'])
+
+            # the session was created on a pooled connection, which is reused
+            self.assertEqual(ends[0].phases['connect'], 0.0)
+            self.assertGreater(ends[0].phases['ttfb'], 0.0)
+            self.assertGreater(ends[0].bytes_received, 0)
+
+            ge.get_session().close()
+            task.get_status()
+            self.assertGreater(recorder.events[-1].phases['connect'], 0.0)
+        finally:
+            ge.reset(False)
+            server.shutdown()
+            server.server_close()
+
+    def test_histogram(self):
+        histogram = ge.Histogram([1.0, 2.0, 4.0])
+
+        for value in [0.5, 1.5, 1.5, 3.0, 10.0]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.mean, 3.3)
+        self.assertEqual(histogram.quantile(0.0), 0.5)
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(1.0), 10.0)
+        self.assertEqual(ge.Histogram().quantile(0.5), 0.0)
+
+    def test_otlp_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spans.jsonl')
+            exporter = ge.OtlpJsonFileExporter(path, service_name='test')
+
+            phases = {'connect': 0.0, 'ttfb': 0.25, 'download': 0.5, 'decode': 0.125}
+            exporter.on_end(ge.OperationEnd(1, 'get_array', '/wcs', 1700000000.0, 1.5, 200, 2, 1, 10, 2048,
+                                            phases, None))
+            exporter.on_end(ge.OperationEnd(2, 'get_array', '/wcs', 1700000001.0, 0.5, 500, 1, 0, 0, 10,
+                                            phases, ValueError('failed')))
+
+            with open(path, encoding='utf-8') as file:
+                lines = [json.loads(line) for line in file]
+
+        self.assertEqual(len(lines), 2)
+
+        resource_spans = lines[0]['resourceSpans'][0]
+        self.assertEqual(resource_spans['resource']['attributes'],
+                         [{'key': 'service.name', 'value': {'stringValue': 'test'}}])
+
+        span = resource_spans['scopeSpans'][0]['spans'][0]
+        self.assertEqual(span['name'], 'get_array')
+        self.assertEqual(len(span['traceId']), 32)
+        self.assertEqual(len(span['spanId']), 16)
+        self.assertEqual(span['startTimeUnixNano'], '1700000000000000000')
+        self.assertEqual(span['endTimeUnixNano'], '1700000001500000000')
+        self.assertEqual(span['status'], {'code': 1})
+
+        attributes = {attribute['key']: attribute['value'] for attribute in span['attributes']}
+        self.assertEqual(attributes['geoengine.endpoint'], {'stringValue': '/wcs'})
+        self.assertEqual(attributes['geoengine.bytes_received'], {'intValue': '2048'})
+        self.assertEqual(attributes['http.response.status_code'], {'intValue': '200'})
+        self.assertEqual(attributes['geoengine.phase.download.seconds'], {'doubleValue': 0.5})
+
+        error_span = lines[1]['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual(error_span['status'], {'code': 2, 'message': 'ValueError: failed'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 """Tests for the layers module."""
 
+import itertools
 import unittest
+from urllib.parse import parse_qs, urlparse
 from uuid import UUID
 import requests_mock
 import geoengine as ge
@@ -214,6 +216,74 @@ class LayerTests(unittest.TestCase):
                 ).__dict__
             )
 
+    def test_layer_collection_pages(self):
+        """Test concurrent and lazy paging of `layer_collection`."""
+
+        collection_url = 'http://mock-instance/layers/collections/ac50ed0d-c9a0-41f8-9ce8-35fc9e38299b/' \
+            '546073b6-d535-4205-b601-99675c9f6dd7'
+
+        def collection_page(request, _context):
+            query = parse_qs(urlparse(request.url).query)
+            (offset, limit) = (int(query['offset'][0]), int(query['limit'][0]))
+
+            return {
+                "description": "Basic Layers for all Datasets",
+                "entryLabel": None,
+                "id": {
+                    "collectionId": "546073b6-d535-4205-b601-99675c9f6dd7",
+                    "providerId": "ac50ed0d-c9a0-41f8-9ce8-35fc9e38299b"
+                },
+                "items": [
+                    {
+                        "description": f"Layer {i}",
+                        "id": {"layerId": f"layer-{i}", "providerId": "ac50ed0d-c9a0-41f8-9ce8-35fc9e38299b"},
+                        "name": f"Layer {i}",
+                        "type": "layer"
+                    }
+                    for i in range(offset, min(offset + limit, 45))
+                ],
+                "name": "Datasets",
+                "properties": []
+            }
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+            collection_matcher = m.get(collection_url, json=collection_page)
+
+            ge.initialize("http://mock-instance")
+
+            collection_id = ge.LayerCollectionId('546073b6-d535-4205-b601-99675c9f6dd7')
+            provider_id = ge.LayerProviderId(UUID('ac50ed0d-c9a0-41f8-9ce8-35fc9e38299b'))
+
+            collection = ge.layer_collection(collection_id, provider_id, page_size=10, max_workers=3)
+
+            self.assertEqual(collection.name, 'Datasets')
+            self.assertEqual([item.listing_id for item in collection.items], [f'layer-{i}' for i in range(45)])
+
+            # the five pages and at most two more that were in flight when the last page arrived
+            self.assertLessEqual(5, collection_matcher.call_count)
+            self.assertLessEqual(collection_matcher.call_count, 7)
+
+            # a single worker pages serially and stops after the last page
+            collection_matcher.reset()
+            collection = ge.layer_collection(collection_id, provider_id, page_size=15, max_workers=1)
+            self.assertEqual(len(collection.items), 45)
+            self.assertEqual(collection_matcher.call_count, 4)
+
+            # the iterator yields items before all pages were requested
+            collection_matcher.reset()
+            items = ge.layer_collection_items(collection_id, provider_id, page_size=10, max_workers=1)
+            self.assertEqual([item.name for item in itertools.islice(items, 12)], [f'Layer {i}' for i in range(12)])
+            self.assertLessEqual(collection_matcher.call_count, 3)
+            items.close()
+
+            with self.assertRaises(ge.InputException):
+                ge.layer_collection(collection_id, provider_id, page_size=0)
+
     def test_layer_collection_modification(self):
         """Test addition and removal to a data collection."""
 
@@ -0,0 +1,104 @@
+'''Tests for resumable uploads against the local stand-in server'''
+
+import os
+import tempfile
+import unittest
+
+import requests
+
+import geoengine as ge
+from geoengine.datasets import UploadId
+from benchmarks.server import StandInServer
+
+PART_SIZE = 1000
+
+
+class ResumableUploadTests(unittest.TestCase):
+    '''Resumable upload test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+
+        self.server = StandInServer()
+        self.server.start()
+        ge.initialize(self.server.url)
+
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.state_directory = os.path.join(self.directory.name, 'state')
+        self.path = os.path.join(self.directory.name, 'data.bin')
+        self.content = os.urandom(5 * PART_SIZE + 123)
+        with open(self.path, 'wb') as file:
+            file.write(self.content)
+
+    def tearDown(self) -> None:
+        ge.reset(False)
+        self.server.stop()
+        self.directory.cleanup()
+
+    def upload(self, max_attempts: int = 4, endpoint: str = ge.datasets.RESUMABLE_UPLOAD_PATH) -> UploadId:
+        '''Upload the test file'''
+        return ge.upload_file_resumable(self.path, part_size=PART_SIZE, state_directory=self.state_directory,
+                                        retry_policy=ge.RetryPolicy(max_attempts, backoff_seconds=0),
+                                        endpoint=endpoint)
+
+    def uploaded_content(self, upload_id: UploadId) -> bytes:
+        '''Return what the server received for an upload'''
+        (_length, content) = self.server.state.resumable_uploads[str(upload_id)]
+        return bytes(content)
+
+    def test_failed_parts_are_resent(self):
+        self.server.state.parts_before_failures = 2
+        self.server.state.dropped_parts = 1
+        self.server.state.corrupted_parts = 2
+
+        upload_id = self.upload()
+
+        self.assertEqual(self.uploaded_content(upload_id), self.content)
+        self.assertEqual(os.listdir(self.state_directory), [])
+
+    def test_interrupted_upload_is_resumed(self):
+        self.server.state.parts_before_failures = 3
+        self.server.state.dropped_parts = 1
+
+        with self.assertRaises(requests.ConnectionError):
+            self.upload(max_attempts=1)
+
+        [state_file] = os.listdir(self.state_directory)
+        with open(os.path.join(self.state_directory, state_file), encoding='utf-8') as file:
+            state = ge.ResumableUploadState.from_json(file.read())
+        self.assertEqual((state.offset, state.size), (3 * PART_SIZE, len(self.content)))
+        self.assertEqual(self.uploaded_content(state.upload_id), self.content[:3 * PART_SIZE])
+
+        upload_id = self.upload()
+
+        self.assertEqual(upload_id, state.upload_id)
+        self.assertEqual(self.uploaded_content(upload_id), self.content)
+        self.assertEqual(len(self.server.state.resumable_uploads), 1)
+
+    def test_expired_upload_starts_over(self):
+        self.server.state.parts_before_failures = 1
+        self.server.state.dropped_parts = 1
+
+        with self.assertRaises(requests.ConnectionError):
+            self.upload(max_attempts=1)
+
+        self.server.state.resumable_uploads.clear()
+
+        upload_id = self.upload()
+
+        self.assertEqual(self.uploaded_content(upload_id), self.content)
+
+    def test_endpoint(self):
+        self.server.state.resumable_upload_path = '/api/uploads/resumable'
+
+        # the server does not support resumable uploads at the default endpoint
+        with self.assertRaises(ge.GeoEngineException):
+            self.upload()
+
+        upload_id = self.upload(endpoint='/api/uploads/resumable')
+
+        self.assertEqual(self.uploaded_content(upload_id), self.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+'''Tests for tile pyramids'''
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+from uuid import UUID
+
+import requests_mock
+from PIL import Image
+
+import geoengine as ge
+from geoengine.tiles import WEB_MERCATOR_EXTENT
+
+
+def tile_image_callback(request, context):
+    '''Render a PNG of the requested size whose color encodes the upper left corner of the requested bbox'''
+
+    query = parse_qs(urlparse(request.url).query)
+    width = int(query['width'][0])
+    height = int(query['height'][0])
+    [xmin, _ymin, _xmax, ymax] = [float(v) for v in query['bbox'][0].split(',')]
+
+    color = (int(xmin / WEB_MERCATOR_EXTENT * 100) + 100, int(ymax / WEB_MERCATOR_EXTENT * 100) + 100, 0)
+
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+
+    context.headers['Content-Type'] = 'image/png'
+    return buffer.getvalue()
+
+
+class TileTests(unittest.TestCase):
+    '''Tile pyramid test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+        ge.disable_result_cache()
+
+    def tearDown(self) -> None:
+        ge.disable_result_cache()
+
+    def test_grid(self):
+        grid = ge.WEB_MERCATOR
+
+        self.assertEqual(grid.shape(3), (8, 8))
+        self.assertEqual(
+            grid.tile_bounds(ge.Tile(1, 0, 0)).as_bbox_tuple(),
+            (-WEB_MERCATOR_EXTENT, 0.0, 0.0, WEB_MERCATOR_EXTENT)
+        )
+        self.assertEqual(ge.Tile(2, 1, 0).tms_y, 3)
+
+        with self.assertRaises(ge.InputException):
+            grid.tile_bounds(ge.Tile(1, 2, 0))
+
+        # bounds on tile edges do not include the neighbors
+        self.assertEqual(
+            grid.tiles(ge.BoundingBox2D(0.0, 0.0, WEB_MERCATOR_EXTENT, WEB_MERCATOR_EXTENT), [0, 1, 2]),
+            [ge.Tile(0, 0, 0), ge.Tile(1, 1, 0),
+             ge.Tile(2, 2, 0), ge.Tile(2, 3, 0), ge.Tile(2, 2, 1), ge.Tile(2, 3, 1)]
+        )
+
+        # bounds outside of the grid are clipped
+        self.assertEqual(len(grid.tiles(ge.BoundingBox2D(-1e9, -1e9, 1e9, 1e9), [3])), 64)
+
+        quad = ge.WORLD_CRS84_QUAD
+        self.assertEqual(quad.shape(0), (1, 2))
+        self.assertEqual(quad.tile_bounds(ge.Tile(1, 3, 1)).as_bbox_tuple(), (90.0, -90.0, 180.0, 0.0))
+
+    def test_tiles(self):  # pylint: disable=too-many-locals
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/5b9508a8-bd34-5a1c-acd6-75bb832d2d38/metadata',
+                  json={
+                      "type": "raster",
+                      "dataType": "U8",
+                      "spatialReference": "EPSG:3857",
+                      "measurement": {
+                              "type": "unitless"
+                      }
+                  })
+
+            wms_matcher = m.get('http://mock-instance/wms/5b9508a8-bd34-5a1c-acd6-75bb832d2d38',
+                                content=tile_image_callback)
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id(UUID('5b9508a8-bd34-5a1c-acd6-75bb832d2d38'))
+
+            time = ge.TimeInterval(datetime(2014, 4, 1, 12, tzinfo=timezone.utc))
+            colorizer = ge.Colorizer.linear_with_mpl_cmap(map_name="gray", min_max=(0, 255), n_steps=2)
+            bounds = ge.BoundingBox2D(-WEB_MERCATOR_EXTENT, -WEB_MERCATOR_EXTENT, 0.0, WEB_MERCATOR_EXTENT)
+
+            tiles = list(workflow.wms_get_tiles(bounds, time, colorizer, range(0, 3), max_workers=3))
+
+            self.assertEqual(
+                [tile for (tile, _image) in tiles],
+                [ge.Tile(0, 0, 0), ge.Tile(1, 0, 0), ge.Tile(1, 0, 1),
+                 *[ge.Tile(2, x, y) for y in range(4) for x in range(2)]]
+            )
+
+            for (tile, image) in tiles:
+                # the size does not suffer from rounding errors of the resolution
+                self.assertEqual(image.size, (256, 256))
+
+                bbox = ge.WEB_MERCATOR.tile_bounds(tile)
+                expected_color = (
+                    int(bbox.xmin / WEB_MERCATOR_EXTENT * 100) + 100,
+                    int(bbox.ymax / WEB_MERCATOR_EXTENT * 100) + 100,
+                    0,
+                )
+                self.assertEqual(image.getpixel((0, 0)), expected_color)
+
+            request = wms_matcher.last_request
+            self.assertEqual(request.qs['crs'], ['epsg:3857'])
+            self.assertEqual(request.qs['request'], ['getmap'])
+
+            # tiles are cached by index, time and colorizer
+            cache = ge.enable_result_cache(os.path.join(directory, 'cache'))
+            m.reset_mock()
+
+            mbtiles_path = os.path.join(directory, 'pyramid.mbtiles')
+            self.assertEqual(workflow.wms_download_tiles(mbtiles_path, bounds, time, colorizer, [1, 2]), 10)
+            self.assertEqual(wms_matcher.call_count, 10)
+
+            png_path = os.path.join(directory, 'pyramid')
+            self.assertEqual(workflow.wms_download_tiles(png_path, bounds, time, colorizer, [1, 2]), 10)
+            self.assertEqual(wms_matcher.call_count, 10)
+            self.assertEqual(cache.stats.hits, 10)
+
+            other_colorizer = ge.Colorizer.linear_with_mpl_cmap(map_name="gray", min_max=(0, 100), n_steps=2)
+            list(workflow.wms_get_tiles(bounds, time, other_colorizer, [1]))
+            self.assertEqual(wms_matcher.call_count, 12)
+
+            # MBTiles count rows from the bottom
+            with sqlite3.connect(mbtiles_path) as connection:
+                rows = connection.execute(
+                    'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level, tile_row'
+                ).fetchall()
+                metadata = dict(connection.execute('SELECT name, value FROM metadata').fetchall())
+            connection.close()
+
+            self.assertEqual([row[:3] for row in rows[:2]], [(1, 0, 0), (1, 0, 1)])
+            self.assertEqual(metadata['minzoom'], '1')
+            self.assertEqual(metadata['maxzoom'], '2')
+            self.assertEqual(metadata['format'], 'png')
+            self.assertEqual(metadata['bounds'], '-180.0,-85.051129,0.0,85.051129')
+
+            with open(os.path.join(png_path, '1', '0', '1.png'), 'rb') as file:
+                self.assertEqual(file.read(), rows[0][3])
+
+
+if __name__ == '__main__':
+    unittest.main()
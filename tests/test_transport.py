@@ -0,0 +1,148 @@
+'''Tests for the HTTP transport'''
+
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest import mock
+from uuid import UUID
+
+import requests
+import requests_mock
+
+import geoengine as ge
+from geoengine.transport import parse_retry_after
+
+METADATA_URL = 'http://mock-instance/workflow/8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62/metadata'
+
+RESULT_DESCRIPTOR = {
+    "type": "raster",
+    "dataType": "U8",
+    "spatialReference": "EPSG:4326",
+    "measurement": {
+        "type": "unitless"
+    }
+}
+
+
+class RetryTests(unittest.TestCase):
+    '''Retry policy test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+
+    def initialize(self, m, retry_policy):
+        '''Create an anonymous session and record its retries'''
+        m.post('http://mock-instance/anonymous', json={
+            "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+            "project": None,
+            "view": None
+        })
+
+        ge.initialize("http://mock-instance", retry_policy=retry_policy)
+
+        events = []
+        ge.get_session().requests_session.retry_hooks.append(events.append)
+        return events
+
+    @mock.patch('geoengine.transport.time.sleep')
+    def test_transient_errors(self, sleep):
+        with requests_mock.Mocker() as m:
+            events = self.initialize(m, ge.RetryPolicy(backoff_seconds=1.0))
+
+            metadata_matcher = m.get(METADATA_URL, [
+                {'status_code': 503, 'json': {'error': 'Unavailable', 'message': 'proxy'}},
+                {'exc': requests.ConnectionError('connection reset')},
+                {'status_code': 502, 'text': 'bad gateway', 'headers': {'Retry-After': '7'}},
+                {'json': RESULT_DESCRIPTOR},
+            ])
+
+            workflow = ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62'))
+
+            self.assertTrue(workflow.get_result_descriptor().is_raster_result())
+            self.assertEqual(metadata_matcher.call_count, 4)
+
+            self.assertEqual([event.attempt for event in events], [1, 2, 3])
+            self.assertEqual([event.status_code for event in events], [503, None, 502])
+            self.assertIsInstance(events[1].error, requests.ConnectionError)
+
+            # jittered backoff doubles and the `Retry-After` of the server wins
+            self.assertTrue(0.0 <= events[0].delay_seconds <= 1.0)
+            self.assertTrue(0.0 <= events[1].delay_seconds <= 2.0)
+            self.assertEqual(events[2].delay_seconds, 7.0)
+            self.assertEqual([call.args[0] for call in sleep.call_args_list],
+                             [event.delay_seconds for event in events])
+
+    @mock.patch('geoengine.transport.time.sleep')
+    def test_give_up(self, sleep):
+        with requests_mock.Mocker() as m:
+            events = self.initialize(m, ge.RetryPolicy(max_attempts=3, max_retry_after_seconds=60))
+
+            metadata_matcher = m.get(METADATA_URL, status_code=504,
+                                     json={'error': 'Timeout', 'message': 'gateway timeout'})
+
+            with self.assertRaises(ge.GeoEngineException):
+                ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62')).get_result_descriptor()
+
+            self.assertEqual(metadata_matcher.call_count, 3)
+            self.assertEqual(len(events), 2)
+
+            # a `Retry-After` beyond the limit is not waited for
+            m.get(METADATA_URL, status_code=503, headers={'Retry-After': '600'})
+
+            with self.assertRaises(requests.HTTPError):
+                ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62')).get_result_descriptor()
+
+            self.assertEqual(len(events), 2)
+
+            # other errors are not retried
+            m.get(METADATA_URL, status_code=500, json={'error': 'Operator', 'message': 'failed'})
+
+            with self.assertRaises(ge.GeoEngineException):
+                ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62')).get_result_descriptor()
+
+            self.assertEqual(len(events), 2)
+            self.assertEqual(sleep.call_count, 2)
+
+    @mock.patch('geoengine.transport.time.sleep')
+    def test_non_idempotent(self, sleep):
+        with requests_mock.Mocker() as m:
+            events = self.initialize(m, ge.RetryPolicy())
+
+            workflow_matcher = m.post('http://mock-instance/workflow', status_code=503,
+                                      json={'error': 'Unavailable', 'message': 'proxy'})
+
+            with self.assertRaises(TypeError):
+                ge.register_workflow({"type": "Raster", "operator": {"type": "GdalSource", "params": {}}})
+
+            self.assertEqual(workflow_matcher.call_count, 1)
+            self.assertEqual(events, [])
+            sleep.assert_not_called()
+
+            # retries are disabled without a policy
+            ge.get_session().retry_policy = None
+            metadata_matcher = m.get(METADATA_URL, status_code=503)
+
+            with self.assertRaises(requests.HTTPError):
+                ge.workflow_by_id(UUID('8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62')).get_result_descriptor()
+
+            self.assertEqual(metadata_matcher.call_count, 1)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True)), 30.0, delta=2.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            ge.RetryPolicy(max_attempts=0)
+
+        with self.assertRaises(ValueError):
+            ge.RetryPolicy(backoff_seconds=-1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
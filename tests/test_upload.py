@@ -1,12 +1,16 @@
 '''Tests regarding upload functionality'''
 
+import gzip
+import json
 import unittest
+from email.parser import BytesParser
 import requests_mock
 import pandas as pd
 import geopandas
 
 import geoengine as ge
-from geoengine.datasets import DatasetId, OgrSourceDatasetTimeType, OgrSourceDuration, OgrSourceTimeFormat
+from geoengine.datasets import DatasetId, OgrSourceDatasetTimeType, OgrSourceDuration, OgrSourceTimeFormat, \
+    geojson_chunks
 from geoengine.types import TimeStepGranularity
 
 
@@ -58,6 +62,96 @@ class UploadTests(unittest.TestCase):
 
             self.assertEqual(dataset_id, DatasetId("fc5f9e0f-ac97-421f-a5be-d701915ceb6f"))
 
+    def test_streaming_upload(self):
+        uploads = []
+
+        def upload(request, _context):
+            body = b''.join(request.body)
+            if request.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+
+            headers = f'Content-Type: {request.headers["Content-Type"]}\r\n\r\n'.encode()
+            [part] = BytesParser().parsebytes(headers + body).get_payload()
+            uploads.append((part.get_filename(), json.loads(part.get_payload(decode=True))))
+
+            return {"id": "c314ff6d-3e37-41b4-b9b2-3669f13f7369"}
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+            upload_matcher = m.post('http://mock-instance/upload', json=upload)
+            dataset_matcher = m.post('http://mock-instance/dataset', json={
+                'id': 'fc5f9e0f-ac97-421f-a5be-d701915ceb6f'
+            })
+
+            ge.initialize("http://mock-instance")
+
+            gdf = geopandas.GeoDataFrame(
+                pd.DataFrame({'label': ['NA', 'DE', 'FR'], 'index': [0, 1, 2], 'rnd': [34.34, 567.547, None]}),
+                geometry=geopandas.points_from_xy([1.0, 2.0, 3.0], [4.0, 5.0, 6.0]),
+                crs="EPSG:4326"
+            )
+
+            self.assertEqual(b''.join(geojson_chunks(gdf, 2)), gdf.to_json().encode())
+
+            ge.upload_dataframe(gdf, chunk_rows=2)
+            self.assertEqual(upload_matcher.last_request.headers['Transfer-Encoding'], 'chunked')
+            metadata = dataset_matcher.last_request.json()
+
+            ge.upload_dataframe(gdf, chunk_rows=1, compress=True)
+            self.assertEqual(dataset_matcher.last_request.json(), metadata)
+
+            self.assertEqual(uploads, [('geo.json', json.loads(gdf.to_json()))] * 2)
+            self.assertEqual(metadata['definition']['metaData']['loadingInfo']['fileName'], 'geo.json')
+
+            with self.assertRaises(ge.InputException):
+                ge.upload_dataframe(gdf, chunk_rows=0)
+
+    def test_upload_dataframes(self):
+        def create_dataset(request, context):
+            name = request.json()['definition']['properties']['name']
+            if name == 'broken':
+                context.status_code = 400
+                return {'error': 'Operator', 'message': 'broken'}
+            return {'id': f'fc5f9e0f-ac97-421f-a5be-d701915ceb6{name}'}
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "c4983c3e-9b53-47ae-bda9-382223bd5081",
+                "project": None,
+                "view": None
+            })
+            upload_matcher = m.post('http://mock-instance/upload', json={"id": "c314ff6d-3e37-41b4-b9b2-3669f13f7369"})
+            m.post('http://mock-instance/dataset', json=create_dataset)
+
+            ge.initialize("http://mock-instance")
+
+            gdf = geopandas.GeoDataFrame(
+                pd.DataFrame({'label': ['NA', 'DE'], 'index': [0, 1]}),
+                geometry=geopandas.points_from_xy([1.0, 2.0], [4.0, 5.0]),
+                crs="EPSG:4326"
+            )
+
+            for serialization_workers in [0, 2]:
+                results = ge.upload_dataframes([gdf, gdf.iloc[:0], gdf, gdf], names=['0', 'empty', 'broken', '3'],
+                                               upload_workers=2, serialization_workers=serialization_workers)
+
+                self.assertEqual([result.dataset_id for result in results], [
+                    DatasetId('fc5f9e0f-ac97-421f-a5be-d701915ceb60'), None, None,
+                    DatasetId('fc5f9e0f-ac97-421f-a5be-d701915ceb63'),
+                ])
+                self.assertEqual([result.ok for result in results], [True, False, False, True])
+                self.assertIsInstance(results[1].error, ge.InputException)
+                self.assertIsInstance(results[2].error, ge.GeoEngineException)
+
+            self.assertEqual(upload_matcher.call_count, 6)
+
+            with self.assertRaises(ge.InputException):
+                ge.upload_dataframes([gdf], names=['a', 'b'])
+
     def test_time_specification(self):
         time = OgrSourceDatasetTimeType.start(
             'start', OgrSourceTimeFormat.auto(), OgrSourceDuration.value(10, TimeStepGranularity.MINUTES))
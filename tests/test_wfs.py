@@ -1,13 +1,20 @@
+# pylint: disable=too-many-lines
+
 '''Test for WFS calls'''
 
 from datetime import datetime
+from io import BytesIO
+import json
+import tempfile
 import textwrap
 import unittest
+from urllib.parse import parse_qs, urlparse
 from numpy import nan
 import requests_mock
 import geopandas as gpd
 import geopandas.testing  # pylint: disable=unused-import
-from shapely.geometry import Point
+import pyarrow as pa
+from shapely.geometry import LineString, Point, box, mapping, shape
 from pkg_resources import get_distribution
 import geoengine as ge
 
@@ -308,7 +315,7 @@ class WfsTests(unittest.TestCase):
                              "http://mock-instance/workflow")
             self.assertEqual(workflow_request.json(), workflow_definition)
 
-            # note: the result descriptor is retrieved upon workflow registration (constructor),
+            # note: the result descriptor is retrieved when the workflow is first used,
             # thus the actual WFS request is in the 4th history slot
 
             wfs_request = m.request_history[3]
@@ -348,6 +355,442 @@ class WfsTests(unittest.TestCase):
 
             gpd.testing.assert_geodataframe_equal(df, expected_df)
 
+    def test_dataframe_batches(self):
+        def feature(name, geometry):
+            return {
+                "type": "Feature",
+                "geometry": mapping(geometry),
+                "properties": {"name": name},
+                "when": {
+                    "start": "2014-04-01T00:00:00+00:00",
+                    "end": "2014-05-01T00:00:00+00:00",
+                    "type": "Interval"
+                }
+            }
+
+        features = [
+            feature("north west", Point(-100.0, 45.0)),
+            feature("north east", Point(100.0, 45.0)),
+            feature("south east", Point(100.0, -45.0)),
+            feature("center", Point(0.0, 0.0)),
+            feature("equator", LineString([(-120.0, 0.0), (120.0, 0.0)])),
+            feature("diagonal", LineString([(-170.0, -80.0), (170.0, 80.0)])),
+            feature("beyond", LineString([(200.0, 50.0), (170.0, 50.0)])),
+            # identical features are distinct results
+            feature("twin", LineString([(-10.0, 10.0), (10.0, 10.0)])),
+            feature("twin", LineString([(-10.0, 10.0), (10.0, 10.0)])),
+        ]
+
+        def wfs_callback(request, _context):
+            [xmin, ymin, xmax, ymax] = [float(v) for v in parse_qs(urlparse(request.url).query)['bbox'][0].split(',')]
+            cell = box(xmin, ymin, xmax, ymax)
+            return {
+                "type": "FeatureCollection",
+                "features": [f for f in features if shape(f['geometry']).intersects(cell)],
+            }
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/956d3656-2d14-5951-96a0-f962b92371cd/metadata',
+                  json={
+                      "type": "vector",
+                      "dataType": "MultiPoint",
+                      "spatialReference": "EPSG:4326",
+                      "columns": {
+                          "name": {
+                              "dataType": "text",
+                              "measurement": {
+                                  "type": "unitless"
+                              },
+                          },
+                      },
+                  })
+
+            wfs_matcher = m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd', json=wfs_callback)
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id('956d3656-2d14-5951-96a0-f962b92371cd')
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime.strptime('2014-04-01T12:00:00.000Z', "%Y-%m-%dT%H:%M:%S.%f%z")),
+                ge.SpatialResolution(0.1, 0.1)
+            )
+
+            batches = workflow.get_dataframe_batches(query, grid_shape=(2, 2))
+
+            # nothing is requested before the iterator is consumed
+            self.assertEqual(wfs_matcher.call_count, 0)
+
+            batch_list = list(batches)
+
+            self.assertEqual(wfs_matcher.call_count, 4)
+            self.assertEqual([len(batch) for batch in batch_list], [4, 3, 1, 1])
+            self.assertEqual(sum(batch['name'].tolist().count('twin') for batch in batch_list), 2)
+            self.assertTrue(all(batch.crs == "EPSG:4326" for batch in batch_list))
+
+            streamed = gpd.pd.concat(batch_list).sort_values('name').reset_index(drop=True)
+            complete = workflow.get_dataframe(query).sort_values('name').reset_index(drop=True)
+
+            gpd.testing.assert_geodataframe_equal(streamed, complete)
+
+    def test_time_sentinels(self):
+        def feature(name, geometry, start, end):
+            return {
+                "type": "Feature",
+                "geometry": mapping(geometry),
+                "properties": {"name": name},
+                "when": {"start": start, "end": end, "type": "Interval"}
+            }
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/956d3656-2d14-5951-96a0-f962b92371cd/metadata',
+                  json={
+                      "type": "vector",
+                      "dataType": "Data",
+                      "spatialReference": "EPSG:4326",
+                      "columns": {},
+                  })
+
+            m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd', json={
+                "type": "FeatureCollection",
+                "features": [
+                    feature("bounded", Point(1.0, 2.0), "2014-04-01T00:00:00+00:00", "2014-05-01T00:00:00+00:00"),
+                    feature("forever", LineString([(0.0, 0.0), (1.0, 1.0)]),
+                            "-262144-01-01T00:00:00+00:00", "+262143-12-31T23:59:59.999+00:00"),
+                    feature("invalid", Point(3.0, 4.0), "foobar", "2014-05-01T00:00:00+00:00"),
+                ],
+            })
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id('956d3656-2d14-5951-96a0-f962b92371cd')
+
+            df = workflow.get_dataframe(ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime.strptime('2014-04-01T12:00:00.000Z', "%Y-%m-%dT%H:%M:%S.%f%z")),
+                ge.SpatialResolution(0.1, 0.1)
+            ))
+
+            self.assertEqual(list(df.columns), ['geometry', 'name', 'start', 'end'])
+            self.assertEqual(
+                list(df.geometry),
+                [Point(1.0, 2.0), LineString([(0.0, 0.0), (1.0, 1.0)]), Point(3.0, 4.0)]
+            )
+            self.assertEqual(str(df['start'].dtype), 'datetime64[ns, UTC]')
+
+            self.assertEqual(df['start'][0], gpd.pd.Timestamp('2014-04-01T00:00:00Z'))
+            self.assertEqual(df['start'][1], gpd.pd.Timestamp.min.tz_localize('UTC'))
+            self.assertEqual(df['end'][1], gpd.pd.Timestamp.max.tz_localize('UTC'))
+            self.assertTrue(gpd.pd.isna(df['start'][2]))
+
+    def test_3d_points(self):
+        def feature(geometry):
+            return {
+                "type": "Feature",
+                "geometry": mapping(geometry),
+                "properties": {},
+                "when": {"start": "2014-04-01T00:00:00+00:00", "end": "2014-05-01T00:00:00+00:00", "type": "Interval"}
+            }
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/956d3656-2d14-5951-96a0-f962b92371cd/metadata',
+                  json={
+                      "type": "vector",
+                      "dataType": "MultiPoint",
+                      "spatialReference": "EPSG:4326",
+                      "columns": {},
+                  })
+
+            m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd', [
+                {'json': {"type": "FeatureCollection", "features": [feature(Point(1.0, 2.0, 3.0))]}},
+                {'json': {
+                    "type": "FeatureCollection",
+                    "features": [feature(Point(1.0, 2.0)), feature(Point(3.0, 4.0, 5.0))],
+                }},
+            ])
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id('956d3656-2d14-5951-96a0-f962b92371cd')
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime.strptime('2014-04-01T12:00:00.000Z', "%Y-%m-%dT%H:%M:%S.%f%z")),
+                ge.SpatialResolution(0.1, 0.1)
+            )
+
+            # the Z coordinate is kept
+            df = workflow.get_dataframe(query)
+            self.assertEqual(list(df.geometry), [Point(1.0, 2.0, 3.0)])
+            self.assertEqual(list(df.geometry.has_z), [True])
+
+            df = workflow.get_dataframe(query)
+            self.assertEqual(list(df.geometry), [Point(1.0, 2.0), Point(3.0, 4.0, 5.0)])
+            self.assertEqual(list(df.geometry.has_z), [False, True])
+
+    def test_binary_formats(self):  # pylint: disable=too-many-locals
+        geometries = [Point(1.0, 2.0), LineString([(0.0, 0.0), (1.0, 1.0)])]
+        start = ["2014-04-01T00:00:00+00:00", "-262144-01-01T00:00:00+00:00"]
+        end = ["2014-05-01T00:00:00+00:00", "+262143-12-31T23:59:59.999+00:00"]
+
+        geo_json = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": mapping(geometry),
+                    "properties": {"name": name, "value": value},
+                    "when": {"start": s, "end": e, "type": "Interval"}
+                }
+                for (geometry, name, value, s, e) in zip(geometries, ["a", "b"], [1.5, 2.5], start, end)
+            ],
+        }
+
+        # GeoParquet with time strings
+        parquet = BytesIO()
+        gpd.GeoDataFrame(
+            {"name": ["a", "b"], "value": [1.5, 2.5], "start": start, "end": end},
+            geometry=geometries,
+            crs="EPSG:4326",
+        ).to_parquet(parquet)
+
+        # Arrow IPC stream with WKB geometries and millisecond timestamps, including begin and end of time
+        arrow = pa.BufferOutputStream()
+        table = pa.table({
+            "geometry": [geometry.wkb for geometry in geometries],
+            "name": ["a", "b"],
+            "value": [1.5, 2.5],
+            "start": pa.array([1396310400000, -8334632851200001], type=pa.timestamp('ms', tz='UTC')),
+            "end": pa.array([1398902400000, 8210298412799999], type=pa.timestamp('ms', tz='UTC')),
+        })
+        with pa.ipc.new_stream(arrow, table.schema) as writer:
+            writer.write_table(table)
+
+        encodings = {
+            'application/json': None,
+            'application/vnd.apache.parquet': parquet.getvalue(),
+            'application/vnd.apache.arrow.stream': arrow.getvalue().to_pybytes(),
+        }
+
+        def wfs_callback(request, context):
+            output_format = parse_qs(urlparse(request.url).query)['outputFormat'][0]
+            if encodings[output_format] is None:
+                context.headers['Content-Type'] = 'application/json'
+                return json.dumps(geo_json).encode()
+            context.headers['Content-Type'] = output_format
+            return encodings[output_format]
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/956d3656-2d14-5951-96a0-f962b92371cd/metadata',
+                  json={
+                      "type": "vector",
+                      "dataType": "Data",
+                      "spatialReference": "EPSG:4326",
+                      "columns": {},
+                  })
+
+            wfs_matcher = m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd', content=wfs_callback)
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id('956d3656-2d14-5951-96a0-f962b92371cd')
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime.strptime('2014-04-01T12:00:00.000Z', "%Y-%m-%dT%H:%M:%S.%f%z")),
+                ge.SpatialResolution(0.1, 0.1)
+            )
+
+            expected = workflow.get_dataframe(query)
+
+            self.assertEqual(expected['start'][1], gpd.pd.Timestamp.min.tz_localize('UTC'))
+
+            for output_format in [ge.VectorResultFormat.GEOPARQUET, ge.VectorResultFormat.ARROW]:
+                df = workflow.get_dataframe(query, output_format=output_format)
+
+                self.assertEqual(
+                    parse_qs(urlparse(wfs_matcher.last_request.url).query)['outputFormat'], [output_format.value]
+                )
+
+                gpd.testing.assert_geodataframe_equal(df, expected, check_less_precise=True)
+
+            table = workflow.get_arrow_table(query)
+            self.assertEqual(table.column_names, ["geometry", "name", "value", "start", "end"])
+            self.assertEqual(json.loads(table.schema.metadata[b'geo'])['primary_column'], 'geometry')
+
+            # the server cannot produce binary formats
+            encodings['application/vnd.apache.arrow.stream'] = None
+            m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd', [
+                {'status_code': 400, 'json': {'error': 'UnknownOutputFormat', 'message': 'Unknown output format'}},
+                {'content': wfs_callback},
+                {'status_code': 400, 'json': {'error': 'UnknownOutputFormat', 'message': 'Unknown output format'}},
+                {'content': wfs_callback},
+            ])
+
+            df = workflow.get_dataframe(query, output_format=ge.VectorResultFormat.ARROW)
+            gpd.testing.assert_geodataframe_equal(df, expected)
+
+            table = workflow.get_arrow_table(query)
+            gpd.testing.assert_geodataframe_equal(
+                gpd.GeoDataFrame(
+                    table.drop(["geometry"]).to_pandas(),
+                    geometry=gpd.GeoSeries.from_wkb(table.column("geometry").to_pandas()),
+                    crs="EPSG:4326",
+                )[expected.columns],
+                expected
+            )
+
+    def test_binary_format_fallback(self):
+        geo_json = {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": mapping(Point(1.0, 2.0)),
+                "properties": {"name": "a"},
+                "when": {"start": "2014-04-01T00:00:00+00:00", "end": "2014-05-01T00:00:00+00:00", "type": "Interval"}
+            }],
+        }
+
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            m.get('http://mock-instance/workflow/956d3656-2d14-5951-96a0-f962b92371cd/metadata',
+                  json={
+                      "type": "vector",
+                      "dataType": "MultiPoint",
+                      "spatialReference": "EPSG:4326",
+                      "columns": {},
+                  })
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id('956d3656-2d14-5951-96a0-f962b92371cd')
+
+            query = ge.QueryRectangle(
+                ge.BoundingBox2D(-180.0, -90.0, 180.0, 90.0),
+                ge.TimeInterval(datetime.strptime('2014-04-01T12:00:00.000Z', "%Y-%m-%dT%H:%M:%S.%f%z")),
+                ge.SpatialResolution(0.1, 0.1)
+            )
+
+            # statuses that reject the format fall back to GeoJSON
+            for response in [
+                {'status_code': 400, 'json': {'error': 'UnknownOutputFormat', 'message': 'Unknown output format'}},
+                {'status_code': 406},
+                {'status_code': 415},
+                {'status_code': 501},
+            ]:
+                wfs_matcher = m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd',
+                                    [response, {'json': geo_json}])
+
+                df = workflow.get_dataframe(query, output_format=ge.VectorResultFormat.ARROW)
+
+                self.assertEqual(list(df['name']), ['a'])
+                self.assertEqual(wfs_matcher.call_count, 2)
+
+            # other errors are raised
+            m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd', [
+                {'status_code': 400, 'json': {'error': 'Operator', 'message': 'Could not open gdal dataset'}},
+                {'status_code': 401, 'json': {'error': 'Unauthorized', 'message': 'Invalid session'}},
+                {'status_code': 404, 'json': {'error': 'NotFound', 'message': 'Unknown workflow'}},
+            ])
+
+            for _ in range(3):
+                with self.assertRaises(ge.GeoEngineException):
+                    workflow.get_dataframe(query, output_format=ge.VectorResultFormat.ARROW)
+
+            # a GeoJSON result of a server that ignores the format is cached
+            ge.enable_result_cache(directory)
+
+            wfs_matcher = m.get('http://mock-instance/wfs/956d3656-2d14-5951-96a0-f962b92371cd',
+                                json=geo_json, headers={'Content-Type': 'application/json'})
+
+            for output_format in [ge.VectorResultFormat.ARROW, ge.VectorResultFormat.ARROW,
+                                  ge.VectorResultFormat.GEOJSON]:
+                df = workflow.get_dataframe(query, output_format=output_format)
+                self.assertEqual(list(df['name']), ['a'])
+
+            self.assertEqual(wfs_matcher.call_count, 1)
+
+            ge.disable_result_cache()
+
+    def test_lazy_result_descriptor(self):
+        workflow_ids = [
+            '956d3656-2d14-5951-96a0-f962b92371cd',
+            '8df9b0e6-e4b4-586e-90a3-6cf0f08c4e62',
+            'c4983c3e-9b53-47ae-bda9-382223bd5081',
+        ]
+
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+
+            metadata_matchers = [
+                m.get(f'http://mock-instance/workflow/{workflow_id}/metadata',
+                      json={
+                          "type": "vector",
+                          "dataType": "MultiPoint",
+                          "spatialReference": "EPSG:4326",
+                          "columns": {},
+                      })
+                for workflow_id in workflow_ids
+            ]
+
+            ge.initialize("http://mock-instance")
+
+            workflow = ge.workflow_by_id(workflow_ids[0])
+            self.assertEqual(metadata_matchers[0].call_count, 0)
+
+            self.assertTrue(workflow.get_result_descriptor().is_vector_result())
+            self.assertTrue(ge.workflow_by_id(workflow_ids[0]).get_result_descriptor().is_vector_result())
+            self.assertEqual(metadata_matchers[0].call_count, 1)
+
+            workflows = [ge.workflow_by_id(workflow_id) for workflow_id in workflow_ids]
+            result_descriptors = ge.resolve_result_descriptors(workflows, max_workers=2)
+
+            self.assertEqual(len(result_descriptors), 3)
+            self.assertEqual([matcher.call_count for matcher in metadata_matchers], [1, 1, 1])
+
+            for workflow in workflows:
+                workflow.get_result_descriptor()
+            self.assertEqual([matcher.call_count for matcher in metadata_matchers], [1, 1, 1])
+
+            # a new session queries again
+            ge.initialize("http://mock-instance")
+            ge.workflow_by_id(workflow_ids[0]).get_result_descriptor()
+            self.assertEqual(metadata_matchers[0].call_count, 2)
+
     def test_wfs_curl(self):
         with requests_mock.Mocker() as m:
             m.post('http://mock-instance/anonymous', json={
@@ -0,0 +1,127 @@
+'''Tests for the deduplication of workflow registrations'''
+
+import json
+import os
+import tempfile
+import unittest
+from uuid import UUID, uuid5
+import requests_mock
+import geoengine as ge
+from geoengine.workflow_registry import canonicalize_workflow, workflow_hash
+
+
+def workflow_definition(value: float):
+    return {
+        "type": "Vector",
+        "operator": {
+            "type": "MockPointSource",
+            "params": {
+                "points": [{"x": value, "y": 2.0}]
+            }
+        }
+    }
+
+
+def register_callback(request, _context):
+    '''Derive the id from the content like Geo Engine does'''
+    return {"id": str(uuid5(UUID(int=0), canonicalize_workflow(request.json())))}
+
+
+class WorkflowRegistryTests(unittest.TestCase):
+    '''Workflow registry test runner'''
+
+    def setUp(self) -> None:
+        ge.reset(False)
+        ge.set_workflow_store(None)
+
+    def tearDown(self) -> None:
+        ge.set_workflow_store(None)
+
+    def test_canonicalize(self):
+        self.assertEqual(
+            canonicalize_workflow({"b": [1.0, {"d": 2, "c": 0.5}], "a": "x"}),
+            '{"a":"x","b":[1,{"c":0.5,"d":2}]}'
+        )
+        self.assertEqual(
+            workflow_hash(json.loads('{"operator": {"params": {"y": 2, "x": 1}}, "type": "Vector"}')),
+            workflow_hash({"type": "Vector", "operator": {"params": {"x": 1.0, "y": 2.0}}})
+        )
+        self.assertNotEqual(workflow_hash(workflow_definition(1.0)), workflow_hash(workflow_definition(1.5)))
+
+    def test_register_workflow(self):
+        with requests_mock.Mocker() as m:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+            register_matcher = m.post('http://mock-instance/workflow', json=register_callback)
+
+            ge.initialize("http://mock-instance")
+
+            first = ge.register_workflow(workflow_definition(1.0))
+            second = ge.register_workflow(json.loads(json.dumps(workflow_definition(1))))
+
+            self.assertEqual(register_matcher.call_count, 1)
+            self.assertEqual(str(first), str(second))
+
+            ge.register_workflow(workflow_definition(1.0), deduplicate=False)
+            self.assertEqual(register_matcher.call_count, 2)
+
+            workflows = ge.register_workflows(
+                [workflow_definition(value) for value in [1.0, 2.0, 3.0, 2.0, 1.0, 4.0]],
+                max_workers=3
+            )
+
+            # only 2.0, 3.0 and 4.0 are unseen
+            self.assertEqual(register_matcher.call_count, 2 + 3)
+            self.assertEqual(
+                [str(workflow) for workflow in workflows],
+                [str(ge.register_workflow(workflow_definition(value))) for value in [1.0, 2.0, 3.0, 2.0, 1.0, 4.0]]
+            )
+            self.assertEqual(register_matcher.call_count, 2 + 3)
+            self.assertEqual(len(ge.get_workflow_registry()), 4)
+
+            # a new session does not know the workflows
+            ge.initialize("http://mock-instance")
+            ge.register_workflow(workflow_definition(1.0))
+            self.assertEqual(register_matcher.call_count, 2 + 3 + 1)
+
+    def test_persistent_store(self):
+        with requests_mock.Mocker() as m, tempfile.TemporaryDirectory() as directory:
+            m.post('http://mock-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+            m.post('http://other-instance/anonymous', json={
+                "id": "e327d9c3-a4f3-4bd7-a5e1-30b26cae8064",
+                "project": None,
+                "view": None
+            })
+            register_matcher = m.post('http://mock-instance/workflow', json=register_callback)
+            other_register_matcher = m.post('http://other-instance/workflow', json=register_callback)
+
+            store_path = os.path.join(directory, 'workflows.sqlite')
+
+            ge.set_workflow_store(store_path)
+            ge.initialize("http://mock-instance")
+            workflow = ge.register_workflow(workflow_definition(1.0))
+
+            # the store outlives the registry object and the session
+            ge.set_workflow_store(store_path)
+            ge.initialize("http://mock-instance")
+            self.assertEqual(str(ge.register_workflow(workflow_definition(1.0))), str(workflow))
+            self.assertEqual(register_matcher.call_count, 1)
+
+            # workflows are registered per server
+            ge.initialize("http://other-instance")
+            ge.register_workflow(workflow_definition(1.0))
+            self.assertEqual(other_register_matcher.call_count, 1)
+
+            ge.get_workflow_registry().clear()
+            self.assertEqual(len(ge.get_workflow_registry()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()